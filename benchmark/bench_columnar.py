@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Write throughput, file size and lookup time of SummarySoup.save with the
+per-article 'groups' layout versus the 'columns' layout.
+
+    python benchmark/bench_columnar.py [n_articles]
+
+Only the save calls are timed; the efetch batches are parsed beforehand.
+"""
+import tempfile
+import warnings
+import random
+import time
+import sys
+import os
+
+import h5py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                '..', 'pubmed_scraping'))
+import query
+import soups
+import storage
+import synthetic
+
+
+def main(n=10000): 
+    warnings.simplefilter('ignore')
+    corpus = synthetic.SyntheticCorpus(n)
+    batches = [soups.SummarySoup(corpus.efetch(corpus.uids(
+                       start, query.SUMMARY_RETMAX)).decode('utf-8'))
+               for start in range(0, n, query.SUMMARY_RETMAX)]
+    n_records = sum(len(list(soup.records())) for soup in batches)
+    pmids = random.Random(0).sample([int(r.uid) for soup in batches 
+                                     for r in soup.records()], 200)
+    
+    print('{0:>8} {1:>12} {2:>14} {3:>16}'.format(
+            'layout', 'articles/s', 'file size (MB)', 'lookup (ms)'))
+    for layout, filename in (('groups', 'pubmed_summary.h5'), 
+                             ('columns', storage.COLUMNS_FILENAME)): 
+        with tempfile.TemporaryDirectory() as folder: 
+            start = time.perf_counter()
+            for soup in batches: 
+                soup.save(folder, layout)
+            write = time.perf_counter() - start
+            path = os.path.join(folder, filename)
+            size = os.path.getsize(path) / 2.**20
+            
+            start = time.perf_counter()
+            if layout == 'groups': 
+                with h5py.File(path, 'r') as f: 
+                    for pmid in pmids: 
+                        grp = f[str(pmid)]
+                        {k: v[()] for k, v in grp.items() 
+                         if isinstance(v, h5py.Dataset)}
+            else: 
+                with storage.ColumnarReader(path) as reader: 
+                    for pmid in pmids: 
+                        reader[pmid]
+            lookup = (time.perf_counter() - start) / len(pmids)
+        print('{0:>8} {1:12.1f} {2:14.2f} {3:16.3f}'.format(
+                layout, n_records / write, size, 1e3*lookup))
+
+
+if __name__ == '__main__': 
+    main(*[int(arg) for arg in sys.argv[1:]])
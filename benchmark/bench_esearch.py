@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Time to read the Pubmed IDs and Count of a synthetic esearch response with
+UIDSoup and with FastUIDSoup.
+
+    python benchmark/bench_esearch.py [n_ids] [repeat]
+"""
+import warnings
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pubmed_scraping'))
+import synthetic
+import soups
+
+
+def best_of(read, raw, repeat): 
+    best = float('inf')
+    for _ in range(repeat): 
+        start = time.perf_counter()
+        result = read(raw)
+        len(result.uid), result.count
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n=int(1e5), repeat=3): 
+    warnings.simplefilter('ignore')
+    corpus = synthetic.SyntheticCorpus(n)
+    raw = corpus.esearch(0, n)
+    print('{0} IDs, {1:.1f} MB of XML'.format(n, len(raw) / 2**20))
+    print('{0:>12} {1:>10} {2:>12}'.format('parser', 'best (ms)', 'IDs/s'))
+    for name, read in (('UIDSoup', lambda raw: soups.UIDSoup(raw.decode('utf-8'))), 
+                       ('FastUIDSoup', soups.FastUIDSoup)): 
+        elapsed = best_of(read, raw, repeat)
+        print('{0:>12} {1:10.1f} {2:12.0f}'.format(name, 1e3*elapsed, 
+                                                   n / elapsed))
+
+
+if __name__ == '__main__': 
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Per-request latency of KeyWordQuery requests against a local HTTP stub,
+with and without a pooled session.
+
+    python benchmark/bench_session.py [n_requests]
+
+The stub is plain HTTP on localhost, so this only measures the TCP connect
+and teardown that a session saves; against eutils.ncbi.nlm.nih.gov the TLS
+handshake makes the difference considerably larger.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pubmed_scraping'))
+import query
+import synthetic
+
+
+class _Handler(BaseHTTPRequestHandler): 
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = synthetic.SyntheticCorpus(20).esearch(0, 20)
+
+    def log_message(self, format, *args): 
+        pass
+
+    def do_GET(self): 
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+class _Server(ThreadingMixIn, HTTPServer): 
+    daemon_threads = True
+
+
+def time_requests(kw_query, n): 
+    latency = []
+    for _ in range(n): 
+        start = time.perf_counter()
+        with kw_query.as_request() as req: 
+            req.content
+        latency.append(time.perf_counter() - start)
+    latency.sort()
+    return latency
+
+
+def main(n=2000): 
+    server = _Server(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/esearch.fcgi?'.format(server.server_address[1])
+
+    print('{0:>10} {1:>12} {2:>12} {3:>12}'.format('', 'mean (ms)',
+                                                    'median (ms)', 'p99 (ms)'))
+    for name, session in (('no session', None),
+                          ('session', query.make_session())):
+        kw_query = query.KeyWordQuery(session=session)
+        kw_query.load(terms=[[b'author', b'shteyn']])
+        kw_query.base_url = url
+        latency = time_requests(kw_query, n)
+        print('{0:>10} {1:12.3f} {2:12.3f} {3:12.3f}'.format(
+                name, 1e3*sum(latency)/n, 1e3*latency[n//2],
+                1e3*latency[int(n*0.99)]))
+
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == '__main__': 
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Peak memory and throughput of SummarySoup versus stream.iter_summaries on a
+synthetic efetch response.
+
+    python benchmark/bench_stream.py [n_articles]
+
+Each parser runs in its own process so that peak RSS isn't shared between
+them. Peak RSS is reported relative to the process' RSS just before
+parsing, i.e. after the raw XML has been generated.
+"""
+import subprocess
+import resource
+import warnings
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pubmed_scraping'))
+import synthetic
+
+
+def _rss_mb(): 
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run(mode, n): 
+    corpus = synthetic.SyntheticCorpus(n)
+    raw = corpus.efetch(corpus.uids())
+    import soups
+    import stream
+    warnings.simplefilter('ignore')
+    base = _rss_mb()
+
+    start = time.perf_counter()
+    if mode == 'soup': 
+        soup = soups.SummarySoup(raw.decode('utf-8'))
+        count = sum(1 for _ in zip(*[soup.__getattribute__(attr) for attr
+                                     in soup._data_attrs]))
+    else: 
+        count = sum(1 for _ in stream.iter_summaries(raw))
+    elapsed = time.perf_counter() - start
+    print('{0:>8} {1:>10} {2:12.1f} {3:16.1f}'.format(
+            mode, count, count / elapsed, _rss_mb() - base))
+
+
+def main(n=5000): 
+    print('{0:>8} {1:>10} {2:>12} {3:>16}'.format('parser', 'articles',
+                                                  'articles/s', 'peak RSS (MB)'))
+    for mode in ('soup', 'stream'): 
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                               '--run', mode, str(n)])
+
+
+if __name__ == '__main__': 
+    if sys.argv[1:2] == ['--run']: 
+        run(sys.argv[2], int(sys.argv[3]))
+    else: 
+        main(*[int(arg) for arg in sys.argv[1:]])
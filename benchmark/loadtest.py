@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Load test: end-to-end articles per second of the pipelines (esearch,
+efetch, parsing and saving in the 'columns' layout) against a local
+E-utilities simulator (simulator.EutilsSimulator), with injected latency,
+errors and rate limits.
+
+    python benchmark/loadtest.py [--articles 5000] [--latency 0.1]
+                                 [--jitter 0.05] [--error-rate 0.02]
+                                 [--rate-limit 10] [--client-rate 10]
+                                 [--api-key KEY] [--max-in-flight 4]
+                                 [--pipelines Pipeline,AsyncPipeline]
+
+The client's token bucket runs at --client-rate requests per second,
+which defaults to the server's --rate-limit, or to 1000 without one.
+Setting it above the rate limit shows how the pipelines recover from 429s.
+Retries back off from --backoff seconds, rather than RetryPolicy's default,
+so that injected errors don't dominate short runs.
+"""
+import tempfile
+import argparse
+import warnings
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pubmed_scraping'))
+import synthetic
+import pipeline
+import parallel
+import limiter
+import metrics
+from simulator import EutilsSimulator
+
+TERMS = [[b'author', b'shteyn']]
+PIPELINES = {'Pipeline': pipeline.Pipeline, 
+             'AsyncPipeline': pipeline.AsyncPipeline, 
+             'ParallelPipeline': parallel.ParallelPipeline}
+
+
+def run(name, sim, n, client_rate, api_key=None, max_in_flight=4, 
+        backoff=0.1): 
+    """
+    Harvests 'n' articles from 'sim' with the pipeline called 'name'.
+    Returns a dict of what the run took: seconds, articles, requests,
+    retries, and the responses of each status sent by the simulator.
+    """
+    kwargs = {}
+    if name == 'AsyncPipeline': 
+        kwargs['max_in_flight'] = max_in_flight
+    run_metrics = metrics.Metrics()
+    pipe = PIPELINES[name](
+            TERMS, api_key=api_key, limiter=limiter.TokenBucket(client_rate), 
+            retry=limiter.RetryPolicy(backoff=backoff, seed=0), 
+            metrics=run_metrics, **kwargs)
+    pipe.set_base_urls(sim.base_urls)
+
+    statuses = sim.statuses
+    n_requests = len(sim.log)
+    with tempfile.TemporaryDirectory() as folder: 
+        start = time.perf_counter()
+        pipe.request(n, save_folder=folder, layout='columns')
+        seconds = time.perf_counter() - start
+    counters = run_metrics.snapshot()['counters']
+    sent = {status: count - statuses.get(status, 0)
+            for status, count in sim.statuses.items()}
+    return {'pipeline': name, 'seconds': seconds, 
+            'articles': counters.get('articles_written', 0), 
+            'requests': len(sim.log) - n_requests, 
+            'retries': counters.get('retries', 0), 
+            'statuses': {s: c for s, c in sent.items() if c}}
+
+
+def report(result): 
+    errors = sum(c for s, c in result['statuses'].items() 
+                 if s not in (200, 429))
+    print('{0:>17} {1:>9} {2:>9.2f} {3:>11.1f} {4:>9} {5:>8} {6:>6} '
+          '{7:>7}'.format(result['pipeline'], result['articles'], 
+                          result['seconds'], 
+                          result['articles']/result['seconds'], 
+                          result['requests'], result['retries'], 
+                          result['statuses'].get(429, 0), errors))
+
+
+def main(): 
+    parser = argparse.ArgumentParser(
+            description='Pipeline throughput against a local E-utilities '
+                        'simulator.')
+    parser.add_argument('--articles', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.1, 
+                        help='seconds before each response')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0., 
+                        help='fraction of requests answered with a 5xx')
+    parser.add_argument('--rate-limit', type=float, default=None, 
+                        help="server's requests per second, per api_key")
+    parser.add_argument('--client-rate', type=float, default=None)
+    parser.add_argument('--api-key', default=None)
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--backoff', type=float, default=0.1)
+    parser.add_argument('--pipelines', default=','.join(PIPELINES))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    client_rate = args.client_rate or args.rate_limit or 1000
+
+    corpus = synthetic.SyntheticCorpus(args.articles)
+    sim = EutilsSimulator(corpus, latency=args.latency, jitter=args.jitter, 
+                          error_rate=args.error_rate, 
+                          rate_limit=args.rate_limit, seed=args.seed)
+    print('{0:>17} {1:>9} {2:>9} {3:>11} {4:>9} {5:>8} {6:>6} '
+          '{7:>7}'.format('pipeline', 'articles', 'seconds', 'articles/s', 
+                          'requests', 'retries', '429s', 'errors'))
+    with sim: 
+        for name in args.pipelines.split(','): 
+            report(run(name, sim, args.articles, client_rate, args.api_key, 
+                       args.max_in_flight, args.backoff))
+
+
+if __name__ == '__main__': 
+    main()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Offline benchmark suite: throughput and peak memory of query building,
+parsing and storage on synthetic esearch/efetch XML (synthetic.py), for
+several sizes. Each run is appended to a JSON lines file, labeled by git
+commit, and compared with the last run of a different commit, so that
+regressions show up.
+
+    python benchmark/suite.py [--sizes 500,5000,100000] [--max-articles N]
+                              [--repeat 3] [--only PATTERN]
+                              [--results benchmark/results.jsonl]
+                              [--threshold 0.2] [--no-save]
+
+Times are the best of 'repeat' runs. Peak memory is measured in a separate
+run with tracemalloc, i.e. it counts the Python heap but not buffers that
+lxml allocates itself. Cases that parse articles are skipped above
+--max-articles, since a 100k-article SummarySoup needs several GB.
+
+The exit status is 1 if a case got slower, or its peak memory grew, by more
+than 'threshold' (a fraction) compared with the previous commit.
+"""
+from collections import OrderedDict
+import subprocess
+import tracemalloc
+import tempfile
+import argparse
+import warnings
+import fnmatch
+import datetime
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pubmed_scraping'))
+import query
+import soups
+import stream
+import synthetic
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'results.jsonl')
+
+
+class Case(object): 
+    """
+    One benchmark. 'setup(n)' makes the input for n IDs or articles,
+    outside of the timings, and 'run(data)' is what's timed. Cases that
+    parse articles are 'per_article'.
+    """
+    def __init__(self, name, setup, run, per_article=False): 
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.per_article = per_article
+
+
+def _esearch(n): 
+    return synthetic.SyntheticCorpus(n).esearch(0, n)
+
+
+def _efetch(n): 
+    corpus = synthetic.SyntheticCorpus(n)
+    return corpus.efetch(corpus.uids())
+
+
+def _protein_efetch(n): 
+    corpus = synthetic.SyntheticCorpus(n)
+    return corpus.protein_efetch(corpus.uids())
+
+
+def _gene_efetch(n): 
+    corpus = synthetic.SyntheticCorpus(n)
+    return corpus.gene_efetch(corpus.uids())
+
+
+def _records(Soup, decode=False): 
+    def run(raw): 
+        return sum(1 for _ in Soup(raw.decode('utf-8') if decode 
+                                   else raw).records())
+    return run
+
+
+def _summary_soup(n): 
+    return soups.SummarySoup(_efetch(n).decode('utf-8'))
+
+
+def _property(attr): 
+    def run(soup): 
+#        properties share one extraction; drop it so each pays its own way
+        soup.__dict__.pop('_extracted_fields', None)
+        return sum(1 for _ in getattr(soup, attr))
+    return run
+
+
+def _save(layout): 
+    def run(soup): 
+        with tempfile.TemporaryDirectory() as folder: 
+            soup.save(folder, layout)
+    return run
+
+
+def cases(): 
+    yield Case('esearch/UIDSoup', _esearch,
+               lambda raw: len(soups.UIDSoup(raw.decode('utf-8')).uid))
+    yield Case('esearch/FastUIDSoup', _esearch,
+               lambda raw: len(soups.FastUIDSoup(raw).uid))
+    yield Case('UIDQuery._SearchTerms/bytes list',
+               lambda n: [str(u).encode('utf-8') for u in
+                          synthetic.SyntheticCorpus(n).uids()],
+               query.UIDQuery._SearchTerms)
+    yield Case('UIDQuery._SearchTerms/saveable',
+               lambda n: b','.join(str(u).encode('utf-8') for u in
+                                   synthetic.SyntheticCorpus(n).uids()),
+               query.UIDQuery._SearchTerms)
+    yield Case('UIDQuery._SearchTerms/FastUIDSoup',
+               lambda n: soups.FastUIDSoup(_esearch(n)),
+               query.UIDQuery._SearchTerms)
+    yield Case('efetch/SummarySoup', _efetch,
+               lambda raw: soups.SummarySoup(raw.decode('utf-8')),
+               per_article=True)
+    for attr in soups.summary_kwargs: 
+        yield Case('efetch/SummarySoup.{0}'.format(attr), _summary_soup,
+                   _property(attr), per_article=True)
+    yield Case('efetch/stream.iter_summaries', _efetch,
+               lambda raw: sum(1 for _ in stream.iter_summaries(raw)),
+               per_article=True)
+#    BeautifulSoup walk vs. compiled XPath, parsing included
+    yield Case('efetch/SummarySoup.records', _efetch,
+               _records(soups.SummarySoup, decode=True), per_article=True)
+    yield Case('efetch/FastSummarySoup.records', _efetch,
+               _records(soups.FastSummarySoup), per_article=True)
+    yield Case('efetch/ProteinSoup.records', _protein_efetch,
+               _records(soups.ProteinSoup), per_article=True)
+    yield Case('efetch/GeneSoup.records', _gene_efetch,
+               _records(soups.GeneSoup), per_article=True)
+    for layout in ('groups', 'columns'): 
+        yield Case('SummarySoup.save/{0}'.format(layout), _summary_soup,
+                   _save(layout), per_article=True)
+
+
+def measure(case, n, repeat): 
+    """
+    Dict of the best time, throughput and peak memory of 'case' for size n.
+    """
+    data = case.setup(n)
+    best = float('inf')
+    for _ in range(repeat): 
+        start = time.perf_counter()
+        case.run(data)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try: 
+        case.run(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally: 
+        tracemalloc.stop()
+    return OrderedDict([('case', case.name), ('n', n), ('seconds', best),
+                        ('items_per_s', n / best),
+                        ('peak_mb', peak / 2**20)])
+
+
+def commit(): 
+    """
+    Current git commit, with '+dirty' if the tree has uncommitted changes,
+    or None outside of a git checkout.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try: 
+        head = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=folder, stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', 
+                                         '--untracked-files=no'], cwd=folder)
+    except (OSError, subprocess.CalledProcessError): 
+        return None
+    return head.decode().strip() + ('+dirty' if dirty.strip() else '')
+
+
+def load(path): 
+    if not os.path.exists(path): 
+        return []
+    with open(path) as f: 
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous(results, current): 
+    """
+    Latest result of each (case, n) from a commit other than 'current'.
+    """
+    latest = {}
+    for result in results: 
+        if result.get('commit') != current: 
+            latest[result['case'], result['n']] = result
+    return latest
+
+
+def regressions(results, baseline, threshold): 
+    """
+    Yields (result, baseline result, metric, ratio) for each case that got
+    slower, or used more memory, by more than 'threshold' (and more than
+    a millisecond or 0.1 MB).
+    """
+    for result in results: 
+        base = baseline.get((result['case'], result['n']))
+        if base is None: 
+            continue
+        for metric, noise in (('seconds', 1e-3), ('peak_mb', 0.1)): 
+#            differences below 'noise' are timer and allocator jitter
+            if result[metric] - base[metric] > noise \
+               and result[metric] > (1 + threshold) * base[metric]: 
+                yield result, base, metric, result[metric] / base[metric]
+
+
+def main(argv=None): 
+    parser = argparse.ArgumentParser(
+            description='Throughput and peak memory of query building, '
+                        'parsing and storage on synthetic XML.')
+    parser.add_argument('--sizes', default='500,5000,100000')
+    parser.add_argument('--max-articles', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default='*')
+    parser.add_argument('--results', default=RESULTS)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+    warnings.simplefilter('ignore')
+
+    sizes = [int(float(n)) for n in args.sizes.split(',')]
+    current = commit()
+    baseline = previous(load(args.results), current)
+    stamp = datetime.datetime.now().isoformat(timespec='seconds')
+    results = []
+    print('{0:<36} {1:>7} {2:>10} {3:>12} {4:>10} {5:>8}'.format(
+            'case', 'n', 'best (ms)', 'items/s', 'peak (MB)', 'vs prev'))
+    for case in cases(): 
+        if not fnmatch.fnmatch(case.name, args.only): 
+            continue
+        for n in sizes: 
+            if case.per_article and n > args.max_articles: 
+                continue
+            result = measure(case, n, args.repeat)
+            result.update(commit=current, date=stamp)
+            results.append(result)
+            base = baseline.get((case.name, n))
+            change = '' if base is None else '{0:+.0%}'.format(
+                    result['seconds'] / base['seconds'] - 1)
+            print('{0:<36} {1:>7} {2:10.1f} {3:12.0f} {4:10.1f} {5:>8}'.format(
+                    case.name, n, 1e3*result['seconds'], result['items_per_s'],
+                    result['peak_mb'], change))
+
+    if not args.no_save: 
+        with open(args.results, 'a') as f: 
+            for result in results: 
+                f.write(json.dumps(result) + '\n')
+
+    found = list(regressions(results, baseline, args.threshold))
+    for result, base, metric, ratio in found: 
+        print('REGRESSION {0} n={1}: {2} {3:.3g} -> {4:.3g} ({5:+.0%}) since '
+              '{6}'.format(result['case'], result['n'], metric, base[metric],
+                           result[metric], ratio - 1, base.get('commit')))
+    return 1 if found else 0
+
+
+if __name__ == '__main__': 
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+
+from soups import SummaryRecord
+from storage import PARQUET_DIRNAME, single_fields, nested_fields, record_pmid
+
+_string_list = pa.list_(pa.string())
+# multi-valued fields keep one list per sub-key, like SummaryRecord: the
+# sub-keys that summary_kwargs aligns (e.g. authors' lastname and forename)
+# have one value per author, b'' if it's missing, so they line up; the
+# others (e.g. affiliation) are collected independently
+SCHEMA = pa.schema([pa.field('pmid', pa.uint64())] +
+                   [pa.field(field, pa.string()) for field in single_fields] +
+                   [pa.field(field, pa.struct([pa.field(key, _string_list)
+                                               for key in keys]))
+                    for field, keys in nested_fields.items()])
+
+
+def record_batch(records): 
+    """
+    Arrow RecordBatch of a list of SummaryRecords, with schema SCHEMA.
+    """
+    columns = [pa.array([record_pmid(r.uid) for r in records],
+                        type=pa.uint64())]
+    for field in single_fields: 
+        columns.append(pa.array([getattr(r, field) for r in records],
+                                type=pa.string()))
+    for field, keys in nested_fields.items(): 
+        columns.append(pa.StructArray.from_arrays(
+                [pa.array([getattr(r, field)[key] for r in records],
+                          type=_string_list) for key in keys],
+                fields=list(SCHEMA.field(field).type)))
+    return pa.RecordBatch.from_arrays(columns, schema=SCHEMA)
+
+
+class ParquetWriter(object): 
+    """
+    Stores SummaryRecords as a Parquet dataset: a folder of part files
+    with schema SCHEMA, which pyarrow, pandas, Spark, DuckDB etc. read as
+    one table. Single-valued fields are string columns; multi-valued
+    fields are struct columns with a list of strings per sub-key, e.g.
+    authors.lastname.
+
+    Each call to 'append' (i.e. each efetch batch) is written as a part
+    file of its own, with one row group. The part file is written under a
+    hidden name and renamed once it's complete, so readers never see a
+    file without its footer, and a batch is on disk as soon as 'append'
+    returns: a run that crashes loses at most the batch being written.
+    Readers treat the folder as one table however many files it has.
+
+    Parameters
+    ------------
+    path : str
+        Dataset folder; created if it doesn't exist.
+
+    compression : str
+        Parquet compression codec.
+    """
+    def __init__(self, path, compression='snappy'): 
+        self.path = path
+        self.compression = compression
+        os.makedirs(path, exist_ok=True)
+
+    def _part(self): 
+        names = [name for name in os.listdir(self.path)
+                 if name.startswith('part-') and name.endswith('.parquet')]
+        return 1 + max([int(name[5:-8]) for name in names], default=-1)
+
+    def append(self, records): 
+        """
+        Appends an iterable of SummaryRecords, e.g. SummarySoup.records(),
+        as one part file. Returns the number of records written.
+        """
+        records = list(records)
+        if not records: 
+            return 0
+        part = self._part()
+        name = os.path.join(self.path, 'part-{0:05d}.parquet'.format(part))
+        tmp = os.path.join(self.path, '.part-{0:05d}.parquet'.format(part))
+        pq.write_table(pa.Table.from_batches([record_batch(records)]), tmp,
+                       row_group_size=len(records),
+                       compression=self.compression)
+        os.replace(tmp, name)
+        return len(records)
+
+    def close(self): 
+        pass
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+def read_table(folder, columns=None): 
+    """
+    The Parquet dataset saved to 'folder', as a pyarrow Table. Files are
+    memory-mapped, so e.g. the 'pmid' column is a view of the file.
+
+    Parameters
+    ------------
+    folder : str
+        Folder the harvest saves to.
+
+    columns : list
+        Columns to read, e.g. ['pmid', 'title'], or None for all.
+    """
+    path = os.path.join(folder, PARQUET_DIRNAME)
+    return pq.read_table(path, columns=columns, memory_map=True,
+                         schema=SCHEMA)
+
+
+def iter_records(folder): 
+    """
+    Yields the SummaryRecords of the Parquet dataset saved to 'folder'.
+    """
+    for batch in read_table(folder).to_batches(): 
+        rows = batch.to_pydict()
+        for i in range(batch.num_rows): 
+            fields = {field: rows[field][i].encode('utf-8')
+                      for field in single_fields}
+            for field, keys in nested_fields.items(): 
+                value = rows[field][i]
+                fields[field] = {key: [v.encode('utf-8') for v in value[key]]
+                                 for key in keys}
+            yield SummaryRecord(**fields)
+
+
+def parquet_pmids(folder): 
+    """
+    Pubmed IDs of the Parquet dataset saved to 'folder', as a numpy array.
+    """
+    return read_table(folder, ['pmid']).column('pmid').to_numpy()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import numpy as np
+import asyncio
+import os
+import h5py
+
+import query
+import soups
+from pipeline import AsyncPipeline
+from sharding import merge_uids
+from uid_array import UIDArray
+
+MEMBERSHIP_FILENAME = 'query_membership.h5'
+
+
+class QueryMembership(object): 
+    """
+    Which Pubmed IDs each of several searches returned, in the order 
+    esearch returned them. 
+
+    Saved compactly, the way sparse matrices are: every Pubmed ID is 
+    stored once in the sorted 'pmids' array, and each search is a run of 
+    uint32 positions in that array ('indices'), from offsets[i] to 
+    offsets[i + 1] for the i-th search in 'names'. 
+
+    Parameters
+    ------------
+    searches : dict
+        Name of each search -> its Pubmed IDs (anything UIDArray takes).
+    """
+    def __init__(self, searches=()): 
+        self._searches = OrderedDict((name, UIDArray(uids)) for name, uids 
+                                     in OrderedDict(searches).items())
+
+    @classmethod
+    def load(cls, folder): 
+        """
+        Membership saved to 'folder', or an empty one if there is none. 
+        """
+        path = os.path.join(folder, MEMBERSHIP_FILENAME)
+        if not os.path.exists(path): 
+            return cls()
+        with h5py.File(path, 'r') as f: 
+            pmids = f['pmids'][()]
+            indices = f['indices'][()]
+            offsets = f['offsets'][()]
+            names = [name.decode('utf-8') if isinstance(name, bytes) else name 
+                     for name in f['names'][()]]
+        return cls((name, pmids[indices[start:stop]]) for name, start, stop 
+                   in zip(names, offsets[:-1], offsets[1:]))
+
+    def save(self, folder): 
+        path = os.path.join(folder, MEMBERSHIP_FILENAME)
+        pmids = self.pmids.array
+        lists = [uids.array for uids in self._searches.values()]
+        indices = np.searchsorted(pmids, np.concatenate(lists)) if lists \
+                  else np.empty(0)
+        offsets = np.concatenate([[0], np.cumsum([len(li) for li in lists])])
+#        written next to the old file and swapped in, so that an interrupted 
+#        save doesn't lose the searches already recorded 
+        tmp = path + '.tmp'
+        with h5py.File(tmp, 'w') as f: 
+            f.create_dataset('pmids', data=pmids, dtype=UIDArray.dtype)
+            f.create_dataset('indices', data=indices, dtype=np.uint32)
+            f.create_dataset('offsets', data=offsets, dtype=np.int64)
+            f.create_dataset('names', data=list(self._searches.keys()), 
+                             dtype=h5py.string_dtype())
+        os.replace(tmp, path)
+
+    def update(self, other): 
+        """
+        Adds the searches of 'other' (a QueryMembership or dict), replacing 
+        those with the same names. 
+        """
+        for name, uids in OrderedDict(other).items(): 
+            self._searches[name] = UIDArray(uids)
+
+    @property
+    def pmids(self): 
+        """
+        Sorted UIDArray of the Pubmed IDs of all searches, once each. 
+        """
+        if not self._searches: 
+            return UIDArray()
+        return UIDArray(np.unique(np.concatenate(
+                [uids.array for uids in self._searches.values()])))
+
+    def items(self): 
+        return self._searches.items()
+
+    def keys(self): 
+        return self._searches.keys()
+
+    def __getitem__(self, name): 
+        return self._searches[name]
+
+    def __contains__(self, name): 
+        return name in self._searches
+
+    def __iter__(self): 
+        return iter(self._searches)
+
+    def __len__(self): 
+        return len(self._searches)
+
+
+def search_name(kw_query): 
+    """
+    Default name of a search in a QueryMembership: its esearch term and 
+    publication date range. 
+    """
+    terms = kw_query.search_terms
+    return '{0} {1}:{2}'.format(terms.term, terms.mindate, terms.maxdate)
+
+
+class BatchPipeline(AsyncPipeline): 
+    """
+    Harvests many, possibly overlapping, searches at once. The esearches 
+    of all searches are sent first; their Pubmed IDs are then merged into 
+    one set without duplicates, and each summary is fetched and saved 
+    once, however many searches returned it, like ShardedPipeline does 
+    for the shards of one search. 
+
+    Which search returned which articles is kept in a QueryMembership, 
+    saved to the save folder, so each search's results can be picked out 
+    of the saved summaries without fetching anything again. 
+
+    Parameters
+    ------------
+    searches : list or dict
+        Key word search terms (a path or a list of terms; see 
+        KeyWordQuery.load) of each search, or a dict from a name for each 
+        search to its terms. Unnamed searches are named by search_name. 
+
+    api_key, max_in_flight, limiter, session, cache, retry, metrics, 
+    indexes : 
+        See AsyncPipeline. 
+    
+    A harvest is resumed by Pubmed ID rather than checkpointed by window, 
+    since the merged Pubmed IDs change whenever a search is added or NCBI 
+    has new results: every efetch batch is added to the save folder's 
+    FetchedLog, and IDs already saved or fetched are skipped. 
+    """
+    def __init__(self, searches, api_key=None, max_in_flight=4, limiter=None, 
+                 session=None, cache=None, retry=None, metrics=None, 
+                 indexes=()): 
+        super().__init__(None, api_key, max_in_flight=max_in_flight, 
+                         limiter=limiter, session=session, cache=cache, 
+                         retry=retry, metrics=metrics, indexes=indexes)
+        self.kw_queries = OrderedDict()
+        named = isinstance(searches, dict)
+        for name in searches: 
+            kw = searches[name] if named else name
+            kw_query = query.KeyWordQuery(retstart=0, api_key=api_key, 
+                                          session=self.session)
+            if isinstance(kw, str): 
+                kw_query.load(path=kw)
+            else: 
+                kw_query.load(terms=kw)
+            self.kw_queries[name if named else search_name(kw_query)] = kw_query
+
+    def set_base_urls(self, base_urls): 
+        """
+        See Pipeline.set_base_urls. The 'kw_query' URL is used for every 
+        search. 
+        """
+        super().set_base_urls(base_urls)
+        if 'kw_query' in base_urls: 
+            for kw_query in self.kw_queries.values(): 
+                kw_query.base_url = base_urls['kw_query']
+
+    def _one_search(self, name): 
+        raise TypeError('BatchPipeline has no single search to {0}; use '
+                        'request or request_async.'.format(name))
+
+#    these harvest the Pipeline's one kw_query, which a BatchPipeline 
+#    doesn't have
+    def search_window(self, ret_start, ret_max): 
+        self._one_search('search_window')
+
+    def iter_articles(self, n, use_history=False): 
+        self._one_search('iter_articles')
+
+    async def iter_articles_async(self, n, use_history=False): 
+        self._one_search('iter_articles_async')
+        yield
+
+    async def _search(self, kw_query, n, executor): 
+        """
+        UIDArray of the first 'n' Pubmed IDs of one search, in 
+        UID_RETMAX windows. 
+        """
+        kw_query.use_history = False
+        kw_query.ret_max = self._n_or_max(n, query.UID_RETMAX)
+        kw_query.ret_start = 0
+        first = await self._request_async(kw_query, soups.FastUIDSoup, 
+                                          executor)
+        windows = []
+        for start in range(kw_query.ret_max, min(n, first.count), 
+                           kw_query.ret_max): 
+            kw_query.ret_start = start
+            windows.append(self._request_async(kw_query, soups.FastUIDSoup, 
+                                               executor))
+        rest = await asyncio.gather(*windows)
+        return UIDArray.concatenate([first.uid] + [s.uid for s in rest])[:n]
+
+    async def search_async(self, n, executor): 
+        """
+        Coroutine that runs the esearches of all searches and returns 
+        their QueryMembership. 
+        """
+        results = await asyncio.gather(*[self._search(kw_query, n, executor) 
+                                         for kw_query in self.kw_queries.values()])
+        return QueryMembership(zip(self.kw_queries.keys(), results))
+
+    async def request_async(self, n, save_folder='', layout='groups', 
+                            resume=True, incremental=False): 
+        """
+        Coroutine version of 'request'. Returns the QueryMembership of the 
+        searches. 
+        """
+        n = int(n)
+        self.uid_query.ret_max = self._n_or_max(n, query.SUMMARY_RETMAX)
+        known = None
+#        articles already in save_folder are never saved twice (see 
+#        _harvest); when resuming, they aren't fetched again either 
+        if incremental or (resume and save_folder): 
+            known = self._known(save_folder, True, False)
+
+        harvest = self._harvest(save_folder, layout, None, bool(save_folder))
+        with ThreadPoolExecutor(self.max_in_flight + 1) as executor: 
+            try: 
+                membership = await self.search_async(n, executor)
+                uids = merge_uids([uids for name, uids in membership.items()])
+                if known is not None: 
+                    uids = uids.difference(known)
+                if save_folder: 
+                    saved = QueryMembership.load(save_folder)
+                    saved.update(membership)
+                    saved.save(save_folder)
+                await self._save_steps(self._batches(uids, None), harvest, 
+                                       executor)
+            except ConnectionError as e: 
+                if e.response is not None: 
+                    print(e.response.reason)
+                raise ConnectionError(response=e.response, request=e.request)
+            finally: 
+                harvest.close()
+        return membership
+
+    def request(self, n, save_folder='', layout='groups', resume=True, 
+                incremental=False): 
+        """
+        Harvests the first 'n' results of every search, fetching each 
+        article once, and returns their QueryMembership. See 
+        Pipeline.request for the other arguments; the history server isn't 
+        used, since the Pubmed IDs are needed to remove duplicates. Articles 
+        already in 'save_folder' (or in its FetchedLog) aren't fetched 
+        again unless 'resume' is False, so 'incremental' makes no 
+        difference here; with 'resume' False they are fetched, but articles 
+        that are already stored aren't saved twice. 
+        """
+        with self.metrics.run(pipeline=type(self).__name__, 
+                              searches=len(self.kw_queries), n=int(n)): 
+            return asyncio.run(self.request_async(n, save_folder, layout, 
+                                                  resume, incremental))
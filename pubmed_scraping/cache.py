@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+import hashlib
+import json
+import time
+import zlib
+import os
+
+# parameters that don't change what NCBI returns
+_IGNORED_FIELDS = ('api_key',)
+
+
+class ResponseCache(object): 
+    """
+    On-disk cache of raw esearch/efetch responses. Entries are keyed on the 
+    request's URL and its canonical parameters (see Query.request_fields), 
+    and stored zlib-compressed, one file per entry. 
+    
+    Entries older than 'ttl' seconds are treated as missing. Once the cache 
+    holds more than 'max_bytes', the least recently used entries are 
+    deleted. 
+    
+    Parameters
+    ------------
+    folder : str
+        Where to keep the cache. Created if it doesn't exist. 
+    
+    ttl : float
+        Seconds an entry stays valid. None means forever. 
+    
+    max_bytes : int
+        Maximum total size of the (compressed) entries. 
+    """
+    def __init__(self, folder, ttl=7*24*3600., max_bytes=2**30): 
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+    
+    @staticmethod
+    def key(query): 
+        """
+        Cache key of the request 'query' would send. 
+        """
+        fields = {k: str(v) for k, v in query.request_fields().items() 
+                  if k not in _IGNORED_FIELDS}
+        raw = json.dumps([query.base_url, sorted(fields.items())])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _path(self, key): 
+        return os.path.join(self.folder, key[:2], key + '.xml.z')
+    
+    def _entries(self): 
+        for root, dirs, files in os.walk(self.folder): 
+            for name in files: 
+                if name.endswith('.xml.z'): 
+                    yield os.path.join(root, name)
+    
+    def _expired(self, path): 
+        return self.ttl is not None \
+               and time.time() - os.path.getmtime(path) > self.ttl
+    
+    def __contains__(self, key): 
+        path = self._path(key)
+        return os.path.exists(path) and not self._expired(path)
+    
+    def get(self, key): 
+        """
+        Cached response text, or None. 
+        """
+        path = self._path(key)
+        try: 
+            if self._expired(path): 
+                with self._lock: 
+                    self._remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as f: 
+                raw = zlib.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError: 
+            with self._lock: 
+                self.misses += 1
+            return None
+        # access time is what least recently used is decided on; keep the 
+        # modification time, which is what ttl is measured from 
+        try: 
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except FileNotFoundError: 
+            # evicted by another process since it was read; still a hit 
+            pass
+        with self._lock: 
+            self.hits += 1
+        return raw
+    
+    def put(self, key, raw): 
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(raw.encode('utf-8'))
+        tmp = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f: 
+            f.write(data)
+        with self._lock: 
+            if os.path.exists(path): 
+                self._size -= os.path.getsize(path)
+            os.replace(tmp, path)
+            self._size += len(data)
+            if self._size > self.max_bytes: 
+                self._evict()
+    
+    def _remove(self, path): 
+        try: 
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError: 
+            return 
+        self._size -= size
+    
+    def _evict(self): 
+        """
+        Deletes least recently used entries until the cache is at most 90% 
+        of max_bytes. Call with the lock held. 
+        """
+        entries = sorted((os.stat(path).st_atime, path) 
+                         for path in self._entries())
+        for atime, path in entries: 
+            if self._size <= 0.9*self.max_bytes: 
+                break
+            self._remove(path)
+            self.evictions += 1
+    
+    @property
+    def size(self): 
+        return self._size
+    
+    def stats(self): 
+        """
+        Hit and miss counters. Each hit is a request not sent to NCBI. 
+        """
+        with self._lock: 
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 
+                    'evictions': self.evictions, 'bytes': self._size, 
+                    'hit_rate': self.hits / total if total else 0.}
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import os
+
+CHECKPOINT_FILENAME = 'checkpoint.json'
+
+
+def query_key(kw_query, uid_query): 
+    """
+    Identifies a harvest by its search terms and window sizes, so that a 
+    checkpoint isn't reused for a different search. 
+    """
+    fields = dict(kw_query.search_terms.to_dict())
+    fields['kw_retmax'] = kw_query.ret_max
+    fields['uid_retmax'] = uid_query.ret_max
+    fields['db'] = uid_query.fields['db']
+    raw = json.dumps(fields, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+class Checkpoint(object): 
+    """
+    Records which retstart windows of a harvest have been downloaded and 
+    saved, in a JSON file next to the saved results. A window is either a 
+    whole KeyWordQuery window, identified by its ret_start, or one UIDQuery 
+    batch within it, identified by both ret_starts. Pipelines that split a 
+    harvest differently use their own pair of integers, e.g. the date 
+    range of a sharding.Shard. 
+    
+    The file is rewritten atomically after every window, so it's never 
+    left half-written if the harvest is interrupted. 
+    
+    Parameters
+    ------------
+    folder : str
+        Folder the harvest saves to. 
+    
+    key : str
+        Identifies the harvest, e.g. from query_key. A checkpoint file 
+        recorded for a different key is ignored (and overwritten). 
+    """
+    def __init__(self, folder, key): 
+        self.path = os.path.join(folder, CHECKPOINT_FILENAME)
+        self.key = key
+        self._done = set()
+        if os.path.exists(self.path): 
+            with open(self.path, 'r') as f: 
+                saved = json.load(f)
+            if saved.get('key') == key: 
+                self._done = set(tuple(w) for w in saved['done'])
+    
+    @staticmethod
+    def _window(kw_start, uid_start): 
+        if uid_start is None: 
+            return (int(kw_start),)
+        return (int(kw_start), int(uid_start))
+    
+    def done(self, kw_start, uid_start=None): 
+        """
+        Whether the window has been saved. 
+        """
+        return self._window(kw_start, uid_start) in self._done
+    
+    def mark(self, kw_start, uid_start=None): 
+        """
+        Records the window as saved. Call only once its results are on disk. 
+        """
+        self._done.add(self._window(kw_start, uid_start))
+        self._write()
+    
+    def _write(self): 
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f: 
+            json.dump({'key': self.key, 'done': sorted(self._done)}, f)
+        os.replace(tmp, self.path)
+    
+    def clear(self): 
+        self._done = set()
+        if os.path.exists(self.path): 
+            os.remove(self.path)
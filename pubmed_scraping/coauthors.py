@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import hashlib
+import os
+import h5py
+
+from storage import record_pmid
+from store import _write_fixed
+
+GRAPH_FILENAME = 'coauthor_graph.h5'
+
+
+def author_key(lastname, forename): 
+    """
+    What identifies an author: the names, case-folded and with spaces
+    collapsed, as utf-8 bytes. 
+    """
+    parts = []
+    for name in (lastname, forename): 
+        if isinstance(name, bytes): 
+            name = name.decode('utf-8', 'replace')
+        parts.append(' '.join(name.lower().split()))
+    return '\t'.join(parts).encode('utf-8')
+
+
+def _hash(key): 
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 
+                          'little')
+
+
+def _gather(indptr, nodes): 
+    """
+    Positions of the entries of rows 'nodes' of a CSR matrix, row after
+    row, without a Python loop over the rows. 
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    if not len(counts): 
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1])
+
+
+def _coalesce(rows, cols, weights, n): 
+    """
+    Sums the weights of repeated (row, col) edges. Returns the rows, cols
+    and weights sorted by row, then col, and the matching 'indptr'. 
+    """
+    m = np.uint64(max(n, 1))
+    keys = rows.astype(np.uint64)*m + cols.astype(np.uint64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, weights=weights, 
+                          minlength=len(keys)).astype(np.uint32)
+    rows = (keys//m).astype(np.int64)
+    cols = (keys % m).astype(np.uint32)
+    indptr = np.searchsorted(rows, np.arange(n + 1)).astype(np.int64)
+    return rows, cols, weights, indptr
+
+
+class CoauthorGraph(object): 
+    """
+    Co-authorship graph of saved articles, in compressed sparse row (CSR)
+    form, built as summaries are saved (see Pipeline's 'indexes') and
+    persisted next to them, in coauthor_graph.h5.
+
+    Authors are interned: each distinct last name and fore name (see
+    author_key) gets the next integer ID, looked up through a sorted array
+    of 64 bit hashes rather than a dict of names. An edge joins two
+    authors of the same article, in both directions, weighted by the
+    number of articles they share. Collective authors, which have neither
+    name, are left out.
+
+    Edges of new batches go into a small 'delta' CSR, which is merged
+    into the main one once it holds more than 'compact_ratio' times as
+    many edges, so adding a batch takes time in proportion to the delta
+    rather than to the whole graph. The main CSR is stored contiguously
+    and uncompressed, and memory-mapped like SummaryStore's index; queries
+    read both parts.
+
+    Lengths and the current CSR groups are recorded in the file's
+    attributes after everything else is written, so an interrupted 'add'
+    leaves the graph as it was. Each CSR has two groups, e.g. main_0 and
+    main_1: a new one is written over the one not in use, in place (see
+    store._write_fixed), so the file doesn't grow with every 'add'.
+
+    Parameters
+    ------------
+    folder : str
+        Folder the summaries are saved to.
+
+    max_authors : int
+        Articles with more authors, e.g. consortium papers, add no edges,
+        since their n*(n - 1) edges would swamp the graph. Their authors
+        are still interned.
+
+    compact_ratio : float
+        See above. 
+    """
+    def __init__(self, folder, max_authors=100, compact_ratio=0.25): 
+        self.path = os.path.join(folder, GRAPH_FILENAME)
+        self.max_authors = max_authors
+        self.compact_ratio = compact_ratio
+        self._file = h5py.File(self.path, 'a')
+        f = self._file
+        if 'hashes' not in f: 
+            for name, dtype in (('hashes', np.uint64), ('pmids', np.uint64)): 
+                f.create_dataset(name, shape=(0,), maxshape=(None,), 
+                                 dtype=dtype, chunks=(1 << 14,))
+            f.create_dataset('names', shape=(0,), maxshape=(None,), 
+                             dtype=h5py.string_dtype(), chunks=(1 << 12,))
+            f.attrs['n_authors'] = 0
+            f.attrs['n_articles'] = 0
+            self._write_csr('main_0', *_coalesce(*self._no_edges(), 0)[1:])
+            self._write_csr('delta_0', *_coalesce(*self._no_edges(), 0)[1:])
+            f.attrs['main'] = 'main_0'
+            f.attrs['delta'] = 'delta_0'
+#        left over from files that wrote a new group for every 'add'
+        for name in list(f.keys()): 
+            if name.startswith(('main_', 'delta_')) \
+               and name not in (f.attrs['main'], f.attrs['delta']) \
+               and name not in self._slots: 
+                del f[name]
+        self._n = int(f.attrs['n_authors'])
+        hashes = f['hashes'][:self._n]
+        self._order = np.argsort(hashes, kind='stable')
+        self._sorted = hashes[self._order]
+        self._pmids = np.sort(f['pmids'][:int(f.attrs['n_articles'])])
+        self._load_csr()
+
+    _slots = ('main_0', 'main_1', 'delta_0', 'delta_1')
+
+    @staticmethod
+    def _no_edges(): 
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32), 
+                np.empty(0, dtype=np.uint32))
+
+    def _write_csr(self, name, cols, weights, indptr): 
+#        contiguous and uncompressed, so that they can be memory-mapped
+        group = self._file.require_group(name)
+        _write_fixed(group, 'indptr', indptr.astype(np.int64))
+        _write_fixed(group, 'indices', cols.astype(np.uint32))
+        _write_fixed(group, 'weights', weights.astype(np.uint32))
+
+    def _memmap(self, dataset): 
+        length = int(dataset.attrs.get('length', len(dataset)))
+        offset = dataset.id.get_offset()
+        if offset is None: 
+            return dataset[()][:length]
+        return np.memmap(self.path, mode='r', dtype=dataset.dtype, 
+                         shape=dataset.shape, offset=offset)[:length]
+
+    def _load_csr(self): 
+        f = self._file
+        f.flush()
+        main = f[f.attrs['main']]
+        self._main = tuple(self._memmap(main[name]) 
+                           for name in ('indptr', 'indices', 'weights'))
+        delta = f[f.attrs['delta']]
+        self._delta = tuple(
+                delta[name][:int(delta[name].attrs.get('length', 
+                                                       len(delta[name])))]
+                for name in ('indptr', 'indices', 'weights'))
+
+    def _swap(self, kind, cols, weights, indptr): 
+        """
+        Writes a new main or delta CSR over the group of 'kind' that isn't
+        in use; it replaces the current one once the attributes are
+        updated. 
+        """
+        name = '{0}_0'.format(kind)
+        if self._file.attrs[kind] == name: 
+            name = '{0}_1'.format(kind)
+        self._write_csr(name, cols, weights, indptr)
+        return name
+
+    def __len__(self): 
+        return self._n
+
+    @property
+    def n_edges(self): 
+        """
+        Number of distinct co-author pairs. 
+        """
+        return int(self.degrees().sum())//2
+
+    def _intern(self, keys): 
+        """
+        IDs of 'keys', giving new keys the next IDs. Returns the IDs, and
+        the new keys' hashes and positions in 'keys'. 
+        """
+        hashes = np.array([_hash(key) for key in keys], dtype=np.uint64)
+        unique, first, inverse = np.unique(hashes, return_index=True, 
+                                           return_inverse=True)
+        ids = np.empty(len(unique), dtype=np.int64)
+        pos = np.searchsorted(self._sorted, unique)
+        found = pos < len(self._sorted)
+        found[found] = self._sorted[pos[found]] == unique[found]
+        ids[found] = self._order[pos[found]]
+#        new authors are numbered in the order they first occur
+        new = np.flatnonzero(~found)
+        new = new[np.argsort(first[new], kind='stable')]
+        ids[new] = self._n + np.arange(len(new))
+        return ids[inverse], unique[new], first[new]
+
+    def add(self, records): 
+        """
+        Adds the authors and co-authorships of an iterable of
+        SummaryRecords. Articles already added are skipped. Returns the
+        number of articles added.
+        """
+        keys, names, articles, pmids = [], [], [], []
+        seen = set()
+        for record in records: 
+            pmid = record_pmid(record.uid)
+            i = np.searchsorted(self._pmids, pmid)
+            if pmid in seen or (i < len(self._pmids) 
+                                and self._pmids[i] == pmid): 
+                continue
+            seen.add(pmid)
+            pmids.append(pmid)
+            authors = record.authors
+            start = len(keys)
+            for lastname, forename in zip(authors['lastname'], 
+                                          authors['forename']): 
+#                collective authors have neither
+                if not (lastname or forename): 
+                    continue
+                keys.append(author_key(lastname, forename))
+                names.append(b', '.join(n for n in (lastname, forename) if n))
+            articles.append((start, len(keys)))
+        if not pmids: 
+            return 0
+
+        ids, new_hashes, new_first = self._intern(keys)
+        rows, cols = [], []
+        for start, stop in articles: 
+            authors = np.unique(ids[start:stop])
+            if len(authors) > self.max_authors: 
+                continue
+            a, b = np.triu_indices(len(authors), 1)
+            rows += [authors[a], authors[b]]
+            cols += [authors[b], authors[a]]
+        n = self._n + len(new_hashes)
+        indptr, indices, weights = self._delta
+        delta_rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        rows, cols, weights, indptr = _coalesce(
+                np.concatenate([delta_rows] + rows), 
+                np.concatenate([indices] + cols), 
+                np.concatenate([weights, np.ones(sum(len(r) for r in rows))]), 
+                n)
+
+        f = self._file
+        for name, values in (('hashes', new_hashes), ('pmids', pmids), 
+                             ('names', [names[i] for i in new_first])): 
+            size = int(f.attrs['n_articles' if name == 'pmids' 
+                               else 'n_authors'])
+            f[name].resize((size + len(values),))
+            if len(values): 
+                f[name][size:] = values
+        main_edges = len(self._main[1])
+        if len(cols) > self.compact_ratio*main_edges: 
+            main = self._swap('main', *self._merged(cols, weights, indptr, n))
+            delta = self._swap('delta', *_coalesce(*self._no_edges(), n)[1:])
+        else: 
+            main = f.attrs['main']
+            delta = self._swap('delta', cols, weights, indptr)
+        old = [f.attrs['main'], f.attrs['delta']]
+        f.attrs['n_authors'] = n
+        f.attrs['n_articles'] = int(f.attrs['n_articles']) + len(pmids)
+        f.attrs['main'] = main
+        f.attrs['delta'] = delta
+        self._main = None
+        for name in old: 
+            if name not in (main, delta) and name not in self._slots: 
+                del f[name]
+
+        hashes = f['hashes'][:n]
+        self._order = np.argsort(hashes, kind='stable')
+        self._sorted = hashes[self._order]
+        self._pmids = np.sort(np.concatenate([self._pmids, pmids]).astype(
+                np.uint64))
+        self._n = n
+        self._load_csr()
+        return len(pmids)
+
+    def _merged(self, cols, weights, indptr, n): 
+        """
+        Main CSR with the delta (cols, weights, indptr) merged in. 
+        """
+        main_indptr, main_indices, main_weights = self._main
+        main_rows = np.repeat(np.arange(len(main_indptr) - 1), 
+                              np.diff(main_indptr))
+        delta_rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return _coalesce(np.concatenate([main_rows, delta_rows]), 
+                         np.concatenate([main_indices, cols]), 
+                         np.concatenate([main_weights, weights]), n)[1:]
+
+    def compact(self): 
+        """
+        Merges the delta into the main CSR, e.g. once a harvest is done. 
+        """
+        f = self._file
+        if not len(self._delta[1]): 
+            return
+        main = self._swap('main', *self._merged(self._delta[1], 
+                                                self._delta[2], 
+                                                self._delta[0], self._n))
+        delta = self._swap('delta', *_coalesce(*self._no_edges(), 
+                                               self._n)[1:])
+        old = [f.attrs['main'], f.attrs['delta']]
+        f.attrs['main'] = main
+        f.attrs['delta'] = delta
+        self._main = None
+        for name in old: 
+            if name not in self._slots: 
+                del f[name]
+        self._load_csr()
+
+    def find(self, lastname, forename=b''): 
+        """
+        ID of an author, or -1 if there is none. 
+        """
+        h = np.uint64(_hash(author_key(lastname, forename)))
+        i = np.searchsorted(self._sorted, h)
+        if i < len(self._sorted) and self._sorted[i] == h: 
+            return int(self._order[i])
+        return -1
+
+    def name(self, author): 
+        """
+        'Lastname, Forename' of an author ID, as first seen. 
+        """
+        if not 0 <= author < self._n: 
+            raise IndexError(author)
+        return self._file['names'][author]
+
+    def _check(self, authors): 
+        authors = np.atleast_1d(np.asarray(authors, dtype=np.int64))
+        if len(authors) and (authors.min() < 0 or authors.max() >= self._n): 
+            raise IndexError(authors)
+        return authors
+
+    def _edges(self, authors): 
+        """
+        Sources, targets and weights of the edges of 'authors', from both
+        CSRs, with repeated edges summed. 
+        """
+        sources, targets, weights = [], [], []
+        for indptr, indices, w in (self._main, self._delta): 
+            rows = authors[authors < len(indptr) - 1]
+            positions = _gather(indptr, rows)
+            sources.append(np.repeat(rows, np.diff(indptr)[rows]))
+            targets.append(np.asarray(indices[positions], dtype=np.int64))
+            weights.append(np.asarray(w[positions], dtype=np.uint32))
+        return _coalesce(np.concatenate(sources), np.concatenate(targets), 
+                         np.concatenate(weights), max(1, self._n))[:3]
+
+    def neighbors(self, author): 
+        """
+        Co-authors of 'author' (an ID, see 'find'), sorted, and the number
+        of articles shared with each. 
+        """
+        _, cols, weights = self._edges(self._check(author))
+        return cols.astype(np.int64), weights
+
+    def degree(self, author): 
+        """
+        Number of distinct co-authors of 'author'. 
+        """
+        return len(self.neighbors(author)[0])
+
+    def degrees(self): 
+        """
+        Number of distinct co-authors of every author, by ID. 
+        """
+        rows = self._edges(np.arange(self._n))[0]
+        return np.bincount(rows, minlength=self._n)
+
+    def k_hop(self, author, k): 
+        """
+        Authors at most 'k' co-authorships away from 'author', not
+        counting 'author' itself, and how many hops away each is; sorted
+        by hops, then ID. 
+        """
+        frontier = self._check(author)
+        hops = np.full(self._n, -1, dtype=np.int64)
+        hops[frontier] = 0
+        for hop in range(1, k + 1): 
+            if not len(frontier): 
+                break
+            reached = np.unique(self._edges(frontier)[1]).astype(np.int64)
+            frontier = reached[hops[reached] < 0]
+            hops[frontier] = hop
+        found = np.flatnonzero(hops > 0)
+        order = np.argsort(hops[found], kind='stable')
+        return found[order], hops[found][order]
+
+    def close(self): 
+        self._main = self._delta = None
+        self._file.close()
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
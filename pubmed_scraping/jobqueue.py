@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from requests.exceptions import ConnectionError
+from collections import namedtuple
+import multiprocessing
+import threading
+import hashlib
+import socket
+import json
+import time
+import os
+
+import query
+from pipeline import Pipeline
+from storage import open_writer, known_pmids, drop_known, record_pmid
+from limiter import SharedTokenBucket
+from sqlite_db import immediate, connect
+
+QUEUE_FILENAME = 'jobs.sqlite'
+LIMITER_FILENAME = 'limiter.sqlite'
+
+# one esearch window of a search: its terms, as lists of str, and the
+# window's ret_start and ret_max
+Job = namedtuple('Job', ['id', 'terms', 'ret_start', 'ret_max', 'attempts'])
+
+
+def _str(token): 
+    return token.decode('utf-8') if isinstance(token, bytes) else str(token)
+
+
+def _terms(kw): 
+    """
+    Search terms (see KeyWordQuery.load) as lists of str, for JSON. 
+    """
+    return [[_str(token) for token in li] for li in kw]
+
+
+class JobQueue(object): 
+    """
+    Queue of esearch windows to harvest, in an SQLite database that any 
+    number of worker processes (see Worker) claim jobs from. 
+
+    A job is claimed with a lease: a worker that dies, or stops renewing 
+    the lease, loses the job to the next worker once the lease runs out. 
+    Each efetch batch of a job is recorded once it's saved, in the same 
+    transaction that holds the queue's lock while the batch is written 
+    (see 'saving'), so batches are neither saved twice nor by a worker 
+    whose lease has run out. 
+
+    Parameters
+    ------------
+    path : str
+        SQLite database file, or the folder to keep it in (as jobs.sqlite). 
+        Created if it doesn't exist. 
+
+    lease : float
+        Seconds a worker holds a job for without renewing it. 
+
+    max_attempts : int
+        Times a job is claimed before a failure marks it 'failed' rather 
+        than 'pending'. 
+
+    timeout : float
+        Seconds to wait for another process's lock. 
+    """
+    def __init__(self, path, lease=300., max_attempts=3, timeout=60.): 
+        if os.path.isdir(path): 
+            path = os.path.join(path, QUEUE_FILENAME)
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as db: 
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY '
+                       'KEY, key TEXT UNIQUE, terms TEXT, ret_start INTEGER, '
+                       'ret_max INTEGER, state TEXT, owner TEXT, lease REAL, '
+                       'attempts INTEGER, error TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS batches (job INTEGER, '
+                       'uid_start INTEGER, PRIMARY KEY (job, uid_start))')
+            db.execute('CREATE TABLE IF NOT EXISTS pmids (pmid INTEGER '
+                       'PRIMARY KEY)')
+
+    def _transaction(self): 
+        return immediate(self._local, self.path, self.timeout)
+
+    def add(self, kw, n, window=query.UID_RETMAX): 
+        """
+        Adds the esearch windows of the first 'n' results of the search 
+        'kw' (a list of search terms, see KeyWordQuery.load), 'window' 
+        Pubmed IDs each. Windows that are already queued are left as they 
+        are, so adding a search again doesn't repeat it. Returns the number 
+        of jobs added. 
+        """
+        terms = json.dumps(_terms(kw))
+        n, window = int(n), min(int(window), query.UID_RETMAX)
+        added = 0
+        with self._transaction() as db: 
+            for ret_start in range(0, n, window): 
+                ret_max = min(window, n - ret_start)
+                key = hashlib.sha1(json.dumps([terms, ret_start, ret_max])
+                                   .encode('utf-8')).hexdigest()
+                added += db.execute(
+                        'INSERT OR IGNORE INTO jobs VALUES (NULL, ?, ?, ?, ?, '
+                        "'pending', NULL, NULL, 0, NULL)", 
+                        (key, terms, ret_start, ret_max)).rowcount
+        return added
+
+    def claim(self, owner): 
+        """
+        Claims the first job that is pending, or whose lease has run out, 
+        for 'owner'. None if there is none. 
+        """
+        now = time.time()
+        with self._transaction() as db: 
+            row = db.execute("SELECT id, terms, ret_start, ret_max, attempts "
+                             "FROM jobs WHERE state = 'pending' OR (state = "
+                             "'running' AND lease < ?) ORDER BY id LIMIT 1", 
+                             (now,)).fetchone()
+            if row is None: 
+                return None
+            db.execute("UPDATE jobs SET state = 'running', owner = ?, "
+                       'lease = ?, attempts = attempts + 1 WHERE id = ?', 
+                       (owner, now + self.lease, row[0]))
+        return Job(row[0], json.loads(row[1]), row[2], row[3], row[4] + 1)
+
+    def _owns(self, db, job, owner): 
+        return db.execute("SELECT 1 FROM jobs WHERE id = ? AND owner = ? AND "
+                          "state = 'running' AND lease >= ?", 
+                          (job.id, owner, time.time())).fetchone() is not None
+
+    def renew(self, job, owner): 
+        """
+        Extends the lease of 'owner' on 'job'. False if it was lost. 
+        """
+        with self._transaction() as db: 
+            if not self._owns(db, job, owner): 
+                return False
+            db.execute('UPDATE jobs SET lease = ? WHERE id = ?', 
+                       (time.time() + self.lease, job.id))
+        return True
+
+    def saved(self, job): 
+        """
+        ret_starts of the efetch batches of 'job' that have been saved. 
+        """
+        db = connect(self._local, self.path, self.timeout)
+        return set(row[0] for row in db.execute(
+                'SELECT uid_start FROM batches WHERE job = ?', (job.id,)))
+
+    def unsaved(self, pmids): 
+        """
+        Those of the Pubmed IDs 'pmids' that no batch has saved yet, which 
+        are recorded as saved. Called inside 'saving', so that they're 
+        recorded, or rolled back, with the batch. 
+        """
+        db = connect(self._local, self.path, self.timeout)
+        return [pmid for pmid in pmids if db.execute(
+                'INSERT OR IGNORE INTO pmids VALUES (?)', (int(pmid),)
+                ).rowcount]
+
+    def saving(self, job, owner, uid_start): 
+        """
+        Context manager around saving one efetch batch: it holds the 
+        queue's lock, and yields False (save nothing) if the batch was 
+        saved already or the lease was lost. The batch is recorded, and 
+        the lease renewed, if the block finishes without an exception. 
+        """
+        return _Saving(self, job, owner, uid_start)
+
+    def complete(self, job, owner): 
+        """
+        Marks 'job' done. False if the lease was lost. 
+        """
+        with self._transaction() as db: 
+            if not self._owns(db, job, owner): 
+                return False
+            db.execute("UPDATE jobs SET state = 'done' WHERE id = ?", 
+                       (job.id,))
+        return True
+
+    def fail(self, job, owner, error): 
+        """
+        Gives 'job' back to the queue, or marks it 'failed' once it's been 
+        tried max_attempts times. 
+        """
+        state = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        with self._transaction() as db: 
+            db.execute('UPDATE jobs SET state = ?, owner = NULL, error = ? '
+                       'WHERE id = ? AND owner = ?', 
+                       (state, str(error), job.id, owner))
+
+    def retry_failed(self): 
+        """
+        Makes failed jobs pending again, with their attempts reset. 
+        """
+        with self._transaction() as db: 
+            return db.execute("UPDATE jobs SET state = 'pending', attempts = "
+                              "0 WHERE state = 'failed'").rowcount
+
+    def counts(self): 
+        """
+        Number of jobs in each state: pending, running, done and failed. 
+        """
+        db = connect(self._local, self.path, self.timeout)
+        counts = dict.fromkeys(('pending', 'running', 'done', 'failed'), 0)
+        counts.update(db.execute('SELECT state, COUNT(*) FROM jobs '
+                                 'GROUP BY state'))
+        return counts
+
+    def errors(self): 
+        """
+        Last error of each job that has one, by job id. 
+        """
+        db = connect(self._local, self.path, self.timeout)
+        return dict(db.execute('SELECT id, error FROM jobs '
+                               'WHERE error IS NOT NULL'))
+
+
+class _Saving(object): 
+    def __init__(self, queue, job, owner, uid_start): 
+        self.queue = queue
+        self.job = job
+        self.owner = owner
+        self.uid_start = uid_start
+
+    def __enter__(self): 
+        self._transaction = self.queue._transaction()
+        db = self._transaction.__enter__()
+        if not self.queue._owns(db, self.job, self.owner): 
+            return False
+        self.ok = db.execute('SELECT 1 FROM batches WHERE job = ? AND '
+                             'uid_start = ?', (self.job.id, self.uid_start)
+                             ).fetchone() is None
+        if self.ok: 
+            db.execute('INSERT INTO batches VALUES (?, ?)', 
+                       (self.job.id, self.uid_start))
+            db.execute('UPDATE jobs SET lease = ? WHERE id = ?', 
+                       (time.time() + self.queue.lease, self.job.id))
+        return self.ok
+
+    def __exit__(self, *exc_info): 
+#        rolled back, batch record included, if saving raised
+        return self._transaction.__exit__(*exc_info)
+
+
+def default_owner(): 
+    return '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), 
+                                threading.get_ident())
+
+
+class Worker(object): 
+    """
+    Drains a JobQueue: for each job claimed, downloads the esearch window 
+    and its summaries, and appends them to 'save_folder' like 
+    Pipeline.request does. Any number of Workers, in any number of 
+    processes, can drain the same queue; their requests share one 
+    SharedTokenBucket, so together they send at most NCBI's rate. 
+
+    Summaries are written while the queue's lock is held (see 
+    JobQueue.saving), so workers never write the files at the same time. 
+    Articles that are already stored, e.g. because another job's search 
+    overlaps this one's, are left out, and count as saved: the worker 
+    reads what 'save_folder' holds once, and the queue records what its 
+    workers save from then on (see JobQueue.unsaved). Each job is saved 
+    through one writer, which only keeps the files open while it appends 
+    to them. 
+
+    Parameters
+    ------------
+    queue : JobQueue or str
+        The queue, or its path. 
+
+    save_folder : str
+        Where summaries are saved. 
+
+    layout : str
+        See SummarySoup.save. 
+
+    api_key : str
+        Sent with every request. 
+
+    limiter : limiter.TokenBucket
+        Defaults to a SharedTokenBucket for 'api_key' in limiter.sqlite, 
+        next to the queue. Pass one SharedTokenBucket path to all the 
+        harvests of a host so that they share the limit too. 
+
+    owner : str
+        Name of the worker in the queue. Defaults to host, process and 
+        thread. 
+
+    base_urls : dict
+        E-utilities URLs to use instead of NCBI's, by query: 'kw_query' 
+        (esearch) and 'uid_query' (efetch), e.g. for a mirror. 
+
+    pipeline_kwargs : 
+        Passed to the worker's Pipeline, e.g. session, cache, retry, 
+        metrics or indexes. One Pipeline, and so one HTTP session, 
+        harvests all of the worker's jobs, so connections to NCBI are 
+        reused from one job to the next. 
+    """
+    def __init__(self, queue, save_folder, layout='columns', api_key=None, 
+                 limiter=None, owner=None, base_urls=None, 
+                 **pipeline_kwargs): 
+        if not isinstance(queue, JobQueue): 
+            queue = JobQueue(queue)
+        self.queue = queue
+        self.save_folder = save_folder
+        self.layout = layout
+        self.api_key = api_key
+        if limiter is None: 
+            limiter = SharedTokenBucket.for_api_key(os.path.join(
+                    os.path.dirname(queue.path), LIMITER_FILENAME), api_key)
+        self.limiter = limiter
+        self.owner = default_owner() if owner is None else owner
+        self.base_urls = base_urls or {}
+        self.pipeline_kwargs = pipeline_kwargs
+        self._pipe = None
+        self._known = None
+
+    def _pipeline(self, job): 
+        """
+        The worker's Pipeline, made for its first job and pointed at the 
+        search terms of each later one. 
+        """
+        terms = [[token.encode('utf-8') for token in li] for li in job.terms]
+        if self._pipe is not None: 
+            self._pipe.kw_query.load(terms=terms)
+            return self._pipe
+        pipe = Pipeline(terms, self.api_key, limiter=self.limiter, 
+                        **self.pipeline_kwargs)
+        pipe.set_base_urls(self.base_urls)
+        self._pipe = pipe
+        return pipe
+
+    def process(self, job): 
+        """
+        Harvests one claimed job. False if its lease was lost on the way. 
+        """
+        pipe = self._pipeline(job)
+        saved = self.queue.saved(job)
+        if self._known is None: 
+            self._known = known_pmids(self.save_folder)
+        writer = None
+        try: 
+            for uid_start in pipe.search_window(job.ret_start, job.ret_max): 
+                if uid_start in saved: 
+                    continue
+                if not self.queue.renew(job, self.owner): 
+                    return False
+                records = drop_known(pipe.fetch_batch(uid_start), 
+                                     self._known)
+                with self.queue.saving(job, self.owner, uid_start) as ok: 
+                    if not ok: 
+                        return False
+                    new = set(self.queue.unsaved(
+                            record_pmid(r.uid) for r in records))
+                    records = [r for r in records if record_pmid(r.uid) in new]
+                    if writer is None: 
+                        writer = open_writer(self.save_folder, self.layout)
+                    pipe.save_batch(writer, records)
+        finally: 
+            if writer is not None: 
+                writer.close()
+        return self.queue.complete(job, self.owner)
+
+    def run(self, max_jobs=None): 
+        """
+        Claims and harvests jobs until the queue has none left to claim, or 
+        'max_jobs' have been done. A job whose requests fail is given back 
+        to the queue (see JobQueue.fail). Returns the number of jobs done. 
+        """
+        done = 0
+        while max_jobs is None or done < max_jobs: 
+            job = self.queue.claim(self.owner)
+            if job is None: 
+                break
+            try: 
+                if self.process(job): 
+                    done += 1
+            except ConnectionError as e: 
+                self.queue.fail(job, self.owner, repr(e))
+            except BaseException as e: 
+                self.queue.fail(job, self.owner, repr(e))
+                raise
+        return done
+
+
+def _work(queue_path, save_folder, kwargs): 
+    Worker(queue_path, save_folder, **kwargs).run()
+
+
+def run_workers(queue, save_folder, n_workers=4, **kwargs): 
+    """
+    Drains 'queue' (a JobQueue or its path) with 'n_workers' Worker 
+    processes, and returns its JobQueue.counts once they're done. 
+    'kwargs' are passed to each Worker, and must be picklable. 
+    """
+    path = queue.path if isinstance(queue, JobQueue) else JobQueue(queue).path
+    processes = [multiprocessing.Process(
+            target=_work, args=(path, save_folder, kwargs)) 
+            for _ in range(n_workers)]
+    for process in processes: 
+        process.start()
+    for process in processes: 
+        process.join()
+    return JobQueue(path).counts()
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from requests.exceptions import ConnectionError, Timeout
+from email.utils import parsedate_to_datetime
+import datetime
+import asyncio
+import threading
+import random
+import time
+
+from sqlite_db import immediate
+
+# NCBI cannot accept more than three requests per second, or ten if the
+# requests carry an api_key
+NCBI_RATE = 3
+NCBI_RATE_API_KEY = 10
+# responses worth sending the request again for: too many requests, and
+# server errors that are usually gone a moment later
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object): 
+    """
+    Token bucket shared by everything that sends requests to NCBI. Each
+    request takes one token; tokens are refilled at 'rate' per second up to
+    'capacity'.
+
+    Waiting callers reserve their token up front (the token count is allowed
+    to go negative), so concurrent callers are spaced out by 1/rate seconds
+    instead of all waking up at the same time.
+
+    The rate adapts to NCBI's answers (see RetryPolicy): each 429 response
+    multiplies it by 'decrease', at most once per second however many
+    requests were in flight, and successful responses bring it back up
+    by 'increase' requests per second every second, to at most the rate 
+    the bucket was made with. 
+
+    Parameters
+    ------------
+    rate : float
+        Tokens added per second.
+
+    capacity : int
+        Largest burst allowed. The default of 1 never lets more than 'rate'
+        requests through in any one second window.
+
+    min_rate : float
+        Lowest rate 429s can bring the bucket down to. Defaults to rate/10.
+
+    decrease : float
+        Factor applied to the rate on a 429 response.
+
+    increase : float
+        Rate regained per second of successful requests. Defaults to 
+        rate/10.
+    """
+    def __init__(self, rate=NCBI_RATE, capacity=1, min_rate=None, 
+                 decrease=0.5, increase=None): 
+        self.rate = float(rate)
+        self.max_rate = self.rate
+        self.min_rate = self.rate/10 if min_rate is None else float(min_rate)
+        self.decrease = float(decrease)
+        self.increase = self.rate/10 if increase is None else float(increase)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_api_key(cls, api_key=None, capacity=1): 
+        """
+        Bucket sized to NCBI's limit with or without an api_key.
+        """
+        rate = NCBI_RATE if api_key is None else NCBI_RATE_API_KEY
+        return cls(rate, capacity)
+
+    def _refill(self, now): 
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def _reserve(self): 
+        """
+        Takes one token and returns the number of seconds the caller has to
+        wait before using it.
+        """
+        with self._lock: 
+            self._refill(time.monotonic())
+            self._tokens -= 1.
+            if self._tokens >= 0: 
+                return 0.
+            return -self._tokens / self.rate
+
+    def acquire(self): 
+        """
+        Blocks until a token is available. Returns the time spent waiting.
+        """
+        wait = self._reserve()
+        if wait > 0: 
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self): 
+        """
+        Like acquire, but yields to the event loop while waiting.
+        """
+        wait = self._reserve()
+        if wait > 0: 
+            await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds): 
+        """
+        No token is handed out for the next 'seconds' seconds, e.g. as a 
+        response's Retry-After header asks. 
+        """
+        with self._lock: 
+            self._refill(time.monotonic())
+#            waiters are spaced out after the pause like any other deficit
+            self._tokens = min(self._tokens, -float(seconds) * self.rate)
+
+    def throttled(self, retry_after=None): 
+        """
+        Called on a 429 response: lowers the rate and, if the response 
+        said how long to wait, pauses for that long. 
+        """
+        with self._lock: 
+            now = time.monotonic()
+            self._refill(now)
+            if self._last_decrease is None or now - self._last_decrease >= 1.: 
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+        if retry_after: 
+            self.pause(retry_after)
+
+    def succeeded(self): 
+        """
+        Called on a successful response: raises the rate back towards 
+        'max_rate'. 
+        """
+        if self.rate >= self.max_rate: 
+            return
+        with self._lock: 
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, 
+                            self.rate + self.increase / self.rate)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_bucket(api_key=None): 
+    """
+    TokenBucket.for_api_key, shared by every caller in the process that 
+    uses the same 'api_key', e.g. separate calls to request.request. 
+    """
+    with _shared_lock: 
+        if api_key not in _shared: 
+            _shared[api_key] = TokenBucket.for_api_key(api_key)
+        return _shared[api_key]
+
+
+class SharedTokenBucket(TokenBucket): 
+    """
+    TokenBucket whose state lives in an SQLite database, so that every 
+    process using the same file and 'name' shares one rate, e.g. several 
+    harvesters on one host with the same api_key (see jobqueue.Worker). 
+    Tokens are reserved in a transaction that locks the database, so the 
+    processes together never exceed the rate, and 429s and Retry-After 
+    pauses slow all of them down. 
+
+    Processes on different hosts can share a file on a network filesystem 
+    if its locks work (SQLite's usual caveats apply) and their clocks agree, 
+    since refills are timed with time.time(). 
+
+    Parameters
+    ------------
+    path : str
+        SQLite database file; created if it doesn't exist. 
+
+    name : str
+        Buckets with different names in one file are independent, e.g. one 
+        per api_key. 
+
+    rate, capacity, min_rate, decrease, increase : 
+        See TokenBucket. The first process to create the bucket sets them; 
+        others use the stored ones. 
+
+    timeout : float
+        Seconds to wait for another process's lock before raising 
+        sqlite3.OperationalError. 
+    """
+    def __init__(self, path, name='default', rate=NCBI_RATE, capacity=1, 
+                 min_rate=None, decrease=0.5, increase=None, timeout=60.): 
+        super().__init__(rate, capacity, min_rate, decrease, increase)
+        self.path = path
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as db: 
+            db.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY '
+                       'KEY, tokens REAL, last REAL, rate REAL, max_rate REAL, '
+                       'min_rate REAL, last_decrease REAL)')
+            db.execute('INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?, ?, '
+                       '?, NULL)', (name, self.capacity, time.time(), 
+                                    self.rate, self.max_rate, self.min_rate))
+            self._load(db)
+
+    @classmethod
+    def for_api_key(cls, path, api_key=None, capacity=1): 
+        """
+        Bucket sized to NCBI's limit with or without an api_key, named 
+        after the api_key. 
+        """
+        rate = NCBI_RATE if api_key is None else NCBI_RATE_API_KEY
+        return cls(path, str(api_key), rate, capacity)
+
+    def _transaction(self): 
+        return immediate(self._local, self.path, self.timeout)
+
+    def _load(self, db): 
+        self._tokens, self._last, self.rate, self.max_rate, self.min_rate, \
+                self._last_decrease = db.execute(
+                        'SELECT tokens, last, rate, max_rate, min_rate, '
+                        'last_decrease FROM buckets WHERE name = ?', 
+                        (self.name,)).fetchone()
+
+    def _store(self, db): 
+        db.execute('UPDATE buckets SET tokens = ?, last = ?, rate = ?, '
+                   'last_decrease = ? WHERE name = ?', 
+                   (self._tokens, self._last, self.rate, self._last_decrease, 
+                    self.name))
+
+    def _reserve(self): 
+        with self._lock, self._transaction() as db: 
+            self._load(db)
+            self._refill(time.time())
+            self._tokens -= 1.
+            self._store(db)
+            if self._tokens >= 0: 
+                return 0.
+            return -self._tokens / self.rate
+
+    def pause(self, seconds): 
+        with self._lock, self._transaction() as db: 
+            self._load(db)
+            self._refill(time.time())
+            self._tokens = min(self._tokens, -float(seconds) * self.rate)
+            self._store(db)
+
+    def throttled(self, retry_after=None): 
+        with self._lock, self._transaction() as db: 
+            self._load(db)
+            now = time.time()
+            self._refill(now)
+            if self._last_decrease is None or now - self._last_decrease >= 1.: 
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            self._store(db)
+        if retry_after: 
+            self.pause(retry_after)
+
+    def succeeded(self): 
+#        'rate' is as of this process's last transaction, which is good 
+#        enough to skip one when the rate is already at its maximum
+        if self.rate >= self.max_rate: 
+            return
+        with self._lock, self._transaction() as db: 
+            self._load(db)
+            self._refill(time.time())
+            self.rate = min(self.max_rate, 
+                            self.rate + self.increase / self.rate)
+            self._store(db)
+
+
+class RetryPolicy(object): 
+    """
+    Sends requests to NCBI until one succeeds. Network errors and the 
+    responses in 'statuses' are tried again after an exponential backoff 
+    with full jitter: the n-th retry waits a random time between 0 and 
+    backoff*2**n seconds (at most 'max_backoff'), so clients that failed 
+    together don't retry together. A response's Retry-After header takes 
+    precedence over the backoff. 
+
+    Any other response, or running out of retries, raises a 
+    requests.exceptions.ConnectionError, as a failed request always has. 
+
+    Parameters
+    ------------
+    max_retries : int
+        Retries after the first attempt. 0 doesn't retry.
+
+    backoff : float
+        Largest wait, in seconds, before the first retry.
+
+    max_backoff : float
+        Largest wait before any retry, unless Retry-After asks for longer.
+
+    statuses : tuple of int
+        Status codes worth retrying.
+
+    seed : int
+        Seed of the jitter's random number generator.
+    """
+    def __init__(self, max_retries=5, backoff=0.5, max_backoff=60., 
+                 statuses=RETRY_STATUSES, seed=None): 
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self._random = random.Random(seed)
+
+    def delay(self, attempt): 
+        """
+        Seconds to wait before retry number 'attempt' (starting at 0).
+        """
+        return self._random.uniform(
+                0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    @staticmethod
+    def retry_after(response): 
+        """
+        Seconds the Retry-After header of 'response' asks to wait, given 
+        either in seconds or as an HTTP date. None if there is none. 
+        """
+        value = response.headers.get('Retry-After')
+        if value is None: 
+            return None
+        value = value.strip()
+        if value.isdigit(): 
+            return float(value)
+        try: 
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError): 
+            return None
+        now = datetime.datetime.now(date.tzinfo)
+        return max(0., (date - now).total_seconds())
+
+    def send(self, request, limiter=None, acquired=False, metrics=None): 
+        """
+        Returns the text of the first successful response to 'request', 
+        which is what Query.as_request returns. 
+
+        Parameters
+        ------------
+        request : callable
+            Sends the request and returns its response.
+
+        limiter : TokenBucket
+            Each attempt takes a token, and is reported back to it so that 
+            its rate can adapt.
+
+        acquired : bool
+            The first attempt's token has already been taken.
+
+        metrics : metrics.Metrics
+            If given, records the requests and retries sent, the latency 
+            and size of each response, and the time spent waiting for the 
+            limiter.
+        """
+        attempt = 0
+        while True: 
+            if limiter is not None and not acquired: 
+                wait = limiter.acquire()
+                if metrics is not None: 
+                    metrics.observe('limiter_wait_seconds', wait)
+            acquired = False
+            wait = None
+            if metrics is not None: 
+                metrics.incr('requests')
+                start = time.perf_counter()
+            try: 
+                with request() as req: 
+                    if req.status_code == 200: 
+                        text = req.text
+                        if limiter is not None: 
+                            limiter.succeeded()
+                        if metrics is not None: 
+                            metrics.observe('request_seconds', 
+                                            time.perf_counter() - start)
+                            metrics.incr('request_bytes', len(req.content))
+                        return text
+                    status = req.status_code
+                    error = ConnectionError(response=req, request=req.request)
+                    wait = self.retry_after(req)
+            except (ConnectionError, Timeout) as e: 
+                if getattr(e, 'response', None) is not None: 
+                    raise
+                status, error = None, e
+
+            if status == 429 and limiter is not None: 
+                limiter.throttled(wait)
+            elif wait and limiter is not None: 
+                limiter.pause(wait)
+            if attempt >= self.max_retries \
+               or (status is not None and status not in self.statuses): 
+                print(status if status is not None else error)
+                raise error
+            if wait is None: 
+                wait = self.delay(attempt)
+            elif limiter is not None: 
+#                the limiter holds every request back until then
+                wait = 0.
+            print('{0}: retry {1} of {2} in {3:.2f} s'.format(
+                    status if status is not None else type(error).__name__, 
+                    attempt + 1, self.max_retries, wait))
+            if metrics is not None: 
+                metrics.incr('retries')
+            time.sleep(wait)
+            attempt += 1
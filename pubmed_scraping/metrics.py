@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from contextlib import contextmanager
+import functools
+import threading
+import datetime
+import json
+import math
+import time
+
+# sub-buckets per doubling of a Histogram's values, i.e. quantiles are
+# accurate to about 2**(1/4) - 1 = 19%
+_BUCKETS_PER_OCTAVE = 4
+
+# what the pipelines record:
+# requests, retries, request_bytes          counters
+# request_seconds                           histogram, one value per attempt
+# limiter_wait_seconds                      histogram, one value per token
+# parse_seconds, parse_seconds_per_article  histograms, one value per response
+# articles                                  counter, articles parsed
+# write_seconds                             histogram, one value per batch
+# articles_written                          counter
+# index_seconds                             histogram, one value per index
+#                                           and batch
+
+
+class Histogram(object): 
+    """
+    Count, sum, min and max of a series of values, plus counts in 
+    logarithmic buckets from which quantiles are estimated. 
+    """
+    def __init__(self): 
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self._buckets = {}
+
+    @staticmethod
+    def _bucket(value): 
+        if value <= 0: 
+            return None
+        return math.floor(math.log2(value)*_BUCKETS_PER_OCTAVE)
+
+    def add(self, value): 
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = self._bucket(value)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def quantile(self, q): 
+        """
+        Estimate of the q-th quantile (0 <= q <= 1), or None if nothing 
+        has been added. 
+        """
+        if not self.count: 
+            return None
+        rank = q*self.count
+        seen = 0
+#        None (values <= 0) sorts first
+        for bucket in sorted(self._buckets, key=lambda b: (b is not None, b)): 
+            seen += self._buckets[bucket]
+            if seen >= rank: 
+                if bucket is None: 
+                    return min(0., self.max)
+                upper = 2**((bucket + 1)/_BUCKETS_PER_OCTAVE)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def as_dict(self): 
+        if not self.count: 
+            return {'count': 0}
+        return {'count': self.count, 'sum': self.total, 
+                'mean': self.total/self.count, 'min': self.min, 
+                'max': self.max, 'p50': self.quantile(0.5), 
+                'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Metrics(object): 
+    """
+    Counters and histograms of what a pipeline spends its time on. Safe to 
+    share between the threads of a pipeline. Each run (see 'run') starts 
+    by resetting it, so pipelines sharing one instance would wipe each 
+    other's values: give each pipeline its own, and aggregate them with 
+    'callbacks' if need be. 
+
+    Every value recorded is also passed to each callback as (name, value), 
+    e.g. to forward it to a monitoring system. 
+
+    Parameters
+    ------------
+    path : str
+        If given, a JSON line with the metrics of each run (see 'run') is 
+        appended to this file. 
+
+    callbacks : iterable
+        Functions of (name, value). 
+    """
+    def __init__(self, path=None, callbacks=()): 
+        self.path = path
+        self.callbacks = list(callbacks)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self): 
+        with self._lock: 
+            self.counters = {}
+            self.histograms = {}
+
+    def _notify(self, name, value): 
+        for callback in self.callbacks: 
+            callback(name, value)
+
+    def incr(self, name, value=1): 
+        """
+        Adds 'value' to the counter 'name'. 
+        """
+        with self._lock: 
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._notify(name, value)
+
+    def observe(self, name, value): 
+        """
+        Adds 'value' to the histogram 'name'. 
+        """
+        with self._lock: 
+            if name not in self.histograms: 
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(value)
+        self._notify(name, value)
+
+    @contextmanager
+    def timer(self, name): 
+        """
+        Context manager that observes the seconds spent in its block. 
+        """
+        start = time.perf_counter()
+        try: 
+            yield
+        finally: 
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self): 
+        """
+        Dict of the current values of all counters and histograms. 
+        """
+        with self._lock: 
+            return {'counters': dict(self.counters), 
+                    'histograms': {name: h.as_dict() 
+                                   for name, h in self.histograms.items()}}
+
+    @contextmanager
+    def run(self, **info): 
+        """
+        Context manager around one run, e.g. a call to Pipeline.request. The 
+        metrics are reset when it starts; when it ends, a JSON line with 
+        'info', the run's start time, duration and outcome and the 
+        snapshot is appended to 'path', if it was given. 
+        """
+        self.reset()
+        started = datetime.datetime.now()
+        start = time.perf_counter()
+        status = 'error'
+        try: 
+            yield self
+            status = 'ok'
+        finally: 
+            if self.path is not None: 
+                line = dict(info, started=started.isoformat(), status=status, 
+                            seconds=time.perf_counter() - start)
+                line.update(self.snapshot())
+                with open(self.path, 'a') as f: 
+                    f.write(json.dumps(line) + '\n')
+
+
+def record_run(request): 
+    """
+    Decorator for a pipeline's 'request' method: the call is a Metrics.run 
+    of the pipeline's metrics. 
+    """
+    @functools.wraps(request)
+    def wrapper(self, n, *args, **kwargs): 
+        with self.metrics.run(pipeline=type(self).__name__, 
+                              search_terms=self.kw_query.search_terms.term, 
+                              n=int(n)): 
+            return request(self, n, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from requests.exceptions import ConnectionError
+from concurrent.futures import ProcessPoolExecutor
+import threading
+import queue
+import time
+
+from pipeline import Pipeline
+from stream import iter_summaries
+from metrics import record_run
+
+# marks the end of a queue
+_DONE = None
+
+
+def parse_summaries(raw): 
+    """
+    Parser worker: raw efetch XML to a list of SummaryRecords.
+    """
+    return list(iter_summaries(raw))
+
+
+def _timed_parse(raw): 
+    """
+    parse_summaries, and the seconds it took in the worker. 
+    """
+    start = time.perf_counter()
+    records = parse_summaries(raw)
+    return time.perf_counter() - start, records
+
+
+class ParallelPipeline(Pipeline): 
+    """
+    Same as Pipeline, except that downloading, parsing and saving run as
+    separate stages connected by bounded queues:
+
+        fetcher (calling thread) -> raw_queue -> parser processes
+            -> parsed_queue -> writer thread
+
+    The fetcher only downloads efetch responses, so the next request is
+    sent while earlier responses are being parsed. Responses are parsed
+    into SummaryRecords (see stream.iter_summaries) by a pool of
+    'n_workers' processes, and a single writer thread appends batches in
+    the order they were requested; its writer only opens the file while
+    it appends to it (see storage.GroupWriter).
+
+    A full queue blocks the stage that feeds it, so at most about
+    raw_depth + parsed_depth + 2 efetch batches are held in memory at once,
+    however far the fetcher gets ahead of the parsers.
+
+    Parameters
+    ------------
+    kw, api_key, session, cache :
+        See Pipeline.
+
+    n_workers : int
+        Parser processes. Defaults to the number of CPUs.
+
+    raw_depth : int
+        Downloaded responses that can wait to be handed to a parser.
+
+    parsed_depth : int
+        Batches that can be in the parsers or wait for the writer.
+
+    limiter, retry, metrics, indexes :
+        See Pipeline. Parse times are measured in the parser processes.
+    """
+    def __init__(self, kw, api_key=None, n_workers=None, raw_depth=4,
+                 parsed_depth=4, limiter=None, session=None, cache=None, 
+                 retry=None, metrics=None, indexes=()): 
+        super().__init__(kw, api_key, session=session, cache=cache, 
+                         limiter=limiter, retry=retry, metrics=metrics, 
+                         indexes=indexes)
+        self.n_workers = n_workers
+        self.raw_depth = raw_depth
+        self.parsed_depth = parsed_depth
+
+    def _put(self, q, item, failed): 
+        """
+        Blocks until 'item' is in 'q', unless another stage has failed.
+        """
+        while not failed.is_set(): 
+            try: 
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full: 
+                pass
+        return False
+
+    def _dispatch(self, raw_queue, parsed_queue, executor, failed): 
+        while True: 
+            item = raw_queue.get()
+            if item is _DONE: 
+                self._put(parsed_queue, _DONE, failed)
+                return
+            step, raw = item
+            if raw is not None: 
+                raw = executor.submit(_timed_parse, raw)
+            if not self._put(parsed_queue, (step, raw), failed): 
+                return
+
+    def _write(self, parsed_queue, harvest, errors, failed): 
+        try: 
+            while True: 
+                item = parsed_queue.get()
+                if item is _DONE: 
+                    return
+                step, future = item
+                if future is None: 
+                    harvest.done(step.window)
+                    continue
+                seconds, records = future.result()
+                self._observe_parse(seconds, len(records))
+                harvest.save(records, step.window, step.uids)
+        except Exception as e: 
+            errors.append(e)
+            failed.set()
+
+    @record_run
+    def request(self, n, save_folder='', layout='groups', resume=True,
+                use_history=False, incremental=False): 
+        """
+        See Pipeline.request.
+        """
+        self._setup(n, use_history)
+        n = int(n)
+        known = self._known(save_folder, incremental, use_history)
+        checkpoint = None
+        if known is None: 
+            checkpoint = self._checkpoint(save_folder, resume)
+        raw_queue = queue.Queue(self.raw_depth)
+        parsed_queue = queue.Queue(self.parsed_depth)
+        failed = threading.Event()
+        errors = []
+        harvest = self._harvest(save_folder, layout, checkpoint, 
+                                known is not None)
+
+        with ProcessPoolExecutor(self.n_workers) as executor: 
+            dispatcher = threading.Thread(
+                    target=self._dispatch,
+                    args=(raw_queue, parsed_queue, executor, failed))
+            writer_thread = threading.Thread(
+                    target=self._write,
+                    args=(parsed_queue, harvest, errors, failed))
+            dispatcher.start()
+            writer_thread.start()
+            try: 
+                for step in self._windows(n, use_history, save_folder,
+                                          checkpoint, known): 
+#                    whole KeyWordQuery windows are marked by the writer,
+#                    after their last batch
+                    raw = None
+                    if step.fetch: 
+                        raw = self._fetch(self.uid_query)
+                    if not self._put(raw_queue, (step, raw), failed): 
+                        break
+            except ConnectionError as e: 
+                if e.response is not None: 
+                    print(e.response.reason)
+                raise ConnectionError(response=e.response, request=e.request)
+            finally: 
+#                batches that were downloaded are still parsed and saved,
+#                unless saving is what failed
+                if not self._put(raw_queue, _DONE, failed): 
+                    for q in (raw_queue, parsed_queue): 
+                        while not q.empty(): 
+                            q.get()
+                        q.put(_DONE)
+                dispatcher.join()
+                writer_thread.join()
+                harvest.close()
+        if errors: 
+            raise errors[0]
+        harvest.finish()
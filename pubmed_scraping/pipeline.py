@@ -19,41 +19,424 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple
+import asyncio
 import time
 
 import query
 import soups 
+from limiter import TokenBucket, RetryPolicy
+from checkpoint import Checkpoint, query_key
+from storage import known_pmids, drop_known, FetchedLog, open_writer
+from metrics import Metrics, record_run
+from stream import iter_summaries
+
+# one step of a harvest (see Pipeline._windows): an efetch batch if 'fetch', 
+# else the end of a KeyWordQuery window. 'window' identifies it in the 
+# Checkpoint, and 'uids' are added to the FetchedLog once it's saved. 
+Step = namedtuple('Step', ['fetch', 'window', 'uids'])
+
+
+class _Harvest(object): 
+    """
+    Where one run of a pipeline saves its summaries: a single writer, kept 
+    open for the whole run, and the Checkpoint and FetchedLog recording 
+    what has been saved. 
+    
+    A window is only marked after its summaries are written, so a run 
+    that stops in between fetches them again when resumed; summaries 
+    whose Pubmed IDs are in 'stored' are left out, so they aren't saved 
+    twice. Once the whole harvest is saved, 'finish' clears the 
+    checkpoint, so that the next run of the same search sends its 
+    requests again, e.g. to pick up new results. 
+    
+    Parameters
+    ------------
+    pipeline : Pipeline
+        Times the writes and updates its indexes. 
+    
+    save_folder, layout : 
+        See Pipeline.request. Nothing is written without a save_folder. 
+    
+    checkpoint : checkpoint.Checkpoint
+    
+    fetched : storage.FetchedLog
+    
+    stored : UIDArray
+        Pubmed IDs already saved to 'save_folder'. 
+    """
+    def __init__(self, pipeline, save_folder, layout, checkpoint=None, 
+                 fetched=None, stored=None): 
+        self.pipeline = pipeline
+        self.checkpoint = checkpoint
+        self.fetched = fetched
+        self.stored = stored
+        self.writer = None
+        if save_folder: 
+            self.writer = open_writer(save_folder, layout)
+    
+    def save(self, records, window=None, uids=None): 
+        """
+        Writes an iterable of SummaryRecords, then records 'window' and 
+        'uids' as done. 
+        """
+        if self.stored is not None: 
+            records = drop_known(records, self.stored)
+        if self.writer is not None: 
+            self.pipeline.save_batch(self.writer, records)
+        self.done(window, uids)
+    
+    def done(self, window=None, uids=None): 
+        """
+        Marks 'window', a (kw_start, uid_start) tuple, in the checkpoint, 
+        and adds the Pubmed IDs 'uids' to the FetchedLog. 
+        """
+        if self.checkpoint and window is not None: 
+            self.checkpoint.mark(*window)
+        if self.fetched is not None and uids is not None: 
+            self.fetched.append(uids)
+    
+    def close(self): 
+        if self.writer is not None: 
+            self.writer.close()
+            self.writer = None
+    
+    def finish(self): 
+        """
+        Closes the harvest once all of it has been saved, and clears the 
+        checkpoint. 
+        """
+        self.close()
+        if self.checkpoint: 
+            self.checkpoint.clear()
+
 
 class Pipeline(object): 
-    def __init__(self, kw, api_key=None): 
+    def __init__(self, kw, api_key=None, session=None, pool_size=query.POOL_SIZE, 
+                 cache=None, limiter=None, retry=None, metrics=None, 
+                 indexes=()): 
+        """
+        Parameters
+        ------------
+        kw : str or list
+            Path to, or list of, key word search terms. See KeyWordQuery.load. 
+            None leaves kw_query out, for subclasses with searches of their 
+            own, e.g. batch.BatchPipeline. 
+        
+        session : requests.Session
+            Shared by the esearch and efetch queries. By default, a session 
+            keeping 'pool_size' connections alive is made with 
+            query.make_session. 
+        
+        cache : cache.ResponseCache
+            If given, responses are looked up here before requesting them 
+            from NCBI, and stored here afterwards. 
+        
+        limiter : limiter.TokenBucket
+            Every request to NCBI takes a token from it. Pass the same 
+            instance to several pipelines to share NCBI's limit between 
+            them, or a limiter.SharedTokenBucket to share it with other 
+            processes. Defaults to 3 requests per second, or 10 if 'api_key' is 
+            given. Responses found in 'cache' don't count. 
+        
+        retry : limiter.RetryPolicy
+            How failed requests are retried. By default, 429s, server 
+            errors and network errors are retried up to 5 times. 
+        
+        metrics : metrics.Metrics
+            Where request latency and size, limiter waits, parse and write 
+            times are recorded; each call to 'request' resets it. A new 
+            one by default, available as the 'metrics' attribute. 
+        
+        indexes : list
+            Updated with each batch of summaries once it's saved, e.g. 
+            text_index.TextIndex or coauthors.CoauthorGraph. Anything with 
+            an 'add(records)' method will do. 
+        """
         self.api_key = api_key
-        self.kw_query = query.KeyWordQuery(retstart=0, api_key=api_key)
-        self.uid_query = query.UIDQuery(retstart=0, api_key=api_key) 
+        self.cache = cache
+        if limiter is None: 
+            limiter = TokenBucket.for_api_key(api_key)
+        self.limiter = limiter
+        if retry is None: 
+            retry = RetryPolicy()
+        self.retry = retry
+        if metrics is None: 
+            metrics = Metrics()
+        self.metrics = metrics
+        self.indexes = list(indexes)
+        if session is None: 
+            session = query.make_session(pool_size)
+        self.session = session
+        self.uid_query = query.UIDQuery(retstart=0, api_key=api_key, 
+                                        session=session) 
+        self.kw_query = None
+        if kw is not None: 
+            self.kw_query = query.KeyWordQuery(retstart=0, api_key=api_key, 
+                                               session=session)
         if isinstance(kw, str): 
             self.kw_query.load(path=kw)
-        else: 
+        elif kw is not None: 
             self.kw_query.load(terms=kw) 
     
-    @staticmethod
-    def _request(query, Soup): 
+    def set_base_urls(self, base_urls): 
+        """
+        Points the pipeline's queries at other E-utilities URLs, e.g. a 
+        mirror, or simulator.EutilsSimulator.base_urls. 'base_urls' is a 
+        dict from query ('kw_query' for esearch, 'uid_query' for efetch) 
+        to its URL. 
+        """
+        for name, url in base_urls.items(): 
+            query = getattr(self, name)
+            if query is not None: 
+                query.base_url = url
+    
+    def _key(self, query): 
+        """
+        Cache key of 'query', or None if its response isn't cached. Neither 
+        an esearch that starts a history server session nor the efetches 
+        reading one are, since the session (WebEnv) expires. 
+        """
+        if self.cache is None: 
+            return None
+        if query.use_history: 
+            return None
+        return self.cache.key(query)
+    
+    def _request(self, query, Soup): 
+        return self._send(query.as_request, Soup, self.cache, self._key(query))
+    
+    def _send(self, request, Soup, cache=None, key=None, acquired=False): 
+        """
+        Calls 'request', which is what Query.as_request returns, through 
+        the pipeline's limiter and RetryPolicy, and parses the response 
+        into 'Soup'. If 'cache' and 'key' are given, the response is looked 
+        up there under 'key' first. 'acquired' means the limiter's token for 
+        the first attempt has already been taken. 
+        """
         raw = None
-        with query.as_request() as req: 
-            if not req.status_code == 200: 
-                print (req.status_code)
-                print
-                raise ConnectionError(response=req, request=req.request)
-            else: 
-                raw = req.text
-        return Soup(raw) 
+        if key is not None: 
+            raw = cache.get(key)
+        if raw is None: 
+            raw = self.retry.send(request, self.limiter, acquired, 
+                                  self.metrics)
+            if key is not None: 
+                cache.put(key, raw)
+        return self._parse(Soup, raw)
+    
+    def _parse(self, Soup, raw): 
+        """
+        Soup(raw), timed. Summaries are extracted from the articles right 
+        away, so that their parse time includes the extraction. 
+        """
+        if Soup is str: 
+#            raw responses are parsed elsewhere, e.g. by ParallelPipeline
+            return raw
+        start = time.perf_counter()
+        soup = Soup(raw)
+        if not isinstance(soup, soups.SummarySoup): 
+            self.metrics.observe('parse_seconds', time.perf_counter() - start)
+            return soup
+        n = len(soup._extracted)
+        self._observe_parse(time.perf_counter() - start, n)
+        return soup
+    
+    def _observe_parse(self, seconds, n): 
+        self.metrics.observe('parse_seconds', seconds)
+        if n: 
+            self.metrics.observe('parse_seconds_per_article', seconds/n)
+        self.metrics.incr('articles', n)
+    
+    def save_batch(self, writer, records): 
+        """
+        Appends the SummaryRecords 'records' to 'writer' (see 
+        storage.open_writer), timed, then adds them to the pipeline's 
+        indexes. 
+        """
+        records = list(records)
+        with self.metrics.timer('write_seconds'): 
+            n = writer.append(records)
+        self.metrics.incr('articles_written', n)
+        for index in self.indexes: 
+            with self.metrics.timer('index_seconds'): 
+                index.add(records)
     
     @staticmethod
     def _n_or_max(n, max_): 
-        if n >= max_:
+        if n >= max_: 
             return max_
         else: 
             return n 
     
-    def request(self, n, save_folder=''): 
+    def _checkpoint(self, save_folder, resume): 
+        """
+        Checkpoint of the harvest saved to 'save_folder', if any. Call after 
+        the queries' ret_max have been set. 
+        """
+        if not save_folder: 
+            return None
+        checkpoint = Checkpoint(save_folder, 
+                                query_key(self.kw_query, self.uid_query))
+        if not resume: 
+            checkpoint.clear()
+        return checkpoint
+    
+    def _harvest(self, save_folder, layout, checkpoint, log_fetched): 
+        """
+        _Harvest of a run saving to 'save_folder'. Batches are added to the 
+        FetchedLog if 'log_fetched', e.g. if the run is incremental. Articles 
+        already in 'save_folder' are never saved again, whether or not the 
+        run is resumed. 
+        """
+        fetched = stored = None
+        if save_folder: 
+            stored = known_pmids(save_folder)
+        if log_fetched: 
+            fetched = FetchedLog(save_folder)
+        return _Harvest(self, save_folder, layout, checkpoint, fetched, 
+                        stored)
+    
+    def _setup(self, n, use_history): 
+        self.kw_query.use_history = use_history
+        if use_history: 
+#            only the count and the history server session are needed 
+            self.kw_query.ret_max = 0
+        else: 
+            self.kw_query.ret_max = self._n_or_max(n, query.UID_RETMAX)
+        self.uid_query.ret_max = self._n_or_max(n, query.SUMMARY_RETMAX)
+    
+    def _known(self, save_folder, incremental, use_history): 
+        """
+        Pubmed IDs to leave out of an incremental update: those already 
+        saved to 'save_folder'. None if the harvest isn't incremental. 
+        """
+        if not incremental: 
+            return None
+        if not save_folder: 
+            raise ValueError('An incremental update needs a save_folder.')
+        if use_history: 
+            raise ValueError('An incremental update needs the Pubmed IDs, '
+                             'so it cannot use the history server.')
+        return known_pmids(save_folder)
+    
+    def _load_uids(self, uid_soup, known): 
+        """
+        Loads the Pubmed IDs of 'uid_soup' into uid_query, leaving out the 
+        'known' ones, and returns the number of efetch batches they make. 
+        """
+        if known is None: 
+            self.uid_query.load(terms=uid_soup)
+            return (self.kw_query.ret_max-1)//query.SUMMARY_RETMAX + 1
+        self.uid_query.load(terms=uid_soup.uid.difference(known))
+        return (len(self.uid_query.search_terms)-1)//self.uid_query.ret_max + 1
+    
+    def _history_windows(self, uid_soup, n): 
+        """
+        Points uid_query at the history server session of 'uid_soup' and 
+        yields the ret_start and ret_max of each efetch batch. 
+        """
+        self.uid_query.load_history(uid_soup.web_env, uid_soup.query_key)
+        count = min(int(n), uid_soup.count)
+        for uid_start in range(0, count, query.SUMMARY_RETMAX): 
+            yield uid_start, min(query.SUMMARY_RETMAX, count - uid_start)
+    
+    def _fetch(self, query): 
+        """
+        Raw response of 'query', from the cache if it's there.
+        """
+        return self._send(query.as_request, str, self.cache, self._key(query))
+    
+    def search_window(self, ret_start, ret_max): 
+        """
+        Sends the esearch for 'ret_max' Pubmed IDs of the search, from 
+        'ret_start' on, and loads them into uid_query. Returns the 
+        uid_starts of their efetch batches, for fetch_batch. Together with 
+        fetch_batch and save_batch, this lets the caller decide when and 
+        where each batch is saved, e.g. jobqueue.Worker. 
+        """
+        self._setup(ret_max, False)
+        self.kw_query.ret_start = ret_start
+        uid_soup = self._request(self.kw_query, soups.FastUIDSoup)
+        self.uid_query.load(terms=uid_soup)
+        return range(0, len(uid_soup.uid), self.uid_query.ret_max)
+    
+    def fetch_batch(self, uid_start): 
+        """
+        SummaryRecords of the efetch batch at 'uid_start' of the Pubmed IDs 
+        loaded by search_window, as a list. 
+        """
+        self.uid_query.ret_start = uid_start
+        return self._parse_records(self._fetch(self.uid_query))
+    
+    def _windows(self, n, use_history, save_folder, checkpoint, known): 
+        """
+        Sends the esearches of the harvest and sets uid_query up for each 
+        of its efetch batches in turn, yielding a Step after each batch and 
+        after the end of each KeyWordQuery window. Windows recorded in 
+        'checkpoint' and Pubmed IDs in 'known' are skipped. A batch's Step 
+        carries its Pubmed IDs if 'known' is given, so that they can be 
+        added to the FetchedLog. 
+        """
+        if use_history: 
+            self.kw_query.ret_start = 0
+            uid_soup = self._request(self.kw_query, soups.FastUIDSoup)
+            for uid_start, ret_max in self._history_windows(uid_soup, n): 
+                if checkpoint and checkpoint.done(0, uid_start): 
+                    continue
+                self.uid_query.ret_start = uid_start
+                self.uid_query.ret_max = ret_max
+                yield Step(True, (0, uid_start), None)
+            return
+    
+        for i in range((n-1)//query.UID_RETMAX + 1): 
+            kw_start = i*self.kw_query.ret_max
+            if checkpoint and checkpoint.done(kw_start): 
+                continue
+            self.kw_query.ret_start = kw_start
+            uid_soup = self._request(self.kw_query, soups.FastUIDSoup)
+            if save_folder: 
+                uid_soup.save(save_folder)
+    
+            size = self.uid_query.ret_max
+            for j in range(self._load_uids(uid_soup, known)): 
+                uid_start = j*size
+                if checkpoint and checkpoint.done(kw_start, uid_start): 
+                    continue
+                self.uid_query.ret_start = uid_start
+                uids = None
+                if known is not None: 
+                    uids = self.uid_query.search_terms[uid_start:uid_start+size]
+                yield Step(True, (kw_start, uid_start), uids)
+            yield Step(False, (kw_start, None), None)
+    
+    def iter_articles(self, n, use_history=False): 
+        """
+        Yields a SummaryRecord for each of the first 'n' articles as soon 
+        as the efetch batch it's in has been parsed, instead of saving 
+        them. Batches are parsed with stream.iter_summaries, so memory use 
+        doesn't grow with 'n'. The same articles as SummarySoup keeps are 
+        yielded. See 'request' for 'use_history'. 
+        """
+        self._setup(n, use_history)
+        for step in self._windows(int(n), use_history, '', None, None): 
+            if not step.fetch: 
+                continue
+            for record in self._parse_records(self._fetch(self.uid_query)): 
+                yield record
+    
+    def _parse_records(self, raw): 
+        """
+        SummaryRecords of a raw efetch response, timed. 
+        """
+        start = time.perf_counter()
+        records = list(iter_summaries(raw))
+        self._observe_parse(time.perf_counter() - start, len(records))
+        return records
+    
+    @record_run
+    def request(self, n, save_folder='', layout='groups', resume=True, 
+                use_history=False, incremental=False): 
         """
         Parameters
         --------------
@@ -63,39 +446,231 @@ class Pipeline(object):
         save_folder: str
             Where to save results as an h5 file. If we don't want to save the 
             results to disk, enter default argument. 
+        
+        layout: str
+            Output format of the summaries; see SummarySoup.save. 
+        
+        resume: bool
+            If results are saved, progress is checkpointed in 'save_folder'. 
+            If True, windows that a previous, interrupted run of the same 
+            search already saved are skipped; if False, start over. Either 
+            way, articles already in 'save_folder' aren't saved twice, and 
+            the checkpoint is cleared once the run is complete. 
+        
+        use_history: bool
+            If True, the search results are kept on NCBI's history server and 
+            efetch pages through them, instead of the Pubmed IDs being 
+            downloaded and sent back. This also lifts the UID_RETMAX limit 
+            on 'n'. 
+        
+        incremental: bool
+            If True, only summaries that aren't in 'save_folder' yet are 
+            fetched, e.g. to refresh a saved search. Articles that were 
+            already fetched are recognised by their Pubmed IDs, so 'resume' 
+            doesn't apply. Needs Pubmed IDs, so not with 'use_history'. 
         """
-        self.kw_query.ret_max = self._n_or_max(n, query.UID_RETMAX)
-        self.uid_query.ret_max = self._n_or_max(n, query.SUMMARY_RETMAX)
+        self._setup(n, use_history)
         n = int(n)
-        
-        prev_time = time.monotonic()
+        known = self._known(save_folder, incremental, use_history)
+        checkpoint = None
+        if known is None: 
+            checkpoint = self._checkpoint(save_folder, resume)
+        harvest = self._harvest(save_folder, layout, checkpoint, 
+                                known is not None)
         try: 
-            for i in range((n-1)//query.UID_RETMAX + 1): 
-                print('i: ', i, ' elapsed: ', time.monotonic() - prev_time)
-                if not time.monotonic() - prev_time > 0.334: 
-    #                    NCBI cannot accept more than three requests per second 
-                        time.sleep(0.334 - time.monotonic() + prev_time)
-                prev_time = time.monotonic()
-                self.kw_query.ret_start = i*self.kw_query.ret_max
-                uid_soup = self._request(self.kw_query, soups.UIDSoup)
-                if save_folder: 
-                    uid_soup.save(save_folder) 
-                
-                self.uid_query.load(terms=uid_soup)
-                for j in range((self.kw_query.ret_max-1)//query.SUMMARY_RETMAX + 1): 
-                    print('j: ', j, ' elapsed: ', time.monotonic() - prev_time)
-                    if not time.monotonic() - prev_time > 0.334: 
-    #                    NCBI cannot accept more than three requests per second 
-                        time.sleep(0.334 - time.monotonic() + prev_time)
-                    prev_time = time.monotonic()
-                    self.uid_query.ret_start = j*self.uid_query.ret_max
-                    summary_soup = self._request(self.uid_query, soups.SummarySoup)
-                    if save_folder: 
-                        summary_soup.save(save_folder)
+            for step in self._windows(n, use_history, save_folder, 
+                                      checkpoint, known): 
+                if not step.fetch: 
+                    harvest.done(step.window)
+                    continue
+                summary_soup = self._request(self.uid_query, soups.SummarySoup)
+                harvest.save(summary_soup.records(), step.window, step.uids)
+            harvest.finish()
         except ConnectionError as e: 
-            print(e.response.reason)
+            if e.response is not None: 
+                print(e.response.reason)
             raise ConnectionError(response=e.response, request=e.request)
+        finally: 
+            harvest.close()
+
+
+class AsyncPipeline(Pipeline): 
+    """
+    Same as Pipeline, except that up to 'max_in_flight' efetch requests 
+    (one UIDQuery batch each) are kept in flight at once instead of being 
+    sent one after the other. All requests, esearch and efetch, go through 
+    one TokenBucket so that NCBI's rate limit is respected no matter how many 
+    requests are in flight. 
+    
+    Summaries are saved in the same order as Pipeline saves them. 
+    
+    Parameters
+    ------------
+    kw, api_key, session : 
+        See Pipeline. 
+    
+    max_in_flight : int
+        Maximum number of concurrent requests. The default session keeps 
+        this many connections alive. 
+    
+    limiter, retry, cache, metrics, indexes : 
+        See Pipeline. Retries of a request wait for their token in the 
+        thread the request was sent from. 
+    """
+    def __init__(self, kw, api_key=None, max_in_flight=4, limiter=None, 
+                 session=None, cache=None, retry=None, metrics=None, 
+                 indexes=()): 
+        super().__init__(kw, api_key, session=session, 
+                         pool_size=max(max_in_flight, query.POOL_SIZE), 
+                         cache=cache, limiter=limiter, retry=retry, 
+                         metrics=metrics, indexes=indexes)
+        self.max_in_flight = max_in_flight
+    
+    def _request_async(self, query, Soup, executor): 
+        """
+        Returns a coroutine that sends the request and parses the response. 
+        The request is taken from 'query' right away, so the query's fields 
+        can be modified for the next batch as soon as this returns. 
+        """
+        return self._send_async(query.as_request, Soup, executor, 
+                                self._key(query))
+    
+    async def _send_async(self, request, Soup, executor, key): 
+        acquired = key is None or not key in self.cache
+        if acquired: 
+            self.metrics.observe('limiter_wait_seconds', 
+                                 await self.limiter.acquire_async())
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, self._send, request, Soup, 
+                                          self.cache, key, acquired)
+    
+    def _batches(self, uids, checkpoint): 
+        """
+        Sets uid_query up for each batch of uid_query.ret_max Pubmed IDs of 
+        the UIDArray 'uids' in turn, yielding its Step. A batch is 
+        identified in 'checkpoint' by the window (0, its position in 
+        'uids'). 
+        """
+        size = self.uid_query.ret_max
+        for uid_start, batch in zip(range(0, len(uids), size), 
+                                    uids.batches(size)): 
+            if checkpoint and checkpoint.done(0, uid_start): 
+                continue
+            self.uid_query.load(terms=batch)
+            self.uid_query.ret_start = 0
+            yield Step(True, (0, uid_start), batch)
+    
+    async def _save_steps(self, steps, harvest, executor): 
+        """
+        Sends the efetch request of each Step of the iterator 'steps', up 
+        to max_in_flight at a time, and saves the summaries to 'harvest' in 
+        order. 'steps' is advanced off the event loop, since it may send 
+        esearches (see _windows). 
+        """
+        async def save_next(): 
+            step, task = pending.popleft()
+            if task is None: 
+                harvest.done(step.window, step.uids)
+            else: 
+                summary_soup = await task
+                harvest.save(summary_soup.records(), step.window, step.uids)
         
-            
-            
-            
\ No newline at end of file
+        loop = asyncio.get_event_loop()
+        pending = deque()
+        try: 
+            while True: 
+                step = await loop.run_in_executor(executor, next, steps, None)
+                if step is None: 
+                    break
+                task = None
+                if step.fetch: 
+                    task = asyncio.ensure_future(self._request_async(
+                            self.uid_query, soups.SummarySoup, executor))
+                pending.append((step, task))
+                while pending and (pending[0][1] is None or 
+                                   len(pending) >= self.max_in_flight): 
+                    await save_next()
+            while pending: 
+                await save_next()
+        finally: 
+            for step, task in pending: 
+                if task is not None: 
+                    task.cancel()
+    
+    async def iter_articles_async(self, n, use_history=False): 
+        """
+        Asynchronous iterator version of iter_articles: 
+
+            async for record in pipe.iter_articles_async(n): 
+                ...
+
+        Up to 'max_in_flight' efetch batches are downloaded ahead of the 
+        consumer, so at most that many batches are held in memory. 
+        """
+        self._setup(n, use_history)
+        loop = asyncio.get_event_loop()
+        windows = self._windows(int(n), use_history, '', None, None)
+        pending = deque()
+        with ThreadPoolExecutor(self.max_in_flight + 1) as executor: 
+            try: 
+                while True: 
+#                    esearches are sent by the windows generator, so it 
+#                    runs off the event loop 
+                    step = await loop.run_in_executor(executor, next, 
+                                                      windows, None)
+                    if step is None: 
+                        break
+                    if not step.fetch: 
+                        continue
+                    pending.append(asyncio.ensure_future(self._request_async(
+                            self.uid_query, str, executor)))
+                    if len(pending) < self.max_in_flight: 
+                        continue
+                    raw = await pending.popleft()
+                    for record in await loop.run_in_executor(
+                            executor, self._parse_records, raw): 
+                        yield record
+                while pending: 
+                    raw = await pending.popleft()
+                    for record in await loop.run_in_executor(
+                            executor, self._parse_records, raw): 
+                        yield record
+            finally: 
+                for task in pending: 
+                    task.cancel()
+    
+    async def request_async(self, n, save_folder='', layout='groups', 
+                            resume=True, use_history=False, incremental=False): 
+        """
+        Coroutine version of 'request'. 
+        """
+        self._setup(n, use_history)
+        n = int(n)
+        known = self._known(save_folder, incremental, use_history)
+        checkpoint = None
+        if known is None: 
+            checkpoint = self._checkpoint(save_folder, resume)
+        
+        harvest = self._harvest(save_folder, layout, checkpoint, 
+                                known is not None)
+        steps = self._windows(n, use_history, save_folder, checkpoint, known)
+#        one more thread than requests in flight, for the esearches 
+        with ThreadPoolExecutor(self.max_in_flight + 1) as executor: 
+            try: 
+                await self._save_steps(steps, harvest, executor)
+                harvest.finish()
+            except ConnectionError as e: 
+                if e.response is not None: 
+                    print(e.response.reason)
+                raise ConnectionError(response=e.response, request=e.request)
+            finally: 
+                harvest.close()
+    
+    @record_run
+    def request(self, n, save_folder='', layout='groups', resume=True, 
+                use_history=False, incremental=False): 
+        """
+        See Pipeline.request. 
+        """
+        asyncio.run(self.request_async(n, save_folder, layout, resume, 
+                                       use_history, incremental))
@@ -22,11 +22,65 @@ import requests
 import numpy as np
 from collections import OrderedDict
 from abc import ABC, abstractmethod
+import calendar
+import datetime
 import pickle
+import copy
 import h5py
 
+from uid_array import UIDArray
+
 SUMMARY_RETMAX = 500
 UID_RETMAX = int(1e5)
+POOL_SIZE = 10
+
+def make_session(pool_size=POOL_SIZE): 
+    """
+    Session that keeps up to 'pool_size' connections to NCBI alive between 
+    requests, so that each request doesn't pay for a new TCP and TLS 
+    handshake. Share one session between all Query objects of a harvest. 
+    
+    Parameters
+    ------------
+    pool_size : int
+        Maximum number of connections kept open per host. Should be at least 
+        the number of requests sent concurrently. 
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, 
+                                            pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 
+                            'Connection': 'keep-alive'})
+    return session
+
+def parse_date(date, end=False): 
+    """
+    Parses an esearch 'mindate' or 'maxdate', i.e. YYYY, YYYY/MM or 
+    YYYY/MM/DD, into a datetime.date. A missing month or day is the first 
+    one of the year or month, or the last one if 'end' is True, the same way 
+    NCBI reads them. 
+    """
+    if isinstance(date, bytes): 
+        date = date.decode('utf-8')
+    parts = [int(part) for part in str(date).strip().split('/')]
+    year = parts[0]
+    if len(parts) > 1: 
+        month = parts[1]
+    else: 
+        month = 12 if end else 1
+    if len(parts) > 2: 
+        day = parts[2]
+    else: 
+        day = calendar.monthrange(year, month)[1] if end else 1
+    return datetime.date(year, month, day)
+
+def format_date(date): 
+    """
+    Inverse of parse_date. 
+    """
+    return '{0:04d}/{1:02d}/{2:02d}'.format(date.year, date.month, date.day)
 
 class Query(ABC): 
     """
@@ -34,6 +88,9 @@ class Query(ABC):
     query_key = None
     base_url = None
     fields = None
+#    whether the query takes part in a history server session; see 
+#    KeyWordQuery.use_history and UIDQuery.use_history
+    use_history = False
     
     class _SearchTerms(object): 
         def __init__(self, arg): 
@@ -44,9 +101,25 @@ class Query(ABC):
             """
             raise NotImplementedError('Implement in a child class.') 
             
-    def __init__(self, retstart=0, api_key=None): 
+    def __init__(self, retstart=0, api_key=None, session=None): 
+        """
+        Parameters
+        ------------
+        session : requests.Session
+            Session used to send requests, e.g. from make_session. If None, 
+            every request opens a new connection. 
+        """
+#        copy so that the class' default fields aren't shared between instances
+        self.fields = self.fields.copy()
         self.fields['retstart'] = retstart
         self.api_key = api_key
+        self.session = session
+    
+    @property
+    def _http(self): 
+        if self.session is None: 
+            return requests
+        return self.session
     
     def _load_h5(self, path): 
         raise NotImplementedError('Not implemented.')  
@@ -81,12 +154,19 @@ class Query(ABC):
         
         return url, self.req_function
     
-    @property
-    def as_request(self): 
+    def request_fields(self): 
+        """
+        All parameters sent with the request, in canonical form. 
+        """
         fields = self.fields.copy() 
         fields.update(self.search_terms.to_dict()) 
         if not self.api_key is None: 
             fields.update({'api_key': self.api_key})
+        return fields
+    
+    @property
+    def as_request(self): 
+        fields = self.request_fields()
         return lambda: self.req_function(self.base_url, fields)
     
     def load(self, terms=None, path=None): 
@@ -98,8 +178,8 @@ class Query(ABC):
         Parameters
         ------------
         has_uids : SimpleUIDList
-            Anything that has a 'uid' attribute that, upon calling its next 
-            method, generates a utf-8-encoded bytes object. 
+            Anything that has a 'uid' attribute holding Pubmed IDs, e.g. a 
+            UIDSoup, whose 'uid' is a UIDArray. 
             
         
         path: str
@@ -121,10 +201,16 @@ class Query(ABC):
                     elif extension in ('pickle', 'pkl'): 
                         read = pickle.load(f, encoding='bytes')
                         
-                result = [line.split(b',') for line in read.split(b'\n')] 
+                result = self._from_saveable(read) 
             
             self.search_terms = self._SearchTerms(result) 
     
+    def _from_saveable(self, read): 
+        """
+        Search terms from the saveable_format of _SearchTerms. 
+        """
+        return [line.split(b',') for line in read.split(b'\n')] 
+    
     def save(self, path): 
 #        TODO: save to file from which UIDs were loaded 
         extension = path.split('.')[-1] 
@@ -176,8 +262,13 @@ class KeyWordQuery(Query):
                 del self['maxdate'] 
             else: 
                 self.maxdate = '2100'
-            self.baseurl += '&mindate={0}&maxdate={1}'.format(self.mindate, 
-                                                              self.maxdate)
+            self.set_dates(self.mindate, self.maxdate)
+        
+        def set_dates(self, mindate, maxdate): 
+            self.mindate = mindate
+            self.maxdate = maxdate
+            self.baseurl = '&datetype=pdat&mindate={0}&maxdate={1}'.format(
+                    self.mindate, self.maxdate)
             
         @property
         def term(self): 
@@ -235,9 +326,34 @@ class KeyWordQuery(Query):
             val = int(UID_RETMAX)
         self.fields['retmax'] = str(val)
     
+    def for_dates(self, mindate, maxdate): 
+        """
+        Copy of this query restricted to articles published between 
+        'mindate' and 'maxdate' (YYYY, YYYY/MM or YYYY/MM/DD), both included. 
+        """
+        other = copy.copy(self)
+        other.fields = self.fields.copy()
+        other.search_terms = copy.copy(self.search_terms)
+        other.search_terms.set_dates(mindate, maxdate)
+        return other
+    
+    @property
+    def use_history(self): 
+        """
+        Whether NCBI keeps the search results on its history server, so that 
+        they can be fetched with UIDQuery.load_history. 
+        """
+        return self.fields.get('usehistory') == 'y'
+    @use_history.setter
+    def use_history(self, val): 
+        if val: 
+            self.fields['usehistory'] = 'y'
+        else: 
+            self.fields.pop('usehistory', None)
+    
     @property    
     def req_function(self): 
-        return requests.get
+        return self._http.get
 
 
 class UIDQuery(Query): 
@@ -254,35 +370,76 @@ class UIDQuery(Query):
                           ('retstart', '0'), ]) 
     searchable_db = ['pubmed']
     
-    class _SearchTerms(list): 
+    class _SearchTerms(UIDArray): 
         query_key = 'id'
         def __init__(self, terms): 
             try: 
                 terms = terms.uid
             except AttributeError: 
                 pass 
-            terms = filter(lambda x: x.isdigit(), 
-                           map(lambda x: x.decode('utf-8').replace(' ', ''), 
-                               terms))
-
             super().__init__(terms)
         
         def to_url(self): 
-            return ','.join(self) 
+            return self.to_str()
         
         @property
         def saveable_format(self): 
-            return ','.join(self).encode('utf-8')
+            return self.to_bytes()
         
         def to_dict(self): 
             return OrderedDict([(self.query_key, self.to_url())])
     
+    class _HistoryTerms(object): 
+        """
+        Refers to an esearch result stored on NCBI's history server instead 
+        of listing its Pubmed IDs. 
+        """
+        def __init__(self, web_env, query_key): 
+            self.web_env = web_env
+            self.query_key = str(query_key)
+        
+        def to_url(self): 
+            return 'WebEnv={0}&query_key={1}'.format(self.web_env, 
+                                                     self.query_key)
+        
+        @property
+        def saveable_format(self): 
+            return 'WebEnv,{0}\nquery_key,{1}'.format(
+                    self.web_env, self.query_key).encode('utf-8')
+        
+        def to_dict(self): 
+            return OrderedDict([('WebEnv', self.web_env), 
+                                ('query_key', self.query_key)])
+    
+    def load_history(self, web_env, query_key): 
+        """
+        Fetch the results of an esearch that was run with 
+        KeyWordQuery.use_history, paging through them with ret_start, rather 
+        than sending their Pubmed IDs. 
+        
+        Parameters
+        ------------
+        web_env, query_key : str
+            From the esearch result; see UIDSoup.web_env and 
+            UIDSoup.query_key. 
+        """
+        self.search_terms = self._HistoryTerms(web_env, query_key)
+    
+    @property
+    def use_history(self): 
+        """
+        Whether the query fetches the results of a search on NCBI's history 
+        server (see load_history). 
+        """
+        return isinstance(getattr(self, 'search_terms', None), 
+                          self._HistoryTerms)
+    
     def _save_h5(self, path): 
         with h5py.File(path, mode='w') as f: 
             fields = self.fields.copy() 
             for k, v in fields.items(): 
-                f.attrs[k] = v.encode('utf-8')
-            f.create_dataset(name='uid',data=self.search_terms.saveable_format) 
+                f.attrs[k] = str(v).encode('utf-8')
+            f.create_dataset(name='uid', data=self.search_terms.array) 
             
     def _load_h5(self, path): 
         terms = [] 
@@ -290,9 +447,13 @@ class UIDQuery(Query):
             for k, v in f.attrs.items(): 
                 if k in self.fields.keys(): 
                     self.fields[k] = v
-            terms = f['uid']
+#            older files hold the saveable format instead of an array 
+            terms = UIDArray(f['uid'][()])
         return terms 
     
+    def _from_saveable(self, read): 
+        return UIDArray(read)
+    
     @property
     def database(self): 
         return self.fields['db'] 
@@ -316,7 +477,8 @@ class UIDQuery(Query):
     
     @property
     def req_function(self): 
-        if self.ret_max >= 200: 
-            return requests.post
+#        POST is only needed for long lists of IDs 
+        if self.ret_max >= 200 and not self.use_history: 
+            return self._http.post
         else: 
-            return requests.get
\ No newline at end of file
+            return self._http.get
\ No newline at end of file
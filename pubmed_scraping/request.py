@@ -18,10 +18,12 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from query import KeyWordQuery, UIDQuery
+from query import KeyWordQuery, UIDQuery, make_session
 from soups import UIDSoup, SummarySoup
+from limiter import RetryPolicy, shared_bucket
 
-def request(search_terms, type_): 
+def request(search_terms, type_, session=None, cache=None, limiter=None, 
+            retry=None): 
     """
     Searches Pubmed for 'search_terms' and returns a Soup of the results. 
     
@@ -36,24 +38,44 @@ def request(search_terms, type_):
     type_ : str
         Either 'keyword' or 'uids', describing what type of search terms we are 
         using, whether they are key words or pubmed IDs.     
+    
+    session : requests.Session
+        Reuse the connections of this session, e.g. one made with 
+        query.make_session, instead of opening a new one. 
+    
+    cache : cache.ResponseCache
+        If given, the response is looked up here before requesting it from 
+        NCBI, and stored here afterwards. 
+    
+    limiter : limiter.TokenBucket
+        Rate limiter for the request. Defaults to one shared by all calls 
+        without an api_key; see limiter.shared_bucket. 
+    
+    retry : limiter.RetryPolicy
+        How a failed request is retried; see Pipeline. 
     """
     d = {'keyword': (KeyWordQuery, UIDSoup), 
          'uids': (UIDQuery, SummarySoup)} 
     Query, Soup = d[type_]
     
-    query = Query()
+    query = Query(session=session)
     if isinstance(search_terms, str): 
         query.load(path=search_terms)
     else: 
         query.load(terms=search_terms) 
     
     raw = None
-    with query.as_request() as req: 
-        if not req.status_code == 200: 
-#            return req
-            raise (BaseException(str(req.status_code) + ':' + type_))
-        else: 
-            raw = req.text
+    if cache is not None: 
+        key = cache.key(query)
+        raw = cache.get(key)
+    if raw is None: 
+        if limiter is None: 
+            limiter = shared_bucket()
+        if retry is None: 
+            retry = RetryPolicy()
+        raw = retry.send(query.as_request, limiter)
+        if cache is not None: 
+            cache.put(key, raw)
     
     return Soup(raw) 
         
@@ -80,7 +102,8 @@ if __name__ == '__main__':
     terms=[[b'author', b'rothman'], 
            [b'language',b'English'], 
            [b'mindate', b'2000']]
-    uid_soup = request(terms, 'keyword')
-    summary_soup = request(uid_soup, 'uids')
+    session = make_session()
+    uid_soup = request(terms, 'keyword', session)
+    summary_soup = request(uid_soup, 'uids', session)
 #    save(uid_soup, r"C:\Users\v\Anaconda3\envs\py3\py3_modules\pubmed_scraping\test\test_data")
 #    save(summary_soup, r"C:\Users\v\Anaconda3\envs\py3\py3_modules\pubmed_scraping\test\test_data")
\ No newline at end of file
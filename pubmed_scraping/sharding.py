@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import numpy as np
+import datetime
+import asyncio
+import os
+import h5py
+
+import query
+import soups
+from query import parse_date, format_date
+from pipeline import AsyncPipeline, Step
+from uid_array import UIDArray
+from metrics import record_run
+
+# one date range of a sharded search, and its esearch Count
+Shard = namedtuple('Shard', ['mindate', 'maxdate', 'count'])
+
+
+def merge_uids(uid_lists, n=None): 
+    """
+    Concatenates the Pubmed IDs of several shards, keeping only the first
+    occurrence of each ID. Shards can overlap because an article's
+    publication date ('pdat') matches both its print and its electronic
+    date.
+
+    Parameters
+    ------------
+    uid_lists : iterable of UIDArrays
+        Pubmed IDs of each shard, e.g. UIDSoup.uid.
+
+    n : int
+        Keep at most this many IDs.
+    """
+    merged = UIDArray.concatenate(uid_lists).unique()
+    if n is not None: 
+        merged = merged[:int(n)]
+    return merged
+
+
+def split_uids(uid_lists, merged): 
+    """
+    Splits 'merged', from merge_uids(uid_lists, n), into the Pubmed IDs 
+    that each of 'uid_lists' returned first, as a list of UIDArrays. 
+    """
+    concatenated = UIDArray.concatenate(uid_lists).array
+    _, first = np.unique(concatenated, return_index=True)
+    first = np.sort(first)[:len(merged)]
+    ends = np.cumsum([len(UIDArray(uids)) for uids in uid_lists])
+    counts = np.bincount(np.searchsorted(ends, first, side='right'), 
+                         minlength=len(ends))
+    stops = np.cumsum(counts)
+    return [merged[int(stop - count):int(stop)] 
+            for count, stop in zip(counts, stops)]
+
+
+class ShardedPipeline(AsyncPipeline): 
+    """
+    AsyncPipeline for searches with more results than one esearch can
+    return (UID_RETMAX). The search's mindate-maxdate range is halved,
+    recursively, until the esearch Count of each part ('shard') is at most
+    'cap'. The Pubmed IDs of all shards are then downloaded concurrently,
+    merged without duplicates, and their summaries fetched in
+    SUMMARY_RETMAX batches like AsyncPipeline does.
+
+    A single day with more than 'cap' results can't be split any further;
+    only its first 'cap' results are harvested.
+
+    Each Pubmed ID is fetched with the first shard that returned it. A 
+    shard is marked in the checkpoint, by its date range, once all of its 
+    summaries are saved, and a resumed harvest skips those shards and any 
+    Pubmed IDs that are already saved, so that it doesn't depend on the 
+    merged IDs being in the same order as before. 
+
+    Parameters
+    ------------
+    kw, api_key, max_in_flight, limiter, session, cache, retry, metrics, 
+    indexes :
+        See AsyncPipeline.
+
+    cap : int
+        Largest esearch Count of a shard. At most UID_RETMAX.
+    """
+    def __init__(self, kw, api_key=None, max_in_flight=4, limiter=None,
+                 session=None, cache=None, cap=query.UID_RETMAX, retry=None, 
+                 metrics=None, indexes=()): 
+        super().__init__(kw, api_key, max_in_flight=max_in_flight,
+                         limiter=limiter, session=session, cache=cache, 
+                         retry=retry, metrics=metrics, indexes=indexes)
+        self.cap = min(int(cap), query.UID_RETMAX)
+
+    def _shard_query(self, shard, ret_max): 
+        kw_query = self.kw_query.for_dates(format_date(shard.mindate),
+                                           format_date(shard.maxdate))
+        kw_query.use_history = False
+        kw_query.ret_start = 0
+        kw_query.ret_max = ret_max
+        return kw_query
+
+    async def _count(self, mindate, maxdate, executor): 
+        shard = Shard(mindate, maxdate, None)
+        uid_soup = await self._request_async(self._shard_query(shard, 0),
+                                             soups.FastUIDSoup, executor)
+        return shard._replace(count=uid_soup.count)
+
+    async def _split(self, shard, executor): 
+        if shard.count <= self.cap: 
+            return [shard] if shard.count else []
+        if shard.mindate >= shard.maxdate: 
+            print('{0} results published on {1}; only the first {2} are '
+                  'harvested'.format(shard.count, format_date(shard.mindate),
+                                     self.cap))
+            return [shard]
+        middle = shard.mindate + (shard.maxdate - shard.mindate)//2
+        halves = await asyncio.gather(
+                self._count(shard.mindate, middle, executor),
+                self._count(middle + datetime.timedelta(days=1),
+                            shard.maxdate, executor))
+        shards = await asyncio.gather(*[self._split(half, executor)
+                                        for half in halves])
+        return [s for li in shards for s in li]
+
+    async def shards_async(self, executor): 
+        """
+        Coroutine that splits the search into Shards, in date order.
+        """
+        terms = self.kw_query.search_terms
+        whole = await self._count(parse_date(terms.mindate),
+                                  parse_date(terms.maxdate, end=True),
+                                  executor)
+        return await self._split(whole, executor)
+
+    def request_shards(self): 
+        """
+        Splits the search into Shards, in date order, without harvesting 
+        them. 
+        """
+        async def shards(): 
+            with ThreadPoolExecutor(self.max_in_flight) as executor: 
+                return await self.shards_async(executor)
+        return asyncio.run(shards())
+
+    async def _uids(self, shard, executor): 
+        uid_soup = await self._request_async(
+                self._shard_query(shard, min(shard.count, self.cap)),
+                soups.FastUIDSoup, executor)
+        return uid_soup.uid
+
+    def _save_uids(self, save_folder, uids): 
+#        same format as UIDSoup.save
+        with h5py.File(os.path.join(save_folder, 'uids.h5'), 'w') as f: 
+            f.create_dataset(name='uid', data=uids.array)
+            f.attrs['search_terms'] = [self.kw_query.search_terms.term.encode(
+                    'utf-8')]
+
+    def _shard_steps(self, shards, uid_lists, uids, checkpoint, known): 
+        """
+        Sets uid_query up for each efetch batch of the merged Pubmed IDs 
+        'uids' in turn, shard by shard, yielding a Step after each batch 
+        and after the end of each shard. Shards recorded in 'checkpoint' 
+        and Pubmed IDs in 'known' are skipped. 
+        """
+        size = self.uid_query.ret_max
+        for shard, shard_uids in zip(shards, split_uids(uid_lists, uids)): 
+            window = (shard.mindate.toordinal(), shard.maxdate.toordinal())
+            if checkpoint and checkpoint.done(*window): 
+                continue
+            if known is not None: 
+                shard_uids = shard_uids.difference(known)
+            for batch in shard_uids.batches(size): 
+                self.uid_query.load(terms=batch)
+                self.uid_query.ret_start = 0
+                yield Step(True, None, batch)
+            yield Step(False, window, None)
+
+    async def request_async(self, n, save_folder='', layout='groups',
+                            resume=True, incremental=False): 
+        """
+        Coroutine version of 'request'.
+        """
+        n = int(n)
+        self._setup(n, False)
+        self.kw_query.ret_max = self.cap
+        checkpoint = known = None
+        if not incremental: 
+            checkpoint = self._checkpoint(save_folder, resume)
+#        articles already in save_folder are never saved twice (see 
+#        _harvest); when resuming, they aren't fetched again either 
+        if incremental or (resume and save_folder): 
+            known = self._known(save_folder, True, False)
+
+        harvest = self._harvest(save_folder, layout, checkpoint, 
+                                bool(save_folder))
+        with ThreadPoolExecutor(self.max_in_flight + 1) as executor: 
+            try: 
+                shards = await self.shards_async(executor)
+                uid_lists = await asyncio.gather(*[self._uids(shard, executor)
+                                                   for shard in shards])
+                uids = merge_uids(uid_lists, n)
+                if save_folder: 
+                    self._save_uids(save_folder, uids)
+                steps = self._shard_steps(shards, uid_lists, uids, checkpoint, 
+                                          known)
+                await self._save_steps(steps, harvest, executor)
+                harvest.finish()
+            except ConnectionError as e: 
+                if e.response is not None: 
+                    print(e.response.reason)
+                raise ConnectionError(response=e.response, request=e.request)
+            finally: 
+                harvest.close()
+
+    @record_run
+    def request(self, n, save_folder='', layout='groups', resume=True, 
+                incremental=False): 
+        """
+        See Pipeline.request. History server mode isn't available, since the
+        Pubmed IDs of all shards are needed to remove duplicates.
+        """
+        asyncio.run(self.request_async(n, save_folder, layout, resume, 
+                                       incremental))
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Local stand-in for NCBI's esearch and efetch that serves a SyntheticCorpus,
+for tests and load tests that shouldn't depend on (or burden) the real
+E-utilities. It answers the parameters KeyWordQuery and UIDQuery send, 
+including the history server, and can inject latency, errors and NCBI's 
+per-api_key rate limit. 
+
+    python simulator.py [--size 100000] [--port 8080] [--latency 0.2]
+                        [--jitter 0.1] [--error-rate 0.01] [--rate-limit 3]
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+import threading
+import argparse
+import random
+import json
+import time
+
+import synthetic
+from limiter import NCBI_RATE, NCBI_RATE_API_KEY
+
+# efetch method of the corpus for each database
+EFETCH_METHODS = {'pubmed': 'efetch', 'protein': 'protein_efetch', 
+                  'gene': 'gene_efetch'}
+# server errors injected at random, see EutilsSimulator's 'error_rate'
+ERROR_STATUSES = (500, 502, 503)
+
+
+class _Handler(BaseHTTPRequestHandler): 
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args): 
+        pass
+
+    def do_GET(self): 
+        self._respond(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self): 
+        length = int(self.headers.get('Content-Length', 0))
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        self._respond(params)
+
+    def _respond(self, params): 
+        server = self.server
+        path = urlparse(self.path).path
+        params = {k: v[0] for k, v in params.items()}
+        with server.lock: 
+            n = len(server.log)
+            server.log.append((time.monotonic(), path, params))
+            server.clients.add(self.client_address)
+            status = server.fail_on.get(n)
+            if status is None and server.error_rate \
+               and server.rng.random() < server.error_rate: 
+                status = server.rng.choice(server.error_statuses)
+            if status is None: 
+                status = server.limit(params.get('api_key'))
+            if status is not None: 
+                server.statuses[status] = server.statuses.get(status, 0) + 1
+            else: 
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, 
+                                           server.in_flight)
+        if status is not None: 
+            self._send_failure(status, server.retry_after)
+            return
+        try: 
+            self._send_body(server, path, params)
+        finally: 
+            with server.lock: 
+                server.in_flight -= 1
+
+    def _send_failure(self, status, retry_after): 
+        body = b''
+        if status == 429: 
+#            NCBI's answer when the rate limit is exceeded
+            body = json.dumps({'error': 'API rate limit exceeded'}).encode(
+                    'utf-8')
+            if retry_after is None: 
+                retry_after = 1
+        self.send_response(status)
+        if retry_after is not None: 
+            self.send_header('Retry-After', str(retry_after))
+        if body: 
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, server, status): 
+        with server.lock: 
+            server.statuses[status] = server.statuses.get(status, 0) + 1
+        self.send_error(status)
+
+    def _send_body(self, server, path, params): 
+        delay = server.latency
+        if server.jitter: 
+            with server.lock: 
+                delay += server.rng.uniform(0, server.jitter)
+        if delay: 
+            time.sleep(delay)
+
+        db = params.get('db', 'pubmed')
+        if db not in EFETCH_METHODS: 
+            self._send_error(server, 400)
+            return
+        efetch = getattr(server.corpus, EFETCH_METHODS[db])
+        retstart = int(params.get('retstart', 0))
+        if path.endswith('esearch.fcgi'): 
+            web_env = None
+            uids = server.corpus.search(params.get('mindate'), 
+                                        params.get('maxdate'))
+            if params.get('usehistory') == 'y': 
+                with server.lock: 
+                    web_env = 'STUB_{0}'.format(len(server.histories))
+                    server.histories[web_env] = uids
+            body = server.corpus.esearch(retstart, int(params.get('retmax', 20)), 
+                                         web_env=web_env, uids=uids)
+        elif path.endswith('efetch.fcgi') and 'WebEnv' in params: 
+            if not (params['WebEnv'] in server.histories 
+                    and params.get('query_key') == '1'): 
+                self._send_error(server, 400)
+                return
+            retmax = int(params.get('retmax', 20))
+            uids = server.histories[params['WebEnv']]
+            body = efetch(uids[retstart:retstart + retmax])
+        elif path.endswith('efetch.fcgi'): 
+            ids = [i for i in params.get('id', '').split(',') if i]
+            retmax = int(params.get('retmax', len(ids)))
+            body = efetch(ids[retstart:retstart + retmax])
+        else: 
+            self._send_error(server, 404)
+            return
+
+        with server.lock: 
+            server.statuses[200] = server.statuses.get(200, 0) + 1
+            server.bytes_sent += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingMixIn, HTTPServer): 
+    daemon_threads = True
+
+    def limit(self, api_key): 
+        """
+        429 if a request with 'api_key' would exceed the rate limit, 
+        otherwise None (and the request is counted). Called with the lock 
+        held. 
+        """
+        rate = self.rate_limit if api_key is None else self.api_key_rate_limit
+        if rate is None: 
+            return None
+#        requests answered in the last second, like NCBI counts them
+        now = time.monotonic()
+        times = self.windows.setdefault(api_key, deque())
+        while times and times[0] <= now - 1.: 
+            times.popleft()
+        if len(times) >= rate: 
+            return 429
+        times.append(now)
+        return None
+
+
+class EutilsSimulator(object): 
+    """
+    Local HTTP server standing in for eutils.ncbi.nlm.nih.gov, serving a 
+    SyntheticCorpus. It runs in a background thread; use it as a context 
+    manager, and point pipelines at it with 'base_urls':
+
+        with EutilsSimulator(corpus, latency=0.1, rate_limit=3) as sim: 
+            pipe = Pipeline(terms)
+            pipe.set_base_urls(sim.base_urls)
+
+    esearch accepts mindate, maxdate, retstart, retmax and usehistory (the 
+    search term itself is ignored: every search matches the whole corpus, 
+    or its articles published between mindate and maxdate). efetch accepts 
+    id, or WebEnv and query_key, with retstart and retmax; db can be 
+    'pubmed', 'protein' or 'gene'. Every request is logged, in the order 
+    it arrived, as (time.monotonic(), path, params). 
+
+    Parameters
+    ------------
+    corpus : synthetic.SyntheticCorpus
+
+    latency : float
+        Seconds to wait before answering each request. 
+
+    fail_on : iterable of int, or dict
+        Requests, numbered in the order they arrive, that are answered 
+        with a 503 error; or a dict from request number to the status 
+        code to answer it with, e.g. {0: 429}. 
+
+    retry_after : 
+        Value of the Retry-After header sent with those errors, if any. 
+        429s from the rate limit send 1 if this is None. 
+
+    jitter : float
+        Up to this many seconds, drawn uniformly, are added to 'latency'. 
+
+    error_rate : float
+        Fraction of requests answered with one of 'error_statuses', chosen 
+        at random. 
+
+    error_statuses : tuple of int
+        e.g. (429, 503). 
+
+    rate_limit : float
+        Requests per second accepted without an api_key; any more within a 
+        second are answered with 429. None for no limit. 
+
+    api_key_rate_limit : float
+        Requests per second accepted for each api_key. Defaults to 
+        'rate_limit'; NCBI's limits are 3 and 10 (see 'ncbi'). 
+
+    seed : int
+        Seed for the jitter and the injected errors. 
+
+    port : int
+        Port to listen on; 0 picks a free one. 
+    """
+    def __init__(self, corpus, latency=0., fail_on=(), retry_after=None, 
+                 jitter=0., error_rate=0., error_statuses=ERROR_STATUSES, 
+                 rate_limit=None, api_key_rate_limit=None, seed=None, 
+                 host='127.0.0.1', port=0): 
+        self.server = _Server((host, port), _Handler)
+        self.server.corpus = corpus
+        self.server.latency = float(latency)
+        self.server.jitter = float(jitter)
+        if not isinstance(fail_on, dict): 
+            fail_on = {n: 503 for n in fail_on}
+        self.server.fail_on = fail_on
+        self.server.retry_after = retry_after
+        self.server.error_rate = float(error_rate)
+        self.server.error_statuses = tuple(error_statuses)
+        self.server.rng = random.Random(seed)
+        self.server.rate_limit = rate_limit
+        self.server.api_key_rate_limit = rate_limit \
+                if api_key_rate_limit is None else api_key_rate_limit
+        self.server.windows = {}
+        self.server.log = []
+        self.server.statuses = {}
+        self.server.bytes_sent = 0
+        self.server.clients = set()
+        self.server.histories = {}
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    @classmethod
+    def ncbi(cls, corpus, **kwargs): 
+        """
+        Simulator with NCBI's rate limits: three requests per second, or 
+        ten with an api_key. 
+        """
+        return cls(corpus, rate_limit=NCBI_RATE, 
+                   api_key_rate_limit=NCBI_RATE_API_KEY, **kwargs)
+
+    @property
+    def url(self): 
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}/'.format(host, port)
+
+    @property
+    def esearch_url(self): 
+        return self.url + 'esearch.fcgi?'
+
+    @property
+    def efetch_url(self): 
+        return self.url + 'efetch.fcgi?'
+
+    @property
+    def base_urls(self): 
+        """
+        Base URL of a Pipeline's queries, by attribute name, for 
+        Pipeline.set_base_urls or jobqueue.Worker's 'base_urls'. 
+        """
+        return {'kw_query': self.esearch_url, 'uid_query': self.efetch_url}
+
+    @property
+    def log(self): 
+        return self.server.log
+
+    @property
+    def statuses(self): 
+        """
+        Number of responses sent with each HTTP status code. 
+        """
+        with self.server.lock: 
+            return dict(self.server.statuses)
+
+    @property
+    def bytes_sent(self): 
+        """
+        Total size of the XML bodies sent. 
+        """
+        return self.server.bytes_sent
+
+    @property
+    def n_connections(self): 
+        """
+        Number of distinct client connections requests arrived on.
+        """
+        return len(self.server.clients)
+
+    @property
+    def max_in_flight(self): 
+        """
+        Largest number of requests that were being handled at the same time.
+        """
+        return self.server.max_in_flight
+
+    def start(self): 
+        self._thread.start()
+        return self
+
+    def stop(self): 
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self): 
+        return self.start()
+
+    def __exit__(self, *args): 
+        self.stop()
+
+
+def main(): 
+    parser = argparse.ArgumentParser(
+            description="Local stand-in for NCBI's esearch and efetch that "
+                        'serves a synthetic corpus.')
+    parser.add_argument('--size', type=int, default=100000, 
+                        help='articles in the synthetic corpus')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--rate-limit', type=float, default=None, 
+                        help='requests per second without an api_key')
+    parser.add_argument('--api-key-rate-limit', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    sim = EutilsSimulator(synthetic.SyntheticCorpus(args.size), 
+                          latency=args.latency, jitter=args.jitter, 
+                          error_rate=args.error_rate, 
+                          rate_limit=args.rate_limit, 
+                          api_key_rate_limit=args.api_key_rate_limit, 
+                          seed=args.seed, port=args.port)
+    with sim: 
+        print('Serving {0} articles at {1}'.format(args.size, sim.url))
+        try: 
+            while True: 
+                time.sleep(1)
+        except KeyboardInterrupt: 
+            pass
+
+
+if __name__ == '__main__': 
+    main()
@@ -19,26 +19,148 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from bs4 import BeautifulSoup, Tag, SoupStrainer
+from collections import namedtuple
+from lxml import etree
 import numpy as np
+import html
+import re
 import h5py
+import os
 
 from query import UIDQuery
+from uid_array import UIDArray
+from xpath import XPathExtractor
 
 #TODO: add class-specific SoupStrainers to only parse the necessary parts of 
 #      the XML file 
 
+class FieldExtractor(object): 
+    """
+    The keyword arguments of a Soup class (see 
+    NCBISoupABC.add_generator_property), arranged such that every field of 
+    an article can be filled in during a single walk through its tags, rather 
+    than one find_all per field. 
+    
+    A dict spec can name the 'parent' of its tags, or a tuple of their 
+    closest ancestors, outermost first: {'name': 'pmid', 'parent': 
+    'medlinecitation'} matches the article's own PMID, but not those of 
+    the articles it comments on. 
+    """
+    def __init__(self, kwargs): 
+        self.by_tag = {}         # tag name -> single fields matched by name
+        self.by_attr = []        # single fields matched by attributes only
+        self.containers = {}     # tag name -> nested fields
+        self.single = []
+        self.nested = []
+        for field, spec in kwargs.items(): 
+            if isinstance(spec, (str, bytes)): 
+                spec = {'name': spec}
+            if isinstance(spec, dict): 
+                spec = spec.copy()
+                tag = spec.pop('name', None)
+                parents = spec.pop('parent', ())
+                if isinstance(parents, str): 
+                    parents = (parents,)
+                if tag is None: 
+                    self.by_attr.append((field, spec, parents))
+                else: 
+                    self.by_tag.setdefault(tag, []).append(
+                            (field, spec, parents))
+                self.single.append(field)
+            else: 
+                aligned = spec[2] if len(spec) > 2 else ()
+                self.containers.setdefault(spec[0], []).append(
+                        (field, spec[1], aligned))
+                self.nested.append((field, spec[1]))
+    
+    @staticmethod
+    def is_article(article): 
+        return isinstance(article, Tag)
+    
+    def _empty(self): 
+        return {field: [] for field in self.single}, \
+               {field: {key: [] for key in keys} for field, keys in self.nested}
+    
+    @staticmethod
+    def _within(element, parents): 
+        """
+        Whether 'parents' are the names of the element's closest ancestors. 
+        """
+        for name in reversed(parents): 
+            element = element.parent
+            if element is None or element.name != name: 
+                return False
+        return True
+    
+    @staticmethod
+    def _join(strings): 
+        if None in strings: 
+            return b''
+        return ' '.join(strings).encode('utf-8')
+    
+    def extract(self, article): 
+        """
+        Returns a dict of the article's fields. Single fields are the 
+        space-joined strings of all matching tags, utf-8-encoded (or b'' if 
+        one of them doesn't hold just a string); nested fields are dicts of 
+        lists of utf-8-encoded strings. Aligned keys have exactly one 
+        string per container tag, b'' if it's missing. 
+        """
+        single, nested = self._empty()
+        if not isinstance(article, Tag): 
+            return {field: b'' for field in single}
+        
+        for element in article.descendants: 
+            if not isinstance(element, Tag): 
+                continue
+            attrs = element.attrs
+            for field, spec, parents in self.by_tag.get(element.name, ()): 
+                if all(attrs.get(k) == v for k, v in spec.items()) \
+                   and self._within(element, parents): 
+                    single[field].append(element.string)
+            if attrs: 
+                for field, spec, parents in self.by_attr: 
+                    if all(attrs.get(k) == v for k, v in spec.items()) \
+                       and self._within(element, parents): 
+                        single[field].append(element.string)
+            for field, keys, aligned in self.containers.get(element.name, ()): 
+                found = {key: [] for key in keys}
+                for child in element.descendants: 
+                    if isinstance(child, Tag) and child.name in found: 
+                        found[child.name].append(
+                                (child.string or '').encode('utf-8'))
+                for key, values in found.items(): 
+                    if key in aligned: 
+                        values = values[:1] or [b'']
+                    nested[field][key].extend(values)
+        
+        fields = {field: self._join(strings) for field, strings in single.items()}
+        fields.update(nested)
+        return fields
+
+
 class NCBISoupABC(type): 
     """
     Abstract base class for Soup objects, which parse XML requested from 
     NCBI. 
+    
+    The keyword arguments of a class are compiled once, when the class is 
+    made, by its '_extractor_class': FieldExtractor (the default) walks 
+    BeautifulSoup trees, and xpath.XPathExtractor evaluates XPath 
+    expressions on lxml trees (see XPathSoup). 
     """
     @classmethod
-    def add_generator_property(cls, tag_name): 
+    def add_generator_property(cls, attr, tag_name): 
         """
-        Generator that help iterate through tags of an XML file. 
+        Generator that help iterate through tags of an XML file. The values 
+        come from the class' FieldExtractor, which fills in all fields of an 
+        article at once. 
         
         Parameters
         ------------
+        attr : str
+            Name of the property. 
+        
         tag_name : str or tuple
             If string, returns a single_generator; if tuple, returns nested 
             generator. 
@@ -72,30 +194,22 @@ class NCBISoupABC(type):
             
             {'lastname': [b'Doe', b'Smith'], 
              'forename': [b'John', b'Jane'] }
+            
+            Each key collects its tags independently, so an author without 
+            a forename would make the lists above differ in length. Keys 
+            listed in an optional third item, e.g. 
+            ('author', ('forename', 'lastname'), ('forename', 'lastname')), 
+            are kept aligned instead: one value per 'author' tag, b'' if it 
+            has none. 
         """
         def single_generator(self): 
-            for article in self: 
-                try: 
-                    li = article.find_all(**tag_name)
-                    yield ' '.join([element.string for element in 
-                                        li]).encode('utf-8')
-                except (AttributeError, TypeError): 
-                    yield ''.encode('utf-8') 
+            for is_tag, fields in self._extracted: 
+                yield fields[attr]
         
         def nested_generator(self): 
-            for article in self: 
-                name = tag_name[0] 
-                keys = tag_name[1] 
-                if isinstance(article, Tag): 
-                    yield {key: [c.string.encode('utf-8') for contents in  \
-                                 article(name) for c in contents(key)] for \
-                                 key in keys} 
-                    
-
-#                tag = article.find_all(tag_name[0])   
-#                yield [{k: [t.string.encode('utf-8') for t in item.find_all(k)]\
-#                            for k in rest if not (item.__getattr__(k) is None)} 
-#                        for item in tag if isinstance(item, Tag)]
+            for is_tag, fields in self._extracted: 
+                if is_tag: 
+                    yield fields[attr]
                         
         if isinstance(tag_name, (str, bytes, dict)): 
             generator = single_generator 
@@ -106,13 +220,35 @@ class NCBISoupABC(type):
         
         return property(generator)
     
+    @staticmethod
+    def _extracted(self): 
+        """
+        Fields of every article, filled in by a single walk through each 
+        article, and cached so that the generator properties don't each 
+        traverse the tree again. 
+        """
+        try: 
+#            not getattr: BeautifulSoup would search the tree for the name
+            return self.__dict__['_extracted_fields']
+        except KeyError: 
+            extracted = [(self._extractor.is_article(article), 
+                          self._extractor.extract(article)) for article in self]
+            self.__dict__['_extracted_fields'] = extracted
+            return extracted
+    
     def __new__(metacls, name, bases, namespace, **kwds): 
         namespace['_data_attrs'] = []
         for k, v in kwds.items(): 
-            namespace[k] = NCBISoupABC.add_generator_property(v)
+            namespace[k] = NCBISoupABC.add_generator_property(k, v)
             namespace['_data_attrs'].append(k) 
+        if kwds: 
+            namespace['_extracted'] = property(NCBISoupABC._extracted)
             
-        return type.__new__(metacls, name, bases, namespace)
+        cls = type.__new__(metacls, name, bases, namespace)
+        if kwds: 
+            cls._extractor = getattr(cls, '_extractor_class', 
+                                     FieldExtractor)(kwds)
+        return cls
 
     def __subclasscheck__(cls, subclass):
 #        https://stackoverflow.com/questions/40764347/python-subclasscheck-subclasshook
@@ -141,32 +277,131 @@ class UIDSoup(BeautifulSoup, metaclass=NCBISoupABC, **uid_kwargs):
     
     @property
     def uid(self): 
+        """
+        Pubmed IDs of the search results, as a UIDArray. 
+        """
 #        uid = list(self._uid)[0]['id'].copy()
-        for i in self.idlist.children: 
-            if isinstance(i, Tag): 
-                yield i.string.encode('utf-8')
+        return UIDArray([i.string for i in self.idlist.children 
+                         if isinstance(i, Tag)])
+    
+    def _text(self, name): 
+        tag = self.find(name)
+        if tag is None: 
+            return None
+        return tag.string
+    
+    @property
+    def count(self): 
+        """
+        Total number of search results, of which 'uid' is one window. 
+        """
+        return int(self._text('count'))
+    
+    @property
+    def ret_start(self): 
+        return int(self._text('retstart'))
+    
+    @property
+    def ret_max(self): 
+        """
+        Number of Pubmed IDs in 'uid'. 
+        """
+        return int(self._text('retmax'))
+    
+    @property
+    def web_env(self): 
+        """
+        History server session; only there if the search used 
+        KeyWordQuery.use_history. 
+        """
+        return self._text('webenv')
+    
+    @property
+    def query_key(self): 
+        """
+        Key of the results in the 'web_env' history server session. 
+        """
+        return self._text('querykey')
     
     def save(self, folder): 
-        with h5py.File(folder + '\\uids.h5', 'w') as f: 
-            data = [i for i in self.uid]
-            f.create_dataset(name='uid', data=data)
+        with h5py.File(os.path.join(folder, 'uids.h5'), 'w') as f: 
+            f.create_dataset(name='uid', data=self.uid.array)
 #            keep similar h5 save format as UIDQuery
             f.attrs['search_terms'] = [term.string.encode('utf-8') for term 
                                        in self.find_all('term')]
 
+class FastUIDSoup(object): 
+    """
+    Reads the same things as UIDSoup from an esearch response, with regular 
+    expressions over the raw XML instead of a BeautifulSoup tree. The 
+    Pubmed IDs go straight into a UIDArray, so a response with UID_RETMAX 
+    IDs takes milliseconds rather than seconds to read, and no tree is 
+    kept in memory. 
+    
+    Parameters
+    ------------
+    markup : str or bytes
+        esearch XML. 
+    """
+    _id_list = re.compile(rb'<IdList>(.*?)</IdList>', re.DOTALL)
+    _id = re.compile(rb'<Id>\s*(\d+)\s*</Id>')
+    _term = re.compile(rb'<Term>(.*?)</Term>', re.DOTALL)
+    _fields = {'count': 'Count', 'ret_start': 'RetStart', 
+               'ret_max': 'RetMax', 'query_key': 'QueryKey', 
+               'web_env': 'WebEnv'}
+    
+    def __init__(self, markup=b''): 
+        if isinstance(markup, str): 
+            markup = markup.encode('utf-8')
+        self.raw = markup
+        id_list = self._id_list.search(markup)
+        ids = self._id.findall(id_list.group(1)) if id_list else []
+        if ids: 
+            self.uid = UIDArray(np.array(ids).astype(UIDArray.dtype))
+        else: 
+            self.uid = UIDArray()
+#        only the part before <IdList>; the TranslationStack further down 
+#        has Count tags of its own 
+        head = markup[:id_list.start()] if id_list else markup
+        for attr, tag in self._fields.items(): 
+            found = re.search('<{0}>(.*?)</{0}>'.format(tag).encode('utf-8'), 
+                              head)
+            value = found.group(1).decode('utf-8').strip() if found else None
+            if value is not None and attr in ('count', 'ret_start', 'ret_max'): 
+                value = int(value)
+            setattr(self, attr, value)
+    
+    def save(self, folder): 
+#        same format as UIDSoup.save 
+        with h5py.File(os.path.join(folder, 'uids.h5'), 'w') as f: 
+            f.create_dataset(name='uid', data=self.uid.array)
+            f.attrs['search_terms'] = [
+                    html.unescape(term.decode('utf-8')).encode('utf-8') 
+                    for term in self._term.findall(self.raw)]
+
 summary_kwargs = {'abstract': {'name': 'abstracttext'}, 
-                  'uid': {'idtype':'pubmed'}, # uid is mandatory if we want to 
+                  'uid': {'name': 'pmid', 'parent': 'medlinecitation'}, 
+                                              # uid is mandatory if we want to 
                                               # save files to h5 because group 
                                               # (article summaries) are labeled 
-                                              # by their Pubmed IDs
-                  'doi': {'idtype':'doi'}, 
-                  'pmc': {'idtype':'pmc'}, 
+                                              # by their Pubmed IDs; only the 
+                                              # article's own, not those of 
+                                              # its references
+                  'doi': {'idtype':'doi', 
+                          'parent': ('pubmeddata', 'articleidlist')}, 
+                  'pmc': {'idtype':'pmc', 
+                          'parent': ('pubmeddata', 'articleidlist')}, 
                   'title':{'name': 'articletitle'}, 
-                  'authors': ('author', ('lastname', 'forename', 'affiliation')), 
+                  'authors': ('author', ('lastname', 'forename', 'affiliation'), 
+                              ('lastname', 'forename')), # one name per author, 
+                                                         # b'' if it's missing
                   'date': ('pubdate', ('year', 'month', 'day')), 
                   'journal': {'name':'isoabbreviation'}, 
-                  'grant': ('grant', ('grantid', 'agency'))
+                  'grant': ('grant', ('grantid', 'agency'), ('grantid', 'agency'))
                   }
+# one article's worth of summary_kwargs fields
+SummaryRecord = namedtuple('SummaryRecord', list(summary_kwargs.keys()))
+
 class SummarySoup(BeautifulSoup, metaclass=NCBISoupABC, **summary_kwargs): 
     """
     Parses the info of a Pubmed summary -- things like article abstract, 
@@ -189,30 +424,129 @@ class SummarySoup(BeautifulSoup, metaclass=NCBISoupABC, **summary_kwargs):
                yield summary 
         
                 
-    def save(self, folder): 
-        # kind of ugly but it works...
-        with h5py.File(folder + '\\pubmed_summary.h5', 'a') as f: 
-            uid = list(self.uid) 
-            for i, info in enumerate(zip(*[self.__getattribute__(attr) for 
-                                           attr in self._data_attrs])): 
-                grp = f.create_group(name=uid[i].decode('utf-8')) 
-                for name, data in zip(self._data_attrs, info): 
-                    if isinstance(data, dict) and len(data) > 1: 
-                        subgrp = grp.create_group(name)
-                        for k, v in data.items(): 
-                            subgrp.create_dataset(k, data=v)
-                    elif isinstance(data, dict): 
-                        grp.create_dataset(name=name, data=data[data.keys()[0]])
-                    else: 
-                        grp.create_dataset(name=name, data=data)
-
-class ProteinSoup(BeautifulSoup, metaclass=NCBISoupABC): 
-#    TODO: 
-    pass 
-
-class GeneSoup(BeautifulSoup, metaclass=NCBISoupABC): 
-#    TODO: 
-    pass 
+    def records(self): 
+        """
+        Yields a SummaryRecord per article. 
+        """
+        for is_tag, fields in self._extracted: 
+            yield SummaryRecord(**fields)
+                
+    def save(self, folder, layout='groups'): 
+        """
+        Parameters
+        ------------
+        folder : str
+            Folder in which to save the summaries. 
+        
+        layout : str
+            'groups' saves one HDF5 group per article, labeled by its Pubmed 
+            ID, to pubmed_summary.h5. 'columns' appends the articles to the 
+            datasets of pubmed_summary_columns.h5; see storage.ColumnarWriter. 
+            'parquet' adds a part file to the pubmed_summary_parquet dataset; 
+            see arrow_sink.ParquetWriter. See storage.open_writer for the 
+            others. 
+        """
+#        storage imports this module
+        from storage import open_writer
+        with open_writer(folder, layout) as writer: 
+            writer.append(self.records())
+
+class XPathSoup(metaclass=NCBISoupABC): 
+    """
+    Base class of Soups that parse their markup into an lxml tree, and 
+    extract the fields of each article with XPath expressions compiled once 
+    per class (see xpath.XPathExtractor), instead of walking a 
+    BeautifulSoup tree. Subclasses set '_articles', the compiled XPath of 
+    their articles, and '_record', the namedtuple made by 'records'. 
+    
+    Parameters
+    ------------
+    markup : str or bytes
+        efetch XML. 
+    """
+    _extractor_class = XPathExtractor
+    _articles = None
+    _record = None
+    _parser = etree.XMLParser(huge_tree=True, resolve_entities=False, 
+                              no_network=True)
+    
+    def __init__(self, markup=b''): 
+        if isinstance(markup, str): 
+            markup = markup.encode('utf-8')
+        self.root = etree.fromstring(markup, self._parser) \
+                    if markup.strip() else None
+    
+    def __iter__(self): 
+        if self.root is None: 
+            return iter(())
+        return iter(self._articles(self.root))
+    
+    def records(self): 
+        """
+        Yields a '_record' per article. 
+        """
+        for is_tag, fields in self._extracted: 
+            yield self._record(**fields)
+
+class FastSummarySoup(XPathSoup, **summary_kwargs): 
+    """
+    Reads the same articles and fields as SummarySoup, with compiled XPath 
+    expressions over an lxml tree; an order of magnitude faster. 
+    """
+    _articles = etree.XPath("/PubmedArticleSet/PubmedArticle"
+                            "[(.//MedlineCitation)[1]/@Status='MEDLINE']"
+                            "[.//Abstract]")
+    _record = SummaryRecord
+    save = SummarySoup.save
+
+protein_kwargs = {'uid': 'GBSeq_accession-version', 
+                  'locus': 'GBSeq_locus', 
+                  'length': 'GBSeq_length', 
+                  'moltype': 'GBSeq_moltype', 
+                  'definition': 'GBSeq_definition', 
+                  'organism': 'GBSeq_organism', 
+                  'taxonomy': 'GBSeq_taxonomy', 
+                  'sequence': 'GBSeq_sequence', 
+                  'seqids': ('GBSeq_other-seqids', {'seqid': 'GBSeqid'}), 
+                  'references': ('GBReference', 
+                                 {'title': 'GBReference_title', 
+                                  'pubmed': 'GBReference_pubmed'}), 
+                  'features': ('GBFeature', 
+                               {'key': 'GBFeature_key', 
+                                'location': 'GBFeature_location'})
+                  }
+# one sequence's worth of protein_kwargs fields
+ProteinRecord = namedtuple('ProteinRecord', list(protein_kwargs.keys()))
+
+class ProteinSoup(XPathSoup, **protein_kwargs): 
+    """
+    Parses protein sequence records, as returned by 
+    https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=protein&retmode=xml 
+    (GBSet XML). 'uid' is the accession.version. 
+    """
+    _articles = etree.XPath('/GBSet/GBSeq')
+    _record = ProteinRecord
+
+gene_kwargs = {'uid': 'Gene-track_geneid', 
+               'symbol': 'Gene-ref_locus', 
+               'description': 'Gene-ref_desc', 
+               'organism': 'Org-ref_taxname', 
+               'summary': 'Entrezgene_summary', 
+               'location': 'Maps_display-str', 
+               'synonyms': ('Gene-ref_syn', {'synonym': 'Gene-ref_syn_E'}), 
+               'proteins': ('Prot-ref_name', {'name': 'Prot-ref_name_E'})
+               }
+# one gene's worth of gene_kwargs fields
+GeneRecord = namedtuple('GeneRecord', list(gene_kwargs.keys()))
+
+class GeneSoup(XPathSoup, **gene_kwargs): 
+    """
+    Parses gene records, as returned by 
+    https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=gene&retmode=xml 
+    (Entrezgene-Set XML). 'uid' is the Gene ID. 
+    """
+    _articles = etree.XPath('/Entrezgene-Set/Entrezgene')
+    _record = GeneRecord
 
 class SimpleUIDList(metaclass=NCBISoupABC): 
     """
@@ -221,15 +555,14 @@ class SimpleUIDList(metaclass=NCBISoupABC):
     _data_attrs = ['uid']
     
     def __init__(self, uids): 
-        self.uid = iter(uids)
+        self.uid = uids
         
     @property
     def uid(self): 
-        for i in self._uid: 
-            yield i
+        return self._uid
     
     @uid.setter
     def uid(self, val): 
-        self._uid = val 
+        self._uid = UIDArray(val)
 
 
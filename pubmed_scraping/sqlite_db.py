@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+SQLite helpers for state that several threads and processes share, e.g.
+limiter.SharedTokenBucket and jobqueue.JobQueue.
+"""
+from contextlib import contextmanager
+import sqlite3
+import os
+
+
+def connect(local, path, timeout): 
+    """
+    SQLite connection to 'path' for the calling thread and process, kept 
+    in the threading.local 'local': connections can't be shared by threads, 
+    nor survive a fork. 
+    """
+    pid, db = getattr(local, 'db', (None, None))
+    if pid != os.getpid(): 
+        db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        local.db = (os.getpid(), db)
+    return db
+
+
+@contextmanager
+def immediate(local, path, timeout): 
+    """
+    Transaction that holds the database's write lock from the start, so 
+    that what's read in it can't change before it's written. 
+    """
+    db = connect(local, path, timeout)
+    db.execute('BEGIN IMMEDIATE')
+    try: 
+        yield db
+    except BaseException: 
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import h5py
+import os
+
+from query import SUMMARY_RETMAX
+from soups import summary_kwargs, SummaryRecord
+from uid_array import UIDArray
+
+COLUMNS_FILENAME = 'pubmed_summary_columns.h5'
+GROUPS_FILENAME = 'pubmed_summary.h5'
+FETCHED_FILENAME = 'pubmed_fetched.h5'
+PARQUET_DIRNAME = 'pubmed_summary_parquet'
+
+_string_dtype = h5py.special_dtype(vlen=bytes)
+# fields whose summary_kwargs are (parent tag, (child tags...)) hold a list
+# of strings per child tag; the others hold one string
+nested_fields = {k: v[1] for k, v in summary_kwargs.items()
+                 if isinstance(v, tuple)}
+single_fields = [k for k in summary_kwargs.keys() if k not in nested_fields]
+
+
+def record_pmid(uid): 
+    """
+    Pubmed ID as an integer, from SummaryRecord.uid. 0 if there is none.
+    """
+    uid = uid.split()
+    if uid and uid[0].isdigit(): 
+        return int(uid[0])
+    return 0
+
+
+class GroupWriter(object): 
+    """
+    Stores each SummaryRecord as an HDF5 group labeled by its Pubmed ID. 
+    Multi-valued fields with several sub-keys (e.g. authors) are sub-groups 
+    with a dataset per sub-key. 
+
+    A batch is written to a staging group first, and each article is only 
+    moved (a link operation) to its final name once the whole batch has 
+    been written, so an interrupted write never leaves a half-written 
+    article under a Pubmed ID. 
+
+    The file is only open while a batch is appended, so writers in 
+    several processes can take turns appending to it (see 
+    jobqueue.Worker). 
+
+    Parameters
+    ------------
+    path : str
+        HDF5 file; created if it doesn't exist, and appended to otherwise.
+    """
+    _staging = '_pending'
+
+    def __init__(self, path): 
+        self.path = path
+
+    def append(self, records): 
+        """
+        Appends an iterable of SummaryRecords, e.g. SummarySoup.records().
+        Returns the number of records written. Raises ValueError, without 
+        writing anything, if one of the articles is already stored.
+        """
+        records = list(records)
+        with h5py.File(self.path, 'a') as f: 
+#            left over from an interrupted write
+            if self._staging in f: 
+                del f[self._staging]
+            return self._append(f, records)
+
+    def _append(self, f, records): 
+        for record in records: 
+            if record.uid.decode('utf-8') in f: 
+                raise ValueError('{0} is already stored in {1}'.format(
+                        record.uid.decode('utf-8'), self.path))
+
+        staging = f.create_group(self._staging)
+        # kind of ugly but it works...
+        for record in records: 
+            grp = staging.create_group(name=record.uid.decode('utf-8'))
+            for name, data in zip(record._fields, record): 
+                if isinstance(data, dict) and len(data) > 1: 
+                    subgrp = grp.create_group(name)
+                    for k, v in data.items(): 
+                        subgrp.create_dataset(k, data=v)
+                elif isinstance(data, dict): 
+                    grp.create_dataset(name=name,
+                                       data=next(iter(data.values())))
+                else: 
+                    grp.create_dataset(name=name, data=data)
+        f.flush()
+        for record in records: 
+            name = record.uid.decode('utf-8')
+            f.move('{0}/{1}'.format(self._staging, name), name)
+        del f[self._staging]
+        return len(records)
+
+    def close(self): 
+        pass
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+class FetchedLog(object): 
+    """
+    Pubmed IDs whose efetch results have been saved, including the articles 
+    that SummarySoup skips (not MEDLINE-indexed, or without an abstract), 
+    which are never stored and would otherwise be fetched again by every 
+    incremental update. 
+
+    Parameters
+    ------------
+    folder : str
+        Folder the harvest saves to. 
+    """
+    def __init__(self, folder): 
+        self.path = os.path.join(folder, FETCHED_FILENAME)
+
+    def append(self, uids): 
+        uids = UIDArray(uids).array
+        with h5py.File(self.path, 'a') as f: 
+            if 'uid' not in f: 
+                f.create_dataset('uid', shape=(0,), maxshape=(None,), 
+                                 dtype=UIDArray.dtype, chunks=(SUMMARY_RETMAX,))
+            dataset = f['uid']
+            n = len(dataset)
+            dataset.resize((n + len(uids),))
+            dataset[n:] = uids
+
+    @property
+    def uids(self): 
+        if not os.path.exists(self.path): 
+            return UIDArray()
+        with h5py.File(self.path, 'r') as f: 
+            return UIDArray(f['uid'][()])
+
+
+def known_pmids(folder): 
+    """
+    Pubmed IDs that are already in 'folder', in either layout or in its 
+    FetchedLog, and don't need to be fetched again. 
+    """
+    known = [FetchedLog(folder).uids]
+    path = os.path.join(folder, COLUMNS_FILENAME)
+    if os.path.exists(path): 
+        with ColumnarReader(path) as reader: 
+            known.append(reader.pmids)
+    path = os.path.join(folder, GROUPS_FILENAME)
+    if os.path.exists(path): 
+        with h5py.File(path, 'r') as f: 
+#            groups are named by SummaryRecord.uid, which files saved before 
+#            it was the MedlineCitation's PMID only may hold several IDs in; 
+#            the staging group isn't a number, so it's 0 and dropped
+            pmids = [record_pmid(name) for name in f.keys()]
+            known.append(UIDArray([pmid for pmid in pmids if pmid]))
+    if os.path.isdir(os.path.join(folder, PARQUET_DIRNAME)): 
+        from arrow_sink import parquet_pmids
+        known.append(parquet_pmids(folder))
+    return UIDArray.concatenate(known).unique()
+
+
+def drop_known(records, known): 
+    """
+    SummaryRecords of the iterable 'records' whose Pubmed IDs aren't in 
+    'known' (e.g. from known_pmids), as a list. 
+    """
+    records = list(records)
+    pmids = np.array([record_pmid(r.uid) for r in records], 
+                     dtype=UIDArray.dtype)
+    keep = ~np.isin(pmids, UIDArray(known).array)
+    return [r for r, k in zip(records, keep) if k]
+
+
+# layout -> function of the save folder that returns a writer
+_sinks = {}
+
+
+def register_sink(layout, factory): 
+    """
+    Makes 'layout' available to open_writer, and so to SummarySoup.save and
+    the pipelines. 'factory' takes the save folder and returns a writer
+    like ColumnarWriter: append(records) saves an iterable of
+    SummaryRecords and returns how many were saved, and close() (or
+    leaving a 'with' block) finishes the file. The records have to be on
+    disk once append returns: the pipelines checkpoint them right after.
+    """
+    _sinks[layout] = factory
+
+
+def open_writer(folder, layout='groups'): 
+    """
+    Writer that appends SummaryRecords to 'folder' in the given layout: 
+    'groups' (GroupWriter, pubmed_summary.h5), 'columns' (ColumnarWriter, 
+    pubmed_summary_columns.h5), 'parquet' (arrow_sink.ParquetWriter, 
+    pubmed_summary_parquet/, needs pyarrow) or one added with 
+    register_sink. 
+    """
+    try: 
+        factory = _sinks[layout]
+    except KeyError: 
+        raise ValueError('Unknown layout: {0}'.format(layout))
+    return factory(folder)
+
+
+def _parquet_writer(folder): 
+#    pyarrow is only needed for this layout
+    from arrow_sink import ParquetWriter
+    return ParquetWriter(os.path.join(folder, PARQUET_DIRNAME))
+
+
+class ColumnarWriter(object): 
+    """
+    Stores SummaryRecords column by column instead of as one HDF5 group per
+    article. Each single-valued field is one variable-length string dataset
+    with a row per article. Each sub-key of a multi-valued field (e.g.
+    authors/lastname) is a flat variable-length string dataset of all values,
+    plus an 'offsets' array such that the values of row i are
+    values[offsets[i]:offsets[i + 1]].
+
+    All datasets are chunked and compressed, and are resized once per call to
+    'append', so an efetch batch costs a handful of HDF5 writes no matter
+    how many articles it holds.
+
+    The file's 'n_records' attribute is only updated after a batch has been
+    written completely; readers ignore rows past it. The file is only open
+    while a batch is appended, as with GroupWriter.
+
+    Parameters
+    ------------
+    path : str
+        HDF5 file; created if it doesn't exist, and appended to otherwise.
+
+    chunk_size : int
+        Rows per chunk.
+
+    compression : str
+        h5py compression filter.
+    """
+    def __init__(self, path, chunk_size=SUMMARY_RETMAX, compression='gzip'): 
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compression = compression
+        with h5py.File(path, 'a') as f: 
+            if 'n_records' not in f.attrs: 
+                self._create(f)
+
+    def _dataset(self, f, name, dtype, chunk_size): 
+        f.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, 
+                         chunks=(chunk_size,), compression=self.compression,
+                         shuffle=dtype != _string_dtype)
+
+    def _create(self, f): 
+        self._dataset(f, 'pmid', np.uint64, self.chunk_size)
+        for field in single_fields: 
+            self._dataset(f, field, _string_dtype, self.chunk_size)
+        for field, keys in nested_fields.items(): 
+            for key in keys: 
+                self._dataset(f, '{0}/{1}/values'.format(field, key),
+                              _string_dtype, 4*self.chunk_size)
+                self._dataset(f, '{0}/{1}/offsets'.format(field, key),
+                              np.int64, self.chunk_size)
+                f['{0}/{1}/offsets'.format(field, key)].resize((1,))
+        f.attrs['n_records'] = 0
+
+    @property
+    def n_records(self): 
+        with h5py.File(self.path, 'r') as f: 
+            return int(f.attrs['n_records'])
+
+    @staticmethod
+    def _extend(dataset, start, data): 
+        dataset.resize((start + len(data),))
+        if len(data): 
+            dataset[start:] = data
+
+    def append(self, records): 
+        """
+        Appends an iterable of SummaryRecords, e.g. SummarySoup.records().
+        Returns the number of records written.
+        """
+        records = list(records)
+        with h5py.File(self.path, 'a') as f: 
+            return self._append(f, records)
+
+    def _append(self, f, records): 
+        n = int(f.attrs['n_records'])
+        self._extend(f['pmid'], n, np.array([record_pmid(r.uid)
+                                             for r in records],
+                                            dtype=np.uint64))
+        for field in single_fields: 
+            self._extend(f[field], n, np.array([getattr(r, field) for r in
+                                                records], dtype=object))
+        for field, keys in nested_fields.items(): 
+            for key in keys: 
+                lists = [getattr(r, field)[key] for r in records]
+                offsets = f['{0}/{1}/offsets'.format(field, key)]
+                values = f['{0}/{1}/values'.format(field, key)]
+                start = int(offsets[n])
+                self._extend(values, start, np.array(
+                        [v for li in lists for v in li], dtype=object))
+                ends = start + np.cumsum([len(li) for li in lists],
+                                         dtype=np.int64)
+                self._extend(offsets, n + 1, ends)
+        f.attrs['n_records'] = n + len(records)
+        return len(records)
+
+    def close(self): 
+        pass
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+class ColumnarReader(object): 
+    """
+    Reads back a file written by ColumnarWriter.
+
+    Parameters
+    ------------
+    path : str
+        HDF5 file written by ColumnarWriter.
+    """
+    def __init__(self, path): 
+        self.path = path
+        self._file = h5py.File(path, 'r')
+        self._n = int(self._file.attrs['n_records'])
+        self._order = None
+
+    def __len__(self): 
+        return self._n
+
+    @property
+    def pmids(self): 
+        return self._file['pmid'][:self._n]
+
+    def row(self, i): 
+        """
+        SummaryRecord of the i-th article written.
+        """
+        if not 0 <= i < self._n: 
+            raise IndexError(i)
+        f = self._file
+        fields = {field: f[field][i] for field in single_fields}
+        for field, keys in nested_fields.items(): 
+            fields[field] = {}
+            for key in keys: 
+                start, stop = f['{0}/{1}/offsets'.format(field, key)][i:i + 2]
+                fields[field][key] = list(
+                        f['{0}/{1}/values'.format(field, key)][start:stop])
+        return SummaryRecord(**fields)
+
+    def find(self, pmid): 
+        """
+        Row of the article with Pubmed ID 'pmid', or -1 if it isn't stored.
+        """
+        if self._order is None: 
+            pmids = self.pmids
+            self._order = np.argsort(pmids, kind='stable')
+            self._sorted = pmids[self._order]
+        i = np.searchsorted(self._sorted, int(pmid))
+        if i < self._n and self._sorted[i] == int(pmid): 
+            return int(self._order[i])
+        return -1
+
+    def __getitem__(self, pmid): 
+        """
+        SummaryRecord of the article with Pubmed ID 'pmid'.
+        """
+        i = self.find(pmid)
+        if i < 0: 
+            raise KeyError(pmid)
+        return self.row(i)
+
+    def __contains__(self, pmid): 
+        return self.find(pmid) >= 0
+
+    def close(self): 
+        self._file.close()
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+register_sink('groups', lambda folder: GroupWriter(
+        os.path.join(folder, GROUPS_FILENAME)))
+register_sink('columns', lambda folder: ColumnarWriter(
+        os.path.join(folder, COLUMNS_FILENAME)))
+register_sink('parquet', _parquet_writer)
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import h5py
+import os
+
+from query import SUMMARY_RETMAX
+from soups import SummaryRecord
+from storage import ColumnarWriter, COLUMNS_FILENAME, GROUPS_FILENAME, \
+                    single_fields, nested_fields
+
+INDEX_GROUP = 'index'
+# Fibonacci hashing: the top bits of pmid*2**64/phi spread consecutive Pubmed
+# IDs evenly over the table
+_MULTIPLIER = np.uint64(11400714819323198485)
+
+
+def _slots(pmids, bits): 
+    """
+    Home slot of each of 'pmids' in a hash table of 2**bits slots.
+    """
+    pmids = np.asarray(pmids, dtype=np.uint64)
+    return ((pmids*_MULTIPLIER) >> np.uint64(64 - bits)).astype(np.int64)
+
+
+def build_index(pmids): 
+    """
+    Open-addressing hash table (linear probing, load factor at most 1/2)
+    from Pubmed ID to row. Returns the 'keys' and 'rows' arrays; empty slots
+    have key 0. If a Pubmed ID is stored more than once, its first row is
+    found first.
+
+    Slots are assigned for all rows at once, one probe step per iteration,
+    so building the index of millions of rows takes a few numpy passes.
+    """
+    pmids = np.asarray(pmids, dtype=np.uint64)
+    bits = max(4, int(np.ceil(np.log2(max(1, 2*len(pmids))))))
+    size = 1 << bits
+    keys = np.zeros(size, dtype=np.uint64)
+    rows = np.full(size, -1, dtype=np.int64)
+
+#    rows without a Pubmed ID can't be looked up
+    pending = np.flatnonzero(pmids)
+    slots = _slots(pmids[pending], bits)
+    while len(pending): 
+        free = keys[slots] == 0
+#        of the rows probing the same free slot, the first one gets it
+        taken, first = np.unique(slots[free], return_index=True)
+        winners = pending[free][first]
+        keys[taken] = pmids[winners]
+        rows[taken] = winners
+        placed = np.zeros(len(pending), dtype=bool)
+        placed[np.flatnonzero(free)[first]] = True
+        pending = pending[~placed]
+        slots = (slots[~placed] + 1) & (size - 1)
+    return keys, rows
+
+
+def _write_fixed(group, name, data): 
+    """
+    Writes 'data' to the start of the dataset 'name' of 'group', and its 
+    length to the dataset's 'length' attribute. The dataset is contiguous 
+    and uncompressed, so that it can be memory-mapped, and is overwritten 
+    in place: HDF5 doesn't reclaim the space of deleted datasets, so 
+    replacing it on every rebuild would grow the file each time. Once 
+    'data' no longer fits, the dataset is replaced by one twice as large, 
+    so the space left behind adds up to less than the index itself. 
+    """
+    dataset = group.get(name)
+    if dataset is None or len(dataset) < len(data): 
+        capacity = len(data)
+        if dataset is not None: 
+            capacity = max(capacity, 2*len(dataset))
+            del group[name]
+        dataset = group.create_dataset(name, shape=(capacity,), 
+                                       dtype=data.dtype)
+    if len(data): 
+        dataset[:len(data)] = data
+    dataset.attrs['length'] = len(data)
+
+
+class FieldView(object): 
+    """
+    One field of a SummaryStore, read lazily: indexing or slicing only
+    reads the rows asked for, and iterating reads 'chunk_size' rows at a
+    time.
+
+    Single-valued fields give one bytes object per row; each sub-key of a
+    multi-valued field (e.g. authors/lastname) gives a list per row.
+    """
+    def __init__(self, store, field, key=None, chunk_size=SUMMARY_RETMAX): 
+        self.store = store
+        self.field = field
+        self.key = key
+        self.chunk_size = chunk_size
+        f = store._file
+        if key is None: 
+            self._values = f[field]
+            self._offsets = None
+        else: 
+            self._values = f['{0}/{1}/values'.format(field, key)]
+            self._offsets = store._fixed['{0}/{1}/offsets'.format(field, key)]
+
+    def __len__(self): 
+        return len(self.store)
+
+    def _read(self, start, stop): 
+        if self._offsets is None: 
+            return list(self._values[start:stop])
+        offsets = np.asarray(self._offsets[start:stop + 1])
+        if len(offsets) < 2: 
+            return []
+        values = self._values[int(offsets[0]):int(offsets[-1])]
+        offsets = offsets - offsets[0]
+        return [list(values[a:b]) for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def __getitem__(self, index): 
+        if isinstance(index, slice): 
+            start, stop, step = index.indices(len(self))
+            if step != 1: 
+                raise ValueError('Slices with a step are not supported.')
+            return self._read(start, max(start, stop))
+        if index < 0: 
+            index += len(self)
+        if not 0 <= index < len(self): 
+            raise IndexError(index)
+        return self._read(index, index + 1)[0]
+
+    def __iter__(self): 
+        for start in range(0, len(self), self.chunk_size): 
+            for value in self._read(start, min(len(self),
+                                               start + self.chunk_size)): 
+                yield value
+
+
+class SummaryStore(object): 
+    """
+    Lazy, read-only view of summaries saved in the 'columns' layout (see
+    storage.ColumnarWriter). Nothing is read when the store is opened:
+
+    - Lookups by Pubmed ID go through an open-addressing hash table that is
+      persisted in the file's 'index' group, so each takes O(1) time and
+      touches a couple of pages, however large the file.
+    - The fixed-size columns (Pubmed IDs, offsets of the multi-valued
+      fields) and the index are stored contiguously and uncompressed in the
+      same group, and are memory-mapped rather than read.
+    - Fields are read row by row or slice by slice; see 'field'.
+
+    The index is (re)built when the store is opened if it's missing or if
+    rows were appended since it was built, overwriting the old one in
+    place. Files in the 'groups' layout can
+    be converted once with convert_groups.
+
+    Parameters
+    ------------
+    path : str
+        HDF5 file written by ColumnarWriter, or the folder it was saved to.
+
+    build_index : bool
+        If False, a missing or outdated index raises an IOError instead of
+        being built, e.g. for files that aren't writable.
+    """
+    def __init__(self, path, build_index=True): 
+        if os.path.isdir(path): 
+            path = os.path.join(path, COLUMNS_FILENAME)
+        self.path = path
+        self._file = h5py.File(path, 'r')
+        self._n = int(self._file.attrs['n_records'])
+        if not self._index_current(): 
+            if not build_index: 
+                self._file.close()
+                raise IOError('{0} has no index for its {1} rows.'.format(
+                        path, self._n))
+            self._file.close()
+            self._build_index()
+            self._file = h5py.File(path, 'r')
+        self._fixed = {}
+        index = self._file[INDEX_GROUP]
+        def visit(name, obj): 
+            if isinstance(obj, h5py.Dataset): 
+                self._fixed[name] = self._memmap(obj)
+        index.visititems(visit)
+        self._keys = self._fixed.pop('keys')
+        self._rows = self._fixed.pop('rows')
+        self._bits = int(np.log2(len(self._keys)))
+
+    def _index_current(self): 
+        return INDEX_GROUP in self._file \
+               and self._file[INDEX_GROUP].attrs['n_records'] == self._n
+
+    def _build_index(self): 
+        with h5py.File(self.path, 'a') as f: 
+            index = f.require_group(INDEX_GROUP)
+            index.attrs['n_records'] = -1
+            pmids = f['pmid'][:self._n]
+            keys, rows = build_index(pmids)
+            _write_fixed(index, 'keys', keys)
+            _write_fixed(index, 'rows', rows)
+            _write_fixed(index, 'pmid', pmids)
+            for field, subkeys in nested_fields.items(): 
+                for key in subkeys: 
+                    name = '{0}/{1}/offsets'.format(field, key)
+                    _write_fixed(index, name, f[name][:self._n + 1])
+            index.attrs['n_records'] = self._n
+
+    def _memmap(self, dataset): 
+        length = int(dataset.attrs.get('length', len(dataset)))
+        offset = dataset.id.get_offset()
+        if offset is None: 
+#            no storage allocated, e.g. an empty dataset
+            return dataset[()][:length]
+        return np.memmap(self.path, mode='r', dtype=dataset.dtype,
+                         shape=dataset.shape, offset=offset)[:length]
+
+    def __len__(self): 
+        return self._n
+
+    @property
+    def pmids(self): 
+        """
+        Memory-mapped Pubmed ID of every row.
+        """
+        return self._fixed['pmid']
+
+    def find(self, pmid): 
+        """
+        Row of the article with Pubmed ID 'pmid', or -1 if it isn't stored.
+        """
+        pmid = int(pmid)
+        if pmid <= 0: 
+            return -1
+        mask = len(self._keys) - 1
+        slot = int(_slots([pmid], self._bits)[0])
+        while True: 
+            key = int(self._keys[slot])
+            if key == pmid: 
+                return int(self._rows[slot])
+            if key == 0: 
+                return -1
+            slot = (slot + 1) & mask
+
+    def field(self, field, key=None, chunk_size=SUMMARY_RETMAX): 
+        """
+        FieldView of 'field', e.g. store.field('title'), or of one sub-key
+        of a multi-valued field, e.g. store.field('authors', 'lastname').
+        """
+        if field in nested_fields and key not in nested_fields[field]: 
+            raise KeyError('{0} has the keys {1}'.format(
+                    field, nested_fields[field]))
+        if field not in nested_fields and field not in single_fields: 
+            raise KeyError(field)
+        return FieldView(self, field, key, chunk_size)
+
+    def row(self, i): 
+        """
+        SummaryRecord of the i-th article written.
+        """
+        if not 0 <= i < self._n: 
+            raise IndexError(i)
+        f = self._file
+        fields = {field: f[field][i] for field in single_fields}
+        for field, keys in nested_fields.items(): 
+            fields[field] = {}
+            for key in keys: 
+                start, stop = self._fixed['{0}/{1}/offsets'.format(
+                        field, key)][i:i + 2]
+                fields[field][key] = list(
+                        f['{0}/{1}/values'.format(field, key)][start:stop])
+        return SummaryRecord(**fields)
+
+    def iter_rows(self, start=0, stop=None, chunk_size=SUMMARY_RETMAX): 
+        """
+        Yields the SummaryRecords of rows [start, stop), reading
+        'chunk_size' rows of each field at a time.
+        """
+        stop = self._n if stop is None else min(stop, self._n)
+        views = [(field, None, self.field(field)) for field in single_fields]
+        views += [(field, key, self.field(field, key))
+                  for field, keys in nested_fields.items() for key in keys]
+        for a in range(start, stop, chunk_size): 
+            b = min(stop, a + chunk_size)
+            chunk = [{field: {} for field in nested_fields}
+                     for _ in range(a, b)]
+            for field, key, view in views: 
+                for fields, value in zip(chunk, view[a:b]): 
+                    if key is None: 
+                        fields[field] = value
+                    else: 
+                        fields[field][key] = value
+            for fields in chunk: 
+                yield SummaryRecord(**fields)
+
+    def __iter__(self): 
+        return self.iter_rows()
+
+    def __getitem__(self, pmid): 
+        """
+        SummaryRecord of the article with Pubmed ID 'pmid'.
+        """
+        i = self.find(pmid)
+        if i < 0: 
+            raise KeyError(pmid)
+        return self.row(i)
+
+    def __contains__(self, pmid): 
+        return self.find(pmid) >= 0
+
+    def close(self): 
+        self._fixed = {}
+        self._keys = self._rows = None
+        self._file.close()
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+def _group_record(grp): 
+    fields = {field: bytes(grp[field][()]) for field in single_fields}
+    for field, keys in nested_fields.items(): 
+        fields[field] = {key: [bytes(v) for v in grp[field][key][()]]
+                         for key in keys}
+    return SummaryRecord(**fields)
+
+
+def convert_groups(folder, chunk_size=SUMMARY_RETMAX): 
+    """
+    Appends the articles of the 'groups' layout file in 'folder'
+    (pubmed_summary.h5) to its 'columns' layout file, so that they can be
+    read with SummaryStore. Returns the number of articles converted.
+    """
+    n = 0
+    with h5py.File(os.path.join(folder, GROUPS_FILENAME), 'r') as f, \
+         ColumnarWriter(os.path.join(folder, COLUMNS_FILENAME)) as writer: 
+        names = sorted((name for name in f.keys() if name.isdigit()), key=int)
+        for start in range(0, len(names), chunk_size): 
+            n += writer.append(_group_record(f[name])
+                               for name in names[start:start + chunk_size])
+    return n
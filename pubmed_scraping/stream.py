@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from lxml import etree
+import io
+
+from soups import FastSummarySoup, SummaryRecord
+
+# compiled once, with FastSummarySoup
+_summary_extractor = FastSummarySoup._extractor
+
+
+def _lower_attrib(element): 
+    return {k.lower(): v for k, v in element.attrib.items()}
+
+
+def _is_summary(article): 
+    """
+    Same filter as SummarySoup.__iter__: MEDLINE-indexed articles that have
+    an abstract.
+    """
+    citation = abstract = None
+    for element in article.iterdescendants(): 
+        if not isinstance(element.tag, str): 
+            continue
+        tag = element.tag.lower()
+        if citation is None and tag == 'medlinecitation': 
+            citation = element
+        elif tag == 'abstract': 
+            abstract = element
+            break
+    return citation is not None and abstract is not None \
+           and _lower_attrib(citation).get('status') == 'MEDLINE'
+
+
+def iter_summaries(source): 
+    """
+    Streams the articles of an efetch response, yielding one SummaryRecord
+    per article as soon as its closing </PubmedArticle> tag has been parsed.
+    Each article's elements are freed once its record has been made, so
+    memory use doesn't grow with the size of the response.
+
+    Records hold the same values as SummarySoup's generator properties, and
+    the same articles are skipped.
+
+    Parameters
+    ------------
+    source : str, bytes or file-like
+        Raw XML, or a binary file object such as the 'raw' attribute of a
+        streamed requests.Response.
+    """
+    if isinstance(source, str): 
+        source = source.encode('utf-8')
+    if isinstance(source, bytes): 
+        source = io.BytesIO(source)
+
+    for _, article in etree.iterparse(source, events=('end',),
+                                      tag='PubmedArticle'):
+        if _is_summary(article): 
+            yield SummaryRecord(**_summary_extractor.extract(article))
+        # free this article and any siblings that came before it
+        article.clear(keep_tail=True)
+        parent = article.getparent()
+        if parent is not None: 
+            while article.getprevious() is not None: 
+                del parent[0]
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from xml.sax.saxutils import escape
+import datetime
+import random
+
+from query import parse_date
+
+FIRST_UID = 10000000
+
+ESEARCH_HEADER = '<?xml version="1.0" encoding="UTF-8" ?>\n' \
+                 '<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch ' \
+                 '20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/' \
+                 'dtd/20060628/esearch.dtd">\n'
+EFETCH_HEADER = '<?xml version="1.0" ?>\n' \
+                '<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, ' \
+                '1st January 2019//EN" "https://dtd.nlm.nih.gov/ncbi/pubmed/' \
+                'out/pubmed_190101.dtd">\n'
+
+_WORDS = ['autophagy', 'membrane', 'vesicle', 'fusion', 'protein', 'kinase',
+          'neuron', 'synapse', 'receptor', 'signaling', 'cell', 'mitochondria',
+          'transport', 'golgi', 'secretion', 'lipid', 'binding', 'structure',
+          'regulation', 'expression', 'mouse', 'human', 'yeast', 'model']
+_LASTNAMES = ['Smith', 'Doe', 'Rothman', 'Shteyn', 'Garcia', 'Chen', 'Kim',
+              'Novak', 'Okafor', 'Larsen', 'Ivanova', 'Tanaka']
+_FORENAMES = ['John', 'Jane', 'James', 'Vladimir', 'Maria', 'Wei', 'Ji-ho',
+              'Petra', 'Chidi', 'Anna', 'Olga', 'Yuki']
+_AGENCIES = ['NIH HHS', 'NIGMS NIH HHS', 'Wellcome Trust', 'NSF']
+_ORGANISMS = [('Homo sapiens', 'Eukaryota; Metazoa; Chordata; Mammalia; '
+                                'Primates; Hominidae; Homo'), 
+              ('Mus musculus', 'Eukaryota; Metazoa; Chordata; Mammalia; '
+                               'Rodentia; Muridae; Mus'), 
+              ('Saccharomyces cerevisiae', 'Eukaryota; Fungi; Ascomycota; '
+                                           'Saccharomycetaceae; Saccharomyces')]
+_AMINO_ACIDS = 'acdefghiklmnpqrstvwy'
+PROTEIN_HEADER = '<?xml version="1.0" encoding="UTF-8" ?>\n' \
+                 '<!DOCTYPE GBSet PUBLIC "-//NCBI//NCBI GBSeq/EN" ' \
+                 '"https://www.ncbi.nlm.nih.gov/dtd/NCBI_GBSeq.dtd">\n'
+GENE_HEADER = '<?xml version="1.0" ?>\n' \
+              '<!DOCTYPE Entrezgene-Set PUBLIC "-//NCBI//NCBI Entrezgene/EN" ' \
+              '"https://www.ncbi.nlm.nih.gov/dtd/NCBI_Entrezgene.dtd">\n'
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+           'Oct', 'Nov', 'Dec']
+
+
+class SyntheticCorpus(object): 
+    """
+    Deterministic stand-in for the Pubmed database. Article k of the corpus
+    has Pubmed ID first_uid + k, and its contents only depend on the seed and
+    on k, so the same article is rendered identically no matter which esearch
+    or efetch window it's requested in.
+
+    Parameters
+    ------------
+    size : int
+        Number of articles in the corpus.
+
+    first_uid : int
+        Pubmed ID of the first article.
+
+    seed : int
+        Seed for the pseudo-random article contents.
+
+    references : int
+        Each article cites up to this many earlier articles of the corpus
+        in its ReferenceList, whose ArticleIds have the same IdTypes as the
+        article's own, like NCBI's.
+    """
+    def __init__(self, size, first_uid=FIRST_UID, seed=0, references=0): 
+        self.size = int(size)
+        self.first_uid = int(first_uid)
+        self.seed = seed
+        self.references = int(references)
+        self._searches = {}
+
+    def __len__(self): 
+        return self.size
+
+    def uids(self, retstart=0, retmax=None): 
+        stop = self.size if retmax is None else min(self.size, retstart + retmax)
+        return [self.first_uid + k for k in range(retstart, stop)]
+
+    def __contains__(self, uid): 
+        return 0 <= int(uid) - self.first_uid < self.size
+
+    def date(self, uid): 
+        """
+        Publication date of the article with Pubmed ID 'uid'. 
+        """
+        k = int(uid) - self.first_uid
+        return datetime.date(1990 + k % 30, 1 + k % 12, 1 + k % 28)
+
+    def search(self, mindate=None, maxdate=None): 
+        """
+        Pubmed IDs of the articles published between 'mindate' and 'maxdate' 
+        (esearch format, both included), in the order esearch returns them. 
+        """
+        if mindate is None and maxdate is None: 
+            return self.uids()
+        key = (mindate, maxdate)
+        if key not in self._searches: 
+            first = parse_date(mindate or '1800')
+            last = parse_date(maxdate or '2100', end=True)
+            self._searches[key] = [uid for uid in self.uids() 
+                                   if first <= self.date(uid) <= last]
+        return self._searches[key]
+
+    def esearch(self, retstart=0, retmax=20, web_env=None, query_key=1, 
+                mindate=None, maxdate=None, uids=None): 
+        """
+        Returns the esearch XML (as bytes) for the window
+        [retstart, retstart + retmax) of the articles published between 
+        'mindate' and 'maxdate', or of the whole corpus. If 'web_env' is 
+        given, the result refers to the history server session 'web_env'. 
+        'uids' are the search results, if they've already been computed 
+        with 'search'. 
+        """
+        retstart, retmax = int(retstart), int(retmax)
+        if uids is None: 
+            uids = self.search(mindate, maxdate)
+        ids = uids[retstart:retstart + retmax]
+        xml = [ESEARCH_HEADER, '<eSearchResult>',
+               '<Count>{0}</Count>'.format(len(uids)),
+               '<RetMax>{0}</RetMax>'.format(len(ids)),
+               '<RetStart>{0}</RetStart>'.format(retstart)]
+        if web_env is not None: 
+            xml.append('<QueryKey>{0}</QueryKey><WebEnv>{1}</WebEnv>'.format(
+                    query_key, web_env))
+        xml.append('<IdList>\n')
+        xml.extend('<Id>{0}</Id>\n'.format(uid) for uid in ids)
+        xml.append('</IdList><TranslationSet/><TranslationStack>'
+                   '<TermSet><Term>synthetic[All Fields]</Term>'
+                   '<Field>All Fields</Field><Count>{0}</Count>'
+                   '<Explode>N</Explode></TermSet></TranslationStack>'
+                   '<QueryTranslation>synthetic[All Fields]</QueryTranslation>'
+                   '</eSearchResult>\n'.format(len(uids)))
+        return ''.join(xml).encode('utf-8')
+
+    def efetch(self, uids): 
+        """
+        Returns the efetch XML (as bytes) for the Pubmed IDs in 'uids'. IDs
+        that aren't part of the corpus are skipped, like NCBI does.
+        """
+        xml = [EFETCH_HEADER, '<PubmedArticleSet>\n']
+        xml.extend(self.article(int(uid)) for uid in uids if int(uid) in self)
+        xml.append('</PubmedArticleSet>\n')
+        return ''.join(xml).encode('utf-8')
+
+    def article(self, uid): 
+        """
+        XML of a single <PubmedArticle>.
+        """
+        k = uid - self.first_uid
+        date = self.date(uid)
+        rng = random.Random('{0}:{1}'.format(self.seed, k))
+        words = lambda n: ' '.join(rng.choice(_WORDS) for _ in range(n))
+        # a minority of records are not indexed for MEDLINE or have no
+        # abstract, which SummarySoup skips
+        status = 'PubMed-not-MEDLINE' if k % 17 == 5 else 'MEDLINE'
+        has_abstract = k % 23 != 7
+
+        authors = []
+        for _ in range(rng.randint(1, 6)): 
+            authors.append(
+                '<Author ValidYN="Y"><LastName>{0}</LastName>'
+                '<ForeName>{1}</ForeName><Initials>{2}</Initials>'
+                '<AffiliationInfo><Affiliation>Department of {3}, '
+                'University {4}.</Affiliation></AffiliationInfo>'
+                '</Author>'.format(rng.choice(_LASTNAMES),
+                                    rng.choice(_FORENAMES),
+                                    rng.choice('ABCDEFGHJK'),
+                                    escape(words(1).title()),
+                                    rng.randint(1, 50)))
+        grants = []
+        for _ in range(rng.randint(0, 2)): 
+            grants.append('<Grant><GrantID>R{0:02d} GM{1:06d}</GrantID>'
+                          '<Acronym>GM</Acronym><Agency>{2}</Agency>'
+                          '<Country>United States</Country></Grant>'.format(
+                                  rng.randint(1, 99), rng.randint(0, 999999),
+                                  rng.choice(_AGENCIES)))
+        grant_list = '<GrantList CompleteYN="Y">{0}</GrantList>'.format(
+                ''.join(grants)) if grants else ''
+        abstract = '<Abstract><AbstractText>{0}.</AbstractText></Abstract>'\
+                   .format(words(rng.randint(40, 120))) if has_abstract else ''
+        references = ''
+        if self.references and k: 
+#            drawn from their own generator, so the rest of the article is 
+#            the same with or without references 
+            cited = random.Random('{0}:references:{1}'.format(self.seed, k))
+            references = '<ReferenceList>{0}</ReferenceList>'.format(''.join(
+                    '<Reference><Citation>{0}</Citation><ArticleIdList>'
+                    '<ArticleId IdType="doi">10.1000/synthetic.{0}</ArticleId>'
+                    '<ArticleId IdType="pubmed">{0}</ArticleId>'
+                    '</ArticleIdList></Reference>'.format(ref) 
+                    for ref in sorted(set(
+                            uid - cited.randint(1, k) 
+                            for _ in range(cited.randint(1, self.references))))))
+
+        return ('<PubmedArticle><MedlineCitation Status="{status}" Owner="NLM">'
+                '<PMID Version="1">{uid}</PMID>'
+                '<Article PubModel="Print-Electronic"><Journal>'
+                '<ISSN IssnType="Electronic">1234-5678</ISSN>'
+                '<JournalIssue CitedMedium="Internet"><Volume>{volume}</Volume>'
+                '<PubDate><Year>{year}</Year><Month>{month}</Month>'
+                '<Day>{day:02d}</Day></PubDate></JournalIssue>'
+                '<Title>Journal of {journal}</Title>'
+                '<ISOAbbreviation>J {journal}</ISOAbbreviation></Journal>'
+                '<ArticleTitle>{title}.</ArticleTitle>{abstract}'
+                '<AuthorList CompleteYN="Y">{authors}</AuthorList>'
+                '<Language>eng</Language>{grants}</Article>'
+                '</MedlineCitation><PubmedData><ArticleIdList>'
+                '<ArticleId IdType="pubmed">{uid}</ArticleId>'
+                '<ArticleId IdType="doi">10.{doi}/synthetic.{uid}</ArticleId>'
+                '<ArticleId IdType="pmc">PMC{pmc}</ArticleId>'
+                '</ArticleIdList>{references}</PubmedData>'
+                '</PubmedArticle>\n').format(
+                        status=status, uid=uid,
+                        volume=rng.randint(1, 300),
+                        year=date.year,
+                        month=_MONTHS[date.month - 1],
+                        day=date.day,
+                        journal=escape(words(1).title()),
+                        title=escape(words(rng.randint(5, 15)).capitalize()),
+                        abstract=abstract,
+                        authors=''.join(authors),
+                        grants=grant_list,
+                        references=references,
+                        doi=rng.randint(1000, 9999),
+                        pmc=rng.randint(100000, 9999999))
+
+    def _rng(self, kind, uid): 
+        return random.Random('{0}:{1}:{2}'.format(self.seed, kind, 
+                                                  uid - self.first_uid))
+
+    def protein_efetch(self, uids): 
+        """
+        Returns protein efetch XML (GBSet, as bytes) for 'uids'; protein
+        k of the corpus cites article k. 
+        """
+        xml = [PROTEIN_HEADER, '<GBSet>\n']
+        xml.extend(self.protein(int(uid)) for uid in uids if int(uid) in self)
+        xml.append('</GBSet>\n')
+        return ''.join(xml).encode('utf-8')
+
+    def protein(self, uid): 
+        """
+        XML of a single <GBSeq>. 
+        """
+        rng = self._rng('protein', uid)
+        words = lambda n: ' '.join(rng.choice(_WORDS) for _ in range(n))
+        organism, lineage = rng.choice(_ORGANISMS)
+        length = rng.randint(50, 600)
+        accession = 'NP_{0:06d}'.format(uid % 1000000)
+        features = ''.join(
+                '<GBFeature><GBFeature_key>{0}</GBFeature_key>'
+                '<GBFeature_location>{1}..{2}</GBFeature_location>'
+                '<GBFeature_quals><GBQualifier><GBQualifier_name>note'
+                '</GBQualifier_name><GBQualifier_value>{3}'
+                '</GBQualifier_value></GBQualifier></GBFeature_quals>'
+                '</GBFeature>'.format(key, start, min(length, start + 40),
+                                      escape(words(3)))
+                for key, start in [('Protein', 1)] + [
+                        ('Region', rng.randint(1, length)) 
+                        for _ in range(rng.randint(0, 3))])
+        return ('<GBSeq><GBSeq_locus>{accession}</GBSeq_locus>'
+                '<GBSeq_length>{length}</GBSeq_length>'
+                '<GBSeq_moltype>AA</GBSeq_moltype>'
+                '<GBSeq_topology>linear</GBSeq_topology>'
+                '<GBSeq_definition>{definition} [{organism}]'
+                '</GBSeq_definition>'
+                '<GBSeq_primary-accession>{accession}'
+                '</GBSeq_primary-accession>'
+                '<GBSeq_accession-version>{accession}.{version}'
+                '</GBSeq_accession-version>'
+                '<GBSeq_other-seqids><GBSeqid>ref|{accession}.{version}|'
+                '</GBSeqid><GBSeqid>gi|{gi}</GBSeqid></GBSeq_other-seqids>'
+                '<GBSeq_source>{organism}</GBSeq_source>'
+                '<GBSeq_organism>{organism}</GBSeq_organism>'
+                '<GBSeq_taxonomy>{lineage}</GBSeq_taxonomy>'
+                '<GBSeq_references><GBReference>'
+                '<GBReference_reference>1</GBReference_reference>'
+                '<GBReference_title>{title}</GBReference_title>'
+                '<GBReference_journal>J {journal}</GBReference_journal>'
+                '<GBReference_pubmed>{uid}</GBReference_pubmed>'
+                '</GBReference></GBSeq_references>'
+                '<GBSeq_feature-table>{features}</GBSeq_feature-table>'
+                '<GBSeq_sequence>{sequence}</GBSeq_sequence>'
+                '</GBSeq>\n').format(
+                        accession=accession, version=rng.randint(1, 3),
+                        length=length, definition=escape(words(3)),
+                        organism=organism, lineage=lineage, 
+                        gi=rng.randint(10**6, 10**9), 
+                        title=escape(words(8).capitalize()),
+                        journal=escape(words(1).title()), uid=uid, 
+                        features=features, 
+                        sequence=''.join(rng.choice(_AMINO_ACIDS) 
+                                         for _ in range(length)))
+
+    def gene_efetch(self, uids): 
+        """
+        Returns gene efetch XML (Entrezgene-Set, as bytes) for 'uids'.
+        """
+        xml = [GENE_HEADER, '<Entrezgene-Set>\n']
+        xml.extend(self.gene(int(uid)) for uid in uids if int(uid) in self)
+        xml.append('</Entrezgene-Set>\n')
+        return ''.join(xml).encode('utf-8')
+
+    def gene(self, uid): 
+        """
+        XML of a single <Entrezgene>; its Gene ID is 'uid'. 
+        """
+        rng = self._rng('gene', uid)
+        words = lambda n: ' '.join(rng.choice(_WORDS) for _ in range(n))
+        organism, lineage = rng.choice(_ORGANISMS)
+        symbol = '{0}{1}'.format(rng.choice(_WORDS)[:4].upper(), 
+                                 rng.randint(1, 20))
+        synonyms = ''.join('<Gene-ref_syn_E>{0}{1}</Gene-ref_syn_E>'.format(
+                symbol[:3], rng.randint(21, 99)) 
+                for _ in range(rng.randint(0, 3)))
+        return ('<Entrezgene><Entrezgene_track-info><Gene-track>'
+                '<Gene-track_geneid>{uid}</Gene-track_geneid>'
+                '<Gene-track_status value="live">0</Gene-track_status>'
+                '</Gene-track></Entrezgene_track-info>'
+                '<Entrezgene_type value="protein-coding">6</Entrezgene_type>'
+                '<Entrezgene_source><BioSource><BioSource_org><Org-ref>'
+                '<Org-ref_taxname>{organism}</Org-ref_taxname>'
+                '<Org-ref_orgname><OrgName><OrgName_lineage>{lineage}'
+                '</OrgName_lineage></OrgName></Org-ref_orgname>'
+                '</Org-ref></BioSource_org></BioSource></Entrezgene_source>'
+                '<Entrezgene_gene><Gene-ref>'
+                '<Gene-ref_locus>{symbol}</Gene-ref_locus>'
+                '<Gene-ref_desc>{description}</Gene-ref_desc>'
+                '<Gene-ref_maploc>{chromosome}q{band}</Gene-ref_maploc>'
+                '{synonyms}'
+                '</Gene-ref></Entrezgene_gene>'
+                '<Entrezgene_prot><Prot-ref><Prot-ref_name>'
+                '<Prot-ref_name_E>{description} protein</Prot-ref_name_E>'
+                '</Prot-ref_name></Prot-ref></Entrezgene_prot>'
+                '<Entrezgene_summary>{summary}.</Entrezgene_summary>'
+                '<Entrezgene_location><Maps>'
+                '<Maps_display-str>{chromosome}q{band}</Maps_display-str>'
+                '</Maps></Entrezgene_location></Entrezgene>\n').format(
+                        uid=uid, organism=organism, lineage=lineage, 
+                        symbol=symbol, description=escape(words(3)), 
+                        chromosome=rng.randint(1, 22), 
+                        band=rng.randint(11, 35), 
+                        synonyms='<Gene-ref_syn>{0}</Gene-ref_syn>'.format(
+                                synonyms) if synonyms else '', 
+                        summary=escape(words(rng.randint(20, 60)).capitalize()))
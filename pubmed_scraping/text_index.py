@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import json
+import math
+import os
+import re
+import h5py
+
+from uid_array import UIDArray
+from storage import record_pmid
+
+INDEX_DIRNAME = 'pubmed_text_index'
+MANIFEST_FILENAME = 'manifest.json'
+# longer terms are cut, so that a segment's terms fit a fixed-width array
+MAX_TERM_LENGTH = 32
+_word = re.compile(r'\w+')
+
+
+def tokenize(text): 
+    """
+    Lower-case words of 'text' (str or utf-8 bytes), as utf-8 bytes of at
+    most MAX_TERM_LENGTH bytes.
+    """
+    if isinstance(text, bytes): 
+        text = text.decode('utf-8', 'replace')
+    return [w.encode('utf-8')[:MAX_TERM_LENGTH]
+            for w in _word.findall(text.lower())]
+
+
+def _postings(terms, docs, tf): 
+    """
+    Sorts postings by term, keeping each term's documents in order.
+    Returns the distinct terms, the offsets of each term's postings, and
+    the postings' documents and term frequencies.
+    """
+    unique, inverse = np.unique(terms, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    offsets = np.zeros(len(unique) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(inverse, minlength=len(unique)))
+    return unique, offsets, docs[order], tf[order]
+
+
+class _Segment(object): 
+    """
+    Immutable part of a TextIndex: the postings of the documents
+    [first_doc, first_doc + n_docs), in one HDF5 file. The term dictionary
+    and the documents are read when it's opened; posting lists are read
+    from disk term by term.
+
+    Each term's documents are stored delta-encoded (the first relative to
+    first_doc), so they are small integers that the shuffle and gzip
+    filters compress well; np.cumsum decodes them.
+    """
+    def __init__(self, path, first_doc): 
+        self.path = path
+        self.first_doc = first_doc
+        self._file = h5py.File(path, 'r')
+        self.terms = self._file['terms'][()]
+        self.offsets = self._file['offsets'][()]
+        self.pmid = self._file['pmid'][()]
+        self.length = self._file['length'][()]
+
+    def __len__(self): 
+        return len(self.pmid)
+
+    @staticmethod
+    def write(path, first_doc, pmid, length, terms, docs, tf): 
+        """
+        Writes the segment; 'docs' are absolute document numbers, sorted
+        within each term, and 'terms' the term of each posting.
+        """
+        unique, offsets, docs, tf = _postings(terms, docs, tf)
+        deltas = np.diff(docs, prepend=first_doc)
+#        each term's list starts over from first_doc
+        starts = offsets[:-1]
+        deltas[starts] = docs[starts] - first_doc
+#        a batch of articles without any text (e.g. titles with inline 
+#        markup are read as b'') has no postings, and HDF5 can't chunk an 
+#        empty dataset 
+        filters = {}
+        if len(docs): 
+            filters = {'chunks': (min(len(docs), 1 << 14),), 
+                       'compression': 'gzip', 'shuffle': True}
+        tmp = path + '.tmp'
+        with h5py.File(tmp, 'w') as f: 
+            f.create_dataset('terms', data=unique.astype(
+                    'S{0}'.format(MAX_TERM_LENGTH)))
+            f.create_dataset('offsets', data=offsets)
+            f.create_dataset('docs', data=deltas.astype(np.uint32), **filters)
+            f.create_dataset('tf', data=np.minimum(tf, 2**16 - 1).astype(
+                    np.uint16), **filters)
+            f.create_dataset('pmid', data=pmid.astype(np.uint64))
+            f.create_dataset('length', data=length.astype(np.uint32))
+        os.replace(tmp, path)
+
+    def find(self, term): 
+        i = np.searchsorted(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term: 
+            return i
+        return -1
+
+    def postings(self, term): 
+        """
+        Documents (absolute, sorted) and term frequencies of 'term'.
+        """
+        i = self.find(term)
+        if i < 0: 
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        deltas = self._file['docs'][start:stop].astype(np.int64)
+        return self.first_doc + np.cumsum(deltas), self._file['tf'][start:stop]
+
+    def all_postings(self): 
+        """
+        Term, absolute document and frequency of every posting.
+        """
+        counts = np.diff(self.offsets)
+        deltas = self._file['docs'][()].astype(np.int64)
+        terms = np.repeat(np.arange(len(self.terms)), counts)
+#        cumulative sums restart at each term's first posting
+        starts = self.offsets[:-1][counts > 0]
+        total = np.cumsum(deltas)
+        base = np.repeat(total[starts] - deltas[starts], counts[counts > 0])
+        docs = self.first_doc + total - base
+        return self.terms[terms], docs, self._file['tf'][()]
+
+    def close(self): 
+        self._file.close()
+
+
+class TextIndex(object): 
+    """
+    On-disk inverted index of the titles and abstracts of saved summaries, 
+    for BM25-ranked ('search') and boolean ('match') queries without going
+    back to NCBI.
+
+    Each call to 'add' (e.g. each efetch batch, see Pipeline's 'indexes')
+    writes a new segment: a term dictionary and delta-encoded, compressed
+    posting lists for the batch's articles. Segments of similar size are
+    merged as they pile up, so a query reads O(log n) segments, and only
+    the posting lists of its own terms. A manifest, replaced atomically
+    after each change, lists the segments that make up the index, so an
+    interrupted 'add' leaves the index as it was.
+
+    Parameters
+    ------------
+    folder : str
+        Folder the harvest saves to. The index is kept in its
+        pubmed_text_index sub-folder.
+
+    fields : tuple of str
+        SummaryRecord fields whose text is indexed.
+
+    merge_factor : float
+        The newest segment is merged into the one before it while that one
+        holds fewer than merge_factor times as many articles.
+
+    k1, b : float
+        BM25 parameters.
+    """
+    def __init__(self, folder, fields=('title', 'abstract'), merge_factor=2.,
+                 k1=1.2, b=0.75): 
+        self.path = os.path.join(folder, INDEX_DIRNAME)
+        os.makedirs(self.path, exist_ok=True)
+        self.fields = fields
+        self.merge_factor = merge_factor
+        self.k1 = k1
+        self.b = b
+        self._manifest = {'segments': [], 'next': 0}
+        manifest = os.path.join(self.path, MANIFEST_FILENAME)
+        if os.path.exists(manifest): 
+            with open(manifest) as f: 
+                self._manifest = json.load(f)
+        self._segments = [self._open(entry) 
+                          for entry in self._manifest['segments']]
+        self._update_docs()
+
+    def _open(self, entry): 
+        return _Segment(os.path.join(self.path, entry['name']), 
+                        entry['first_doc'])
+
+    def _update_docs(self): 
+        self._pmid = np.concatenate([np.empty(0, dtype=np.uint64)] + 
+                                    [s.pmid for s in self._segments])
+        self._length = np.concatenate([np.empty(0, dtype=np.uint32)] + 
+                                      [s.length for s in self._segments])
+        self._avg_length = max(1., float(self._length.mean())) \
+                           if len(self._length) else 1.
+        self._sorted = np.sort(self._pmid)
+
+    def _write_manifest(self): 
+        path = os.path.join(self.path, MANIFEST_FILENAME)
+        with open(path + '.tmp', 'w') as f: 
+            json.dump(self._manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _new_name(self): 
+        self._manifest['next'] += 1
+        return 'segment_{0:06d}.h5'.format(self._manifest['next'])
+
+    def __len__(self): 
+        return len(self._pmid)
+
+    @property
+    def pmids(self): 
+        """
+        Pubmed IDs of the indexed articles, in the order they were added.
+        """
+        return UIDArray(self._pmid)
+
+    def add(self, records): 
+        """
+        Indexes an iterable of SummaryRecords, e.g. one efetch batch.
+        Articles that are already indexed are skipped. Returns the number
+        of articles indexed.
+        """
+        pmids, lengths, terms, docs, tf = [], [], [], [], []
+        first_doc = len(self)
+        seen = set()
+        for record in records: 
+            pmid = record_pmid(record.uid)
+            i = np.searchsorted(self._sorted, pmid)
+            if pmid in seen or (i < len(self._sorted) 
+                                and self._sorted[i] == pmid): 
+                continue
+            seen.add(pmid)
+            tokens = [t for field in self.fields 
+                      for t in tokenize(getattr(record, field))]
+            doc_terms, counts = np.unique(np.array(tokens, dtype='S{0}'.format(
+                    MAX_TERM_LENGTH)), return_counts=True)
+            terms.append(doc_terms)
+            tf.append(counts)
+            docs.append(np.full(len(doc_terms), first_doc + len(pmids), 
+                                dtype=np.int64))
+            pmids.append(pmid)
+            lengths.append(len(tokens))
+        if not pmids: 
+            return 0
+
+        name = self._new_name()
+        _Segment.write(os.path.join(self.path, name), first_doc, 
+                       np.array(pmids, dtype=np.uint64), np.array(lengths), 
+                       np.concatenate(terms), np.concatenate(docs), 
+                       np.concatenate(tf))
+        self._manifest['segments'].append({'name': name, 
+                                           'first_doc': first_doc, 
+                                           'n_docs': len(pmids)})
+        self._segments.append(self._open(self._manifest['segments'][-1]))
+        while len(self._segments) > 1 and len(self._segments[-2]) \
+              < self.merge_factor*len(self._segments[-1]): 
+            self._merge(len(self._segments) - 2)
+        self._write_manifest()
+        self._remove_unused()
+        self._update_docs()
+        return len(pmids)
+
+    def _merge(self, start): 
+        """
+        Merges the segments from 'start' on into one. The manifest isn't
+        written.
+        """
+        merged = self._segments[start:]
+        parts = [s.all_postings() for s in merged]
+        name = self._new_name()
+        first_doc = merged[0].first_doc
+        _Segment.write(os.path.join(self.path, name), first_doc, 
+                       np.concatenate([s.pmid for s in merged]), 
+                       np.concatenate([s.length for s in merged]), 
+                       np.concatenate([p[0] for p in parts]), 
+                       np.concatenate([p[1] for p in parts]), 
+                       np.concatenate([p[2] for p in parts]))
+        for segment in merged: 
+            segment.close()
+        entry = {'name': name, 'first_doc': first_doc, 
+                 'n_docs': sum(len(s) for s in merged)}
+        self._manifest['segments'][start:] = [entry]
+        self._segments[start:] = [self._open(entry)]
+
+    def merge(self): 
+        """
+        Merges all segments into one, e.g. once a harvest is complete.
+        """
+        if len(self._segments) > 1: 
+            self._merge(0)
+            self._write_manifest()
+            self._remove_unused()
+
+    def _remove_unused(self): 
+        used = set(entry['name'] for entry in self._manifest['segments'])
+        for name in os.listdir(self.path): 
+            if name.startswith('segment_') and name not in used: 
+                os.remove(os.path.join(self.path, name))
+
+    def postings(self, term): 
+        """
+        Sorted document numbers, and frequencies, of one term over all
+        segments.
+        """
+        term = tokenize(term)
+        if len(term) != 1: 
+            raise ValueError('Not a single term: {0}'.format(term))
+        parts = [s.postings(term[0]) for s in self._segments]
+        if not parts: 
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16)
+        return np.concatenate([p[0] for p in parts]), \
+               np.concatenate([p[1] for p in parts])
+
+    def search(self, text, k=10): 
+        """
+        The 'k' best matches of 'text' by BM25, as a list of (Pubmed ID,
+        score), best first.
+        """
+        n = len(self)
+        docs, scores = [], []
+        for term in set(tokenize(text)): 
+            term_docs, tf = self.postings(term)
+            if not len(term_docs): 
+                continue
+            df = len(term_docs)
+            idf = math.log(1 + (n - df + 0.5)/(df + 0.5))
+            tf = tf.astype(np.float64)
+            norm = self.k1*(1 - self.b + self.b*self._length[term_docs]
+                            / self._avg_length)
+            docs.append(term_docs)
+            scores.append(idf*tf*(self.k1 + 1)/(tf + norm))
+        if not docs: 
+            return []
+        docs, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(scores))
+        if len(scores) > k: 
+            best = np.argpartition(-scores, k)[:k]
+        else: 
+            best = np.arange(len(scores))
+#        ties are broken by document number, i.e. by when they were added
+        best = best[np.lexsort((docs[best], -scores[best]))]
+        return [(int(self._pmid[docs[i]]), float(scores[i])) for i in best]
+
+    def match(self, query): 
+        """
+        UIDArray of the Pubmed IDs of the articles matching a boolean
+        query, in the order they were added. Terms next to each other must
+        all match; OR, NOT and parentheses work as usual, e.g. 
+        'autophagy (yeast OR mouse) NOT kinase'. 
+        """
+        docs = _BooleanParser(self, query).parse()
+        return UIDArray(self._pmid[docs])
+
+    def close(self): 
+        for segment in self._segments: 
+            segment.close()
+        self._segments = []
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+
+class _BooleanParser(object): 
+    """
+    Recursive descent parser of TextIndex.match queries, evaluated to
+    sorted arrays of document numbers as they are parsed:
+
+        or  := and ('OR' and)*
+        and := not ('AND'? not)*
+        not := 'NOT' not | '(' or ')' | term
+    """
+    _token = re.compile(r'\(|\)|[^\s()]+')
+
+    def __init__(self, index, query): 
+        self.index = index
+        self.tokens = self._token.findall(query)
+        self.i = 0
+
+    def _peek(self): 
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def _next(self): 
+        token = self._peek()
+        self.i += 1
+        return token
+
+    def parse(self): 
+        docs = self._or()
+        if self._peek() is not None: 
+            raise ValueError('Unexpected {0!r} in query'.format(self._peek()))
+        return docs
+
+    def _or(self): 
+        docs = self._and()
+        while self._peek() == 'OR': 
+            self._next()
+            docs = np.union1d(docs, self._and())
+        return docs
+
+    def _and(self): 
+        docs = self._not()
+        while self._peek() not in (None, 'OR', ')'): 
+            if self._peek() == 'AND': 
+                self._next()
+            docs = np.intersect1d(docs, self._not(), assume_unique=True)
+        return docs
+
+    def _not(self): 
+        token = self._next()
+        if token == 'NOT': 
+            return np.setdiff1d(np.arange(len(self.index)), self._not(), 
+                                assume_unique=True)
+        if token == '(': 
+            docs = self._or()
+            if self._next() != ')': 
+                raise ValueError('Missing ) in query')
+            return docs
+        if token in (None, ')', 'OR', 'AND'): 
+            raise ValueError('Expected a term, got {0!r}'.format(token))
+        terms = tokenize(token)
+        if not terms: 
+            return np.empty(0, dtype=np.int64)
+#        e.g. 'golgi-apparatus' is two terms, both of which must match
+        docs = self.index.postings(terms[0])[0]
+        for term in terms[1:]: 
+            docs = np.intersect1d(docs, self.index.postings(term)[0], 
+                                  assume_unique=True)
+        return docs
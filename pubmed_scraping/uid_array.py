@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+
+class UIDArray(object): 
+    """
+    Pubmed IDs held in one numpy uint64 array, i.e. 8 bytes per ID, instead
+    of a Python bytes object per ID.
+
+    Parameters
+    ------------
+    uids : UIDArray, numpy array, bytes, str or iterable
+        bytes and str are lists of IDs separated by commas or whitespace,
+        e.g. UIDQuery's saveable format. Iterables can hold ints, str or
+        bytes. Tokens that aren't made up of digits (once spaces are
+        removed) are dropped, the way UIDQuery has always filtered its
+        search terms.
+    """
+    dtype = np.uint64
+
+    def __init__(self, uids=()): 
+        self.array = self._parse(uids)
+
+    @classmethod
+    def _parse(cls, uids): 
+        if isinstance(uids, UIDArray): 
+            return uids.array
+        if isinstance(uids, np.ndarray) and uids.dtype.kind in 'ui': 
+            return uids.astype(cls.dtype, copy=False).ravel()
+        if isinstance(uids, str): 
+            uids = uids.encode('utf-8')
+        if isinstance(uids, bytes): 
+            tokens = uids.replace(b',', b' ').split()
+        elif isinstance(uids, np.ndarray) and uids.ndim == 0: 
+            return cls._parse(uids[()])
+        else: 
+            tokens = [t.encode('utf-8') if isinstance(t, str) else t
+                      for t in uids]
+        if not len(tokens): 
+            return np.empty(0, dtype=cls.dtype)
+
+        tokens = np.asarray(tokens)
+        if tokens.dtype.kind in 'ui': 
+            return tokens.astype(cls.dtype).ravel()
+        if tokens.dtype.kind != 'S': 
+            tokens = tokens.astype(bytes)
+        tokens = np.char.replace(tokens.ravel(), b' ', b'')
+        return tokens[np.char.isdigit(tokens)].astype(cls.dtype)
+
+    @classmethod
+    def concatenate(cls, arrays): 
+        """
+        UIDArray of the IDs of each of 'arrays' in turn.
+        """
+        arrays = [cls(a).array for a in arrays]
+        if not arrays: 
+            return cls()
+        return cls(np.concatenate(arrays))
+
+    def unique(self): 
+        """
+        Same IDs without duplicates, in the order they first occur.
+        """
+        _, first = np.unique(self.array, return_index=True)
+        return UIDArray(self.array[np.sort(first)])
+
+    def difference(self, other): 
+        """
+        IDs that aren't in 'other', in their original order.
+        """
+        other = UIDArray(other).array
+        return UIDArray(self.array[~np.isin(self.array, other)])
+
+    def batches(self, size): 
+        """
+        Yields consecutive UIDArrays of at most 'size' IDs. They are views,
+        so no IDs are copied.
+        """
+        size = int(size)
+        for start in range(0, len(self), size): 
+            yield self[start:start + size]
+
+    def to_bytes(self, sep=b','): 
+        return sep.join(self.array.astype(bytes).tolist())
+
+    def to_str(self, sep=','): 
+        return self.to_bytes(sep.encode('utf-8')).decode('utf-8')
+
+    def tolist(self): 
+        return self.array.tolist()
+
+    def __array__(self, dtype=None, copy=None): 
+        if dtype is None: 
+            return self.array
+        return self.array.astype(dtype)
+
+    def __len__(self): 
+        return len(self.array)
+
+    def __iter__(self): 
+        return iter(self.array.tolist())
+
+    def __getitem__(self, index): 
+        if isinstance(index, slice): 
+            return UIDArray(self.array[index])
+        return int(self.array[index])
+
+    def __contains__(self, uid): 
+        return bool(np.any(self.array == int(uid)))
+
+    def __eq__(self, other): 
+        try: 
+            other = UIDArray(other)
+        except (TypeError, ValueError): 
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+
+    def __repr__(self): 
+        return '{0}({1})'.format(type(self).__name__, self.array.tolist())
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from lxml import etree
+
+# NCBI's spelling of the tag and attribute names of the summary and esearch
+# field specs, which are written in lower case for BeautifulSoup's lxml HTML
+# parser
+NCBI_NAMES = ('PubmedArticle', 'MedlineCitation', 'Status', 'Abstract', 
+              'AbstractText', 'IdType', 'ArticleTitle', 'Author', 'LastName', 
+              'ForeName', 'Affiliation', 'PubDate', 'Year', 'Month', 'Day', 
+              'ISOAbbreviation', 'Grant', 'GrantID', 'Agency', 'IdList', 'Id', 
+              'PMID', 'PubmedData', 'ArticleIdList')
+_ncbi_case = {name.lower(): name for name in NCBI_NAMES}
+
+
+def ncbi_name(name): 
+    """
+    NCBI's spelling of a tag or attribute name; names that aren't in
+    NCBI_NAMES are taken to be spelled correctly already. 
+    """
+    return _ncbi_case.get(name, name)
+
+
+def _string(element): 
+    """
+    Same as BeautifulSoup's Tag.string: the element's text if that is its
+    only child, the string of its only child element if it has no text, and
+    None otherwise.
+    """
+    while True: 
+        if len(element) == 0: 
+            return element.text
+        if element.text or len(element) > 1 or element[0].tail: 
+            return None
+        element = element[0]
+
+
+def _literal(value): 
+    if "'" not in value: 
+        return "'{0}'".format(value)
+    return 'concat({0})'.format(', "\'", '.join(
+            "'{0}'".format(part) for part in value.split("'")))
+
+
+def _predicates(attrs): 
+    return ''.join('[@{0}={1}]'.format(k, _literal(v)) 
+                   for k, v in attrs.items())
+
+
+class XPathExtractor(object): 
+    """
+    The keyword arguments of a Soup class (see 
+    NCBISoupABC.add_generator_property), compiled once into lxml XPath 
+    expressions that are evaluated on each article's lxml element: 
+
+        'articletitle'                   .//ArticleTitle
+        {'idtype': 'doi'}                .//*[@IdType]
+        {'idtype': 'doi', 
+         'parent': 'articleidlist'}      .//ArticleIdList/*[@IdType]
+        {'name': 'pmid', 
+         'parent': 'medlinecitation'}    .//MedlineCitation/PMID
+        ('author', ('lastname', ...))    .//Author//*[self::LastName or ...]
+
+    The keys of a nested field can also be a dict from key to tag name, 
+    e.g. ('GBReference', {'pubmed': 'GBReference_pubmed'}). Nested fields 
+    with aligned keys match their containers as well, e.g. 
+    .//Author | .//Author//*[...], and the children are grouped by the 
+    container before them. 
+
+    Fields matched by attributes only are grouped by their first attribute 
+    and parents, e.g. the doi and pmc IDs, so the article is searched once 
+    for all of them, and the values are told apart in Python. 
+
+    Fields hold the same values as FieldExtractor's, but tag and attribute 
+    names are matched as they are spelled, which is what makes the 
+    expressions fast. Names of the lower case specs written for 
+    BeautifulSoup are spelled the way NCBI does (see NCBI_NAMES). 
+    """
+    def __init__(self, kwargs): 
+        self.fields = list(kwargs.keys())
+        self.single = []
+        self.by_attr = {}        # attribute, parents -> path, [(field, attrs)]
+        self.nested = []
+        for field, spec in kwargs.items(): 
+            if isinstance(spec, (str, bytes)): 
+                spec = {'name': spec}
+            if isinstance(spec, dict): 
+                spec = {ncbi_name(k): v for k, v in spec.items()}
+                tag = spec.pop('name', None)
+                parents = spec.pop('parent', ())
+                if isinstance(parents, str): 
+                    parents = (parents,)
+                within = ''.join(ncbi_name(p) + '/' for p in parents)
+                if tag is None: 
+                    key = (next(iter(spec)), within)
+                    if key not in self.by_attr: 
+                        self.by_attr[key] = (etree.XPath(
+                                './/{1}*[@{0}]'.format(*key)), [])
+                    self.by_attr[key][1].append((field, spec))
+                    continue
+                path = etree.XPath('.//{0}{1}{2}'.format(
+                        within, ncbi_name(tag), _predicates(spec)))
+                self.single.append((field, path))
+            else: 
+                tag, keys = spec[:2]
+                aligned = set(spec[2]) if len(spec) > 2 else set()
+                if not isinstance(keys, dict): 
+                    keys = {key: key for key in keys}
+                names = {ncbi_name(name): key for key, name in keys.items()}
+                children = './/{0}//*[{1}]'.format(
+                        ncbi_name(tag), 
+                        ' or '.join('self::' + name for name in names))
+                container = None
+                if aligned: 
+#                    the containers too, in document order, so that each 
+#                    child can be assigned to its container 
+                    container = ncbi_name(tag)
+                    children = './/{0} | {1}'.format(container, children)
+                self.nested.append((field, keys, names, etree.XPath(children), 
+                                    container, aligned))
+
+    @staticmethod
+    def is_article(article): 
+        return isinstance(article, etree._Element)
+
+    def extract(self, article): 
+        """
+        Same as FieldExtractor.extract, for an lxml element. 
+        """
+        fields = {}
+        for field, path in self.single: 
+            fields[field] = self._join(path(article))
+        for path, specs in self.by_attr.values(): 
+            matched = {field: [] for field, attrs in specs}
+            for element in path(article): 
+                get = element.attrib.get
+                for field, attrs in specs: 
+                    if all(get(k) == v for k, v in attrs.items()): 
+                        matched[field].append(element)
+            for field, elements in matched.items(): 
+                fields[field] = self._join(elements)
+        for field, keys, names, path, container, aligned in self.nested: 
+            values = {key: [] for key in keys}
+            if container is None: 
+                for element in path(article): 
+                    values[names[element.tag]].append(
+                            (_string(element) or '').encode('utf-8'))
+            else: 
+                found = None
+                for element in path(article): 
+                    if element.tag == container: 
+                        self._align(values, found, aligned)
+                        found = {key: [] for key in keys}
+                    else: 
+                        found[names[element.tag]].append(
+                                (_string(element) or '').encode('utf-8'))
+                self._align(values, found, aligned)
+            fields[field] = values
+        return {field: fields[field] for field in self.fields}
+
+    @staticmethod
+    def _align(values, found, aligned): 
+        """
+        Adds the values 'found' in one container to 'values', one per 
+        aligned key. 
+        """
+        if found is None: 
+            return
+        for key, strings in found.items(): 
+            if key in aligned: 
+                strings = strings[:1] or [b'']
+            values[key].extend(strings)
+
+    @staticmethod
+    def _join(elements): 
+        strings = [_string(element) for element in elements]
+        if None in strings: 
+            return b''
+        return ' '.join(strings).encode('utf-8')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import os
+
+from py3_modules.pubmed_scraping.pubmed_scraping import storage, stream, \
+                                                         soups, synthetic, \
+                                                         parallel, limiter, \
+                                                         pipeline
+try: 
+    import pyarrow.parquet as pq
+    from py3_modules.pubmed_scraping.pubmed_scraping import arrow_sink
+except ImportError: 
+    pq = None
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+@unittest.skipIf(pq is None, 'pyarrow is not installed')
+class ParquetWriterTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, storage.PARQUET_DIRNAME)
+        corpus = synthetic.SyntheticCorpus(300)
+        self.batches = [list(stream.iter_summaries(corpus.efetch(
+                                corpus.uids(start, 100))))
+                        for start in (0, 100, 200)]
+        self.records = [r for batch in self.batches for r in batch]
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def test_round_trip(self): 
+        with storage.open_writer(self.folder.name, 'parquet') as writer: 
+            for batch in self.batches: 
+                writer.append(batch)
+            writer.append([])
+        self.assertEqual(list(arrow_sink.iter_records(self.folder.name)), 
+                         self.records)
+        # one part file, with one row group, per batch 
+        names = sorted(os.listdir(self.path))
+        self.assertEqual(names, ['part-00000.parquet', 'part-00001.parquet', 
+                                 'part-00002.parquet'])
+        for name, batch in zip(names, self.batches): 
+            f = pq.ParquetFile(os.path.join(self.path, name))
+            self.assertEqual(f.num_row_groups, 1)
+            self.assertEqual(f.metadata.num_rows, len(batch))
+        
+        table = arrow_sink.read_table(self.folder.name, ['pmid', 'authors'])
+        self.assertEqual(table.column('pmid').to_pylist(), 
+                         [int(r.uid) for r in self.records])
+        self.assertEqual(table.column('authors').combine_chunks().field(
+                'lastname').to_pylist()[3], 
+                [v.decode('utf-8') for v in self.records[3].authors['lastname']])
+    
+    def test_batch_on_disk_before_close(self): 
+        writer = storage.open_writer(self.folder.name, 'parquet')
+        writer.append(self.batches[0])
+        # e.g. the run crashed here 
+        self.assertEqual(list(arrow_sink.iter_records(self.folder.name)), 
+                         self.batches[0])
+        self.assertEqual(sorted(storage.known_pmids(self.folder.name).tolist()), 
+                         sorted(int(r.uid) for r in self.batches[0]))
+
+    def test_summary_soup_save(self): 
+        corpus = synthetic.SyntheticCorpus(50)
+        soup = soups.SummarySoup(corpus.efetch(corpus.uids()).decode('utf-8'))
+        soup.save(self.folder.name, layout='parquet')
+        soup.save(self.folder.name, layout='parquet')
+        self.assertEqual(sorted(os.listdir(self.path)), 
+                         ['part-00000.parquet', 'part-00001.parquet'])
+        pmids = storage.known_pmids(self.folder.name)
+        self.assertEqual(sorted(pmids.tolist()), 
+                         sorted(int(r.uid) for r in soup.records()))
+    
+    def test_parallel_pipeline(self): 
+        corpus = synthetic.SyntheticCorpus(1200)
+        with EutilsSimulator(corpus) as stub: 
+            pipe = parallel.ParallelPipeline([[b'author', b'shteyn']], 
+                                             n_workers=1, 
+                                             limiter=limiter.TokenBucket(rate=100))
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(1200, self.folder.name, layout='parquet')
+        expected = list(stream.iter_summaries(corpus.efetch(corpus.uids())))
+        self.assertEqual(list(arrow_sink.iter_records(self.folder.name)), 
+                         expected)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+    
+    def test_async_pipeline(self): 
+        corpus = synthetic.SyntheticCorpus(1200)
+        with EutilsSimulator(corpus) as stub: 
+            pipe = pipeline.AsyncPipeline([[b'author', b'shteyn']], 
+                                          limiter=limiter.TokenBucket(rate=100))
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(1200, self.folder.name, layout='parquet')
+            n_requests = len(stub.log)
+#            the run was complete, so the next one starts over, and stores 
+#            nothing twice 
+            pipe.request(1200, self.folder.name, layout='parquet')
+            self.assertEqual(len(stub.log), 2*n_requests)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+        self.assertEqual(len(list(arrow_sink.iter_records(self.folder.name))), 
+                         len(list(stream.iter_summaries(
+                                 corpus.efetch(corpus.uids())))))
+
+
+class RegisterSinkTest(unittest.TestCase): 
+    def test_custom_layout(self): 
+        saved = []
+        class ListWriter(object): 
+            def __init__(self, folder): 
+                pass
+            def append(self, records): 
+                saved.extend(records)
+                return len(records)
+            def close(self): 
+                pass
+            def __enter__(self): 
+                return self
+            def __exit__(self, *args): 
+                self.close()
+        
+        storage.register_sink('list', ListWriter)
+        corpus = synthetic.SyntheticCorpus(20)
+        records = list(stream.iter_summaries(corpus.efetch(corpus.uids())))
+        with storage.open_writer('', 'list') as writer: 
+            writer.append(records)
+        self.assertEqual(saved, records)
+        self.assertRaises(ValueError, storage.open_writer, '', 'rows')
+
+
+if __name__ == '__main__': 
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import asyncio
+import os
+
+from requests.exceptions import ConnectionError
+
+from py3_modules.pubmed_scraping.pubmed_scraping import batch, limiter, \
+                                                         storage, synthetic
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+# the synthetic corpus ignores search terms, but not publication dates: 
+# articles are published in 1990 + k % 30 
+SEARCHES = {'nineties': [[b'author', b'shteyn'], [b'mindate', b'1990'], 
+                         [b'maxdate', b'1999']], 
+            'late nineties': [[b'author', b'rothman'], [b'mindate', b'1995'], 
+                              [b'maxdate', b'2004']], 
+            'all': [[b'title', b'autophagy']]}
+
+
+class QueryMembershipTest(unittest.TestCase): 
+    def test_round_trip(self): 
+        membership = batch.QueryMembership([('a', [5, 3, 9]), ('b', [9, 1]), 
+                                            ('c', [])])
+        self.assertEqual(membership.pmids.tolist(), [1, 3, 5, 9])
+        with tempfile.TemporaryDirectory() as folder: 
+            membership.save(folder)
+            loaded = batch.QueryMembership.load(folder)
+            self.assertEqual(list(loaded), ['a', 'b', 'c'])
+            self.assertEqual(loaded['a'].tolist(), [5, 3, 9])
+            self.assertEqual(loaded['b'].tolist(), [9, 1])
+            self.assertEqual(len(loaded['c']), 0)
+            
+            loaded.update({'b': [2], 'd': [7]})
+            loaded.save(folder)
+            loaded = batch.QueryMembership.load(folder)
+        self.assertEqual(list(loaded), ['a', 'b', 'c', 'd'])
+        self.assertEqual(loaded['b'].tolist(), [2])
+
+
+class BatchPipelineTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(1500)
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _request(self, stub, searches, n=1500, max_in_flight=4, retry=None, 
+                 **kwargs): 
+        pipe = batch.BatchPipeline(searches, max_in_flight=max_in_flight, 
+                                   retry=retry, 
+                                   limiter=limiter.TokenBucket(rate=100))
+        pipe.set_base_urls(stub.base_urls)
+        return pipe.request(n, self.folder.name, layout='columns', **kwargs)
+    
+    def _efetched(self, stub): 
+        uids = []
+        for t, path, params in stub.log: 
+            if path.endswith('efetch.fcgi'): 
+                uids.extend(int(uid) for uid in params['id'].split(','))
+        return uids
+    
+    def test_each_article_fetched_once(self): 
+        with EutilsSimulator(self.corpus) as stub: 
+            membership = self._request(stub, SEARCHES)
+            efetched = self._efetched(stub)
+        self.assertEqual(sorted(efetched), self.corpus.uids())
+        self.assertEqual(membership['all'].tolist(), self.corpus.uids())
+        self.assertEqual(membership['nineties'].tolist(), 
+                         self.corpus.search('1990', '1999'))
+        
+        saved = batch.QueryMembership.load(self.folder.name)
+        self.assertEqual(list(saved), list(SEARCHES))
+        self.assertEqual(saved['late nineties'].tolist(), 
+                         self.corpus.search('1995', '2004'))
+        # a search's articles can be read back from the saved summaries 
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            stored = set(reader.pmids.tolist())
+            self.assertEqual(len(stored), len(reader))
+        nineties = [uid for uid in saved['nineties'] if uid in stored]
+        self.assertGreater(len(nineties), 0)
+    
+    def test_unnamed_searches_and_n(self): 
+        searches = [SEARCHES['nineties'], SEARCHES['late nineties']]
+        with EutilsSimulator(self.corpus) as stub: 
+            membership = self._request(stub, searches, n=100)
+            efetched = self._efetched(stub)
+        self.assertEqual(list(membership), 
+                         ['shteyn[au] 1990:1999', 'rothman[au] 1995:2004'])
+        self.assertTrue(all(len(uids) == 100 for name, uids 
+                            in membership.items()))
+        overlap = set(membership['shteyn[au] 1990:1999']) \
+                  & set(membership['rothman[au] 1995:2004'])
+        self.assertEqual(len(efetched), 200 - len(overlap))
+        self.assertEqual(len(set(efetched)), len(efetched))
+    
+    def test_single_search_methods(self): 
+        pipe = batch.BatchPipeline(SEARCHES)
+        self.assertRaises(TypeError, pipe.search_window, 0, 100)
+        self.assertRaises(TypeError, pipe.iter_articles, 100)
+        articles = pipe.iter_articles_async(100)
+        self.assertRaises(TypeError, asyncio.run, articles.__anext__())
+    
+    def test_resume(self): 
+        # two esearches, then efetch batches of 500 of the 750 articles 
+        # published 1990-2004; the second efetch fails 
+        two = {'nineties': SEARCHES['nineties'], 
+               'late nineties': SEARCHES['late nineties']}
+        with EutilsSimulator(self.corpus, fail_on=[3]) as stub: 
+            self.assertRaises(ConnectionError, self._request, stub, two, 
+                              max_in_flight=1, 
+                              retry=limiter.RetryPolicy(max_retries=0))
+            first = self._efetched(stub)[:500]
+        # the harvest is resumed with a search more, which changes the 
+        # batches, but not which articles were already saved 
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(stub, SEARCHES)
+            second = self._efetched(stub)
+        self.assertEqual(len(second), 1000)
+        self.assertEqual(sorted(first + second), self.corpus.uids())
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            pmids = reader.pmids.tolist()
+        self.assertEqual(len(pmids), len(set(pmids)))
+    
+    def test_start_over(self): 
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(stub, SEARCHES)
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(stub, SEARCHES, resume=False)
+            efetched = self._efetched(stub)
+        self.assertEqual(sorted(efetched), self.corpus.uids())
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            pmids = reader.pmids.tolist()
+        self.assertEqual(len(pmids), len(set(pmids)))
+        self.assertGreater(len(pmids), 0)
+    
+    def test_incremental(self): 
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(stub, {'nineties': SEARCHES['nineties']}, 
+                          incremental=True)
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(stub, SEARCHES, incremental=True)
+            efetched = self._efetched(stub)
+        self.assertEqual(len(efetched), 1500 - 500)
+        self.assertEqual(list(batch.QueryMembership.load(self.folder.name)), 
+                         ['nineties', 'late nineties', 'all'])
+
+
+if __name__ == '__main__': 
+    unittest.main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from unittest import mock
+import tempfile
+import time
+import os
+
+from py3_modules.pubmed_scraping.pubmed_scraping import cache, query, \
+                                                         pipeline, limiter, \
+                                                         synthetic
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+class ResponseCacheTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def test_key(self): 
+        a = query.UIDQuery(api_key='a')
+        a.load(terms=[b'28852740', b'29350911'])
+        b = query.UIDQuery(api_key='b')
+        b.load(terms=[b'28852740', b'29350911'])
+        self.assertEqual(cache.ResponseCache.key(a), cache.ResponseCache.key(b))
+        b.ret_start = 1
+        self.assertNotEqual(cache.ResponseCache.key(a), 
+                            cache.ResponseCache.key(b))
+    
+    def test_get_put(self): 
+        c = cache.ResponseCache(self.folder.name)
+        self.assertIsNone(c.get('ab01'))
+        c.put('ab01', '<xml>ok</xml>')
+        self.assertEqual(c.get('ab01'), '<xml>ok</xml>')
+        self.assertEqual(c.stats()['hits'], 1)
+        self.assertEqual(c.stats()['misses'], 1)
+        # size is recovered when the cache is reopened 
+        self.assertEqual(cache.ResponseCache(self.folder.name).size, c.size)
+    
+    def test_evicted_while_read(self): 
+        c = cache.ResponseCache(self.folder.name)
+        c.put('ab01', '<xml>ok</xml>')
+        # another process removes the file between the read and the utime 
+        with mock.patch.object(cache.os, 'utime', 
+                               side_effect=FileNotFoundError): 
+            self.assertEqual(c.get('ab01'), '<xml>ok</xml>')
+        self.assertEqual(c.stats()['hits'], 1)
+    
+    def test_ttl(self): 
+        c = cache.ResponseCache(self.folder.name, ttl=0.05)
+        c.put('ab01', '<xml>ok</xml>')
+        self.assertIn('ab01', c)
+        time.sleep(0.1)
+        self.assertNotIn('ab01', c)
+        self.assertIsNone(c.get('ab01'))
+        self.assertEqual(c.size, 0)
+    
+    def test_lru_eviction(self): 
+        raw = os.urandom(1000).hex()
+        c = cache.ResponseCache(self.folder.name, max_bytes=3500)
+        c.put('aa01', raw)
+        c.put('aa02', raw)
+        c.put('aa03', raw)
+        time.sleep(0.01)
+        c.get('aa01')
+        c.put('aa04', raw)
+        self.assertIn('aa01', c)
+        self.assertNotIn('aa02', c)
+        self.assertIn('aa04', c)
+        self.assertLessEqual(c.size, 3500)
+        self.assertGreater(c.stats()['evictions'], 0)
+    
+    def test_pipeline(self): 
+        c = cache.ResponseCache(self.folder.name)
+        corpus = synthetic.SyntheticCorpus(1200)
+        with EutilsSimulator(corpus) as stub: 
+            for n_requests in (4, 4): 
+                pipe = pipeline.AsyncPipeline([[b'author', b'shteyn']], cache=c, 
+                                              limiter=limiter.TokenBucket(50))
+                pipe.set_base_urls(stub.base_urls)
+                pipe.request(1200)
+                # the second time around, everything comes from the cache 
+                self.assertEqual(len(stub.log), n_requests)
+        self.assertEqual(c.stats()['hits'], 4)
+        self.assertEqual(c.stats()['misses'], 4)
+    
+    def test_history_not_cached(self): 
+        c = cache.ResponseCache(self.folder.name)
+        corpus = synthetic.SyntheticCorpus(1200)
+        with EutilsSimulator(corpus) as stub: 
+            for web_env in ('STUB_0', 'STUB_1'): 
+                start = len(stub.log)
+                pipe = pipeline.Pipeline([[b'author', b'shteyn']], cache=c, 
+                                         limiter=limiter.TokenBucket(50))
+                pipe.set_base_urls(stub.base_urls)
+                pipe.request(1200, use_history=True)
+                # each run starts its own history server session, even 
+                # with a warm cache 
+                self.assertEqual(len(stub.log) - start, 4)
+                efetches = [params for t, path, params in stub.log[start:] 
+                            if path.endswith('efetch.fcgi')]
+                self.assertEqual(set(p['WebEnv'] for p in efetches), 
+                                 {web_env})
+        self.assertEqual(c.stats()['hits'], 0)
+        self.assertEqual(c.size, 0)
+
+if __name__ == '__main__': 
+    unittest.main()
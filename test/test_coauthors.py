@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import os
+from collections import Counter, deque
+import re
+
+from py3_modules.pubmed_scraping.pubmed_scraping import coauthors, stream, \
+                                                         synthetic, pipeline, \
+                                                         limiter, soups
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+# a LastName-only author and a collective author among the names
+AUTHORS = [b'<Author ValidYN="Y"><LastName>Smith</LastName>'
+           b'<ForeName>Jane</ForeName></Author>', 
+           b'<Author ValidYN="Y"><LastName>Doe</LastName></Author>', 
+           b'<Author ValidYN="Y"><LastName>Roe</LastName>'
+           b'<ForeName>Rick</ForeName></Author>', 
+           b'<Author ValidYN="Y"><CollectiveName>Consortium</CollectiveName>'
+           b'</Author>']
+
+
+def brute_force_graph(records, max_authors=100): 
+    """
+    Co-authorship weights as a dict of Counters, keyed by author_key. 
+    """
+    graph = {}
+    for record in records: 
+        keys = set(coauthors.author_key(l, f) for l, f in 
+                   zip(record.authors['lastname'], record.authors['forename']))
+        for key in keys: 
+            graph.setdefault(key, Counter())
+        if len(keys) > max_authors: 
+            continue
+        for a in keys: 
+            for b in keys: 
+                if a != b: 
+                    graph[a][b] += 1
+    return graph
+
+
+class CoauthorGraphTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        corpus = synthetic.SyntheticCorpus(1500)
+        self.records = list(stream.iter_summaries(corpus.efetch(
+                corpus.uids())))
+        self.batches = [self.records[i:i + 100] 
+                        for i in range(0, len(self.records), 100)]
+        self.graph = coauthors.CoauthorGraph(self.folder.name)
+        for batch in self.batches: 
+            self.graph.add(batch)
+        self.expected = brute_force_graph(self.records)
+
+    def tearDown(self): 
+        self.graph.close()
+        self.folder.cleanup()
+
+    def _key(self, graph, author): 
+        lastname, forename = graph.name(author).split(b', ')
+        return coauthors.author_key(lastname, forename)
+
+    def _check(self, graph): 
+        self.assertEqual(len(graph), len(self.expected))
+        degrees = graph.degrees()
+        for author in range(len(graph)): 
+            expected = self.expected[self._key(graph, author)]
+            neighbors, weights = graph.neighbors(author)
+            self.assertEqual({self._key(graph, n): w for n, w 
+                              in zip(neighbors, weights)}, dict(expected))
+            self.assertEqual(neighbors.tolist(), sorted(neighbors.tolist()))
+            self.assertEqual(graph.degree(author), len(expected))
+            self.assertEqual(degrees[author], len(expected))
+        self.assertEqual(graph.n_edges, 
+                         sum(len(c) for c in self.expected.values())//2)
+
+    def test_graph(self): 
+        self._check(self.graph)
+        self.assertGreater(len(self.graph._delta[1]), 0)
+        self.graph.compact()
+        self.assertEqual(len(self.graph._delta[1]), 0)
+        self._check(self.graph)
+
+    def test_find(self): 
+        author = self.graph.find(b'Shteyn', b'Vladimir')
+        self.assertEqual(self.graph.name(author), b'Shteyn, Vladimir')
+        self.assertEqual(self.graph.find(' shteyn', 'VLADIMIR '), author)
+        self.assertEqual(self.graph.find(b'Nobody'), -1)
+        with self.assertRaises(IndexError): 
+            self.graph.neighbors(len(self.graph))
+
+    def test_k_hop(self): 
+        start = self.graph.find(b'Shteyn', b'Vladimir')
+        key = self._key(self.graph, start)
+        hops = {key: 0}
+        queue = deque([key])
+        while queue: 
+            a = queue.popleft()
+            if hops[a] == 2: 
+                continue
+            for b in self.expected[a]: 
+                if b not in hops: 
+                    hops[b] = hops[a] + 1
+                    queue.append(b)
+        del hops[key]
+        ids, result = self.graph.k_hop(start, 2)
+        self.assertEqual({self._key(self.graph, a): h 
+                          for a, h in zip(ids, result)}, hops)
+        self.assertEqual(result.tolist(), sorted(result.tolist()))
+        self.assertEqual(len(self.graph.k_hop(start, 0)[0]), 0)
+
+    def test_reopen_and_duplicates(self): 
+        self.graph.close()
+        self.graph = coauthors.CoauthorGraph(self.folder.name)
+        self.assertEqual(self.graph.add(self.batches[0]), 0)
+        self._check(self.graph)
+        self.assertLessEqual(set(k for k in self.graph._file.keys() 
+                                 if k.startswith(('main_', 'delta_'))), 
+                             {'main_0', 'main_1', 'delta_0', 'delta_1'})
+
+    def test_file_size_bounded(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            graph = coauthors.CoauthorGraph(folder)
+            graph.add(self.records)
+            graph.compact()
+            graph.close()
+            size = os.path.getsize(os.path.join(folder, 
+                                                coauthors.GRAPH_FILENAME))
+#            HDF5 only reuses freed space while the file stays open
+            with tempfile.TemporaryDirectory() as other: 
+                for batch in self.batches: 
+                    graph = coauthors.CoauthorGraph(other)
+                    graph.add(batch)
+                    graph.compact()
+                    graph.close()
+                graph = coauthors.CoauthorGraph(other)
+                self._check(graph)
+                graph.close()
+                self.assertLess(os.path.getsize(os.path.join(
+                        other, coauthors.GRAPH_FILENAME)), 2*size)
+
+    def test_max_authors(self): 
+        with tempfile.TemporaryDirectory() as folder, \
+             coauthors.CoauthorGraph(folder, max_authors=3) as graph: 
+            graph.add(self.records)
+            expected = brute_force_graph(self.records, max_authors=3)
+            self.assertEqual(len(graph), len(expected))
+            self.assertEqual(graph.n_edges, 
+                             sum(len(c) for c in expected.values())//2)
+
+    def test_author_without_forename(self): 
+        corpus = synthetic.SyntheticCorpus(1)
+        raw = re.sub(rb'<AuthorList.*</AuthorList>', 
+                     b'<AuthorList CompleteYN="Y">' + b''.join(AUTHORS) 
+                     + b'</AuthorList>', corpus.efetch(corpus.uids()), 
+                     flags=re.S)
+        for records in (list(stream.iter_summaries(raw)), 
+                        list(soups.SummarySoup(
+                                raw.decode('utf-8')).records())): 
+            self.assertEqual(records[0].authors['lastname'], 
+                             [b'Smith', b'Doe', b'Roe', b''])
+            self.assertEqual(records[0].authors['forename'], 
+                             [b'Jane', b'', b'Rick', b''])
+            with tempfile.TemporaryDirectory() as folder, \
+                 coauthors.CoauthorGraph(folder) as graph: 
+                graph.add(records)
+                names = sorted(graph.name(a) for a in range(len(graph)))
+                self.assertEqual(names, [b'Doe', b'Roe, Rick', b'Smith, Jane'])
+                roe = graph.find(b'Roe', b'Rick')
+                self.assertEqual(graph.degree(roe), 2)
+                self.assertEqual(graph.n_edges, 3)
+
+
+class PipelineGraphTest(unittest.TestCase): 
+    def test_graph_built_as_batches_are_saved(self): 
+        corpus = synthetic.SyntheticCorpus(1200)
+        with EutilsSimulator(corpus) as stub, \
+             tempfile.TemporaryDirectory() as folder: 
+            with coauthors.CoauthorGraph(folder) as graph: 
+                pipe = pipeline.AsyncPipeline(
+                        [[b'author', b'shteyn']], indexes=[graph], 
+                        limiter=limiter.TokenBucket(rate=1000))
+                pipe.set_base_urls(stub.base_urls)
+                pipe.request(1200, save_folder=folder, layout='columns')
+                records = list(stream.iter_summaries(corpus.efetch(
+                        corpus.uids())))
+                self.assertEqual(graph.n_edges, sum(
+                        len(c) for c in brute_force_graph(records).values())//2)
+            self.assertTrue(os.path.exists(os.path.join(
+                    folder, coauthors.GRAPH_FILENAME)))
+
+
+if __name__ == '__main__': 
+    unittest.main()
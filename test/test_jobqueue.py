@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+from unittest import mock
+import tempfile
+import multiprocessing
+import time
+import os
+
+from py3_modules.pubmed_scraping.pubmed_scraping import jobqueue, limiter, \
+                                                         storage, stream, \
+                                                         synthetic
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+TERMS = [[b'author', b'shteyn']]
+
+
+def _acquire(path, n): 
+    bucket = limiter.SharedTokenBucket(path, rate=1)
+    for _ in range(n): 
+        bucket.acquire()
+
+
+class SharedTokenBucketTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'limiter.sqlite')
+
+    def tearDown(self): 
+        self.folder.cleanup()
+
+    def test_processes_share_the_rate(self): 
+#        made first, so the other processes use its rate
+        limiter.SharedTokenBucket(self.path, rate=40)
+        processes = [multiprocessing.Process(target=_acquire, 
+                                             args=(self.path, 10)) 
+                     for _ in range(4)]
+        start = time.time()
+        for process in processes: 
+            process.start()
+        for process in processes: 
+            process.join()
+#        40 tokens, the first of which was there already
+        self.assertGreaterEqual(time.time() - start, 39/40)
+
+    def test_throttled_is_shared(self): 
+        a = limiter.SharedTokenBucket(self.path, rate=10)
+        b = limiter.SharedTokenBucket(self.path, rate=10)
+        a.throttled()
+        b.acquire()
+        self.assertAlmostEqual(b.rate, 5)
+        other = limiter.SharedTokenBucket(self.path, name='other', rate=10)
+        other.acquire()
+        self.assertEqual(other.rate, 10)
+
+    def test_pause(self): 
+        a = limiter.SharedTokenBucket(self.path, rate=100)
+        limiter.SharedTokenBucket(self.path).pause(0.3)
+        self.assertGreater(a.acquire(), 0.25)
+
+
+class JobQueueTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.queue = jobqueue.JobQueue(self.folder.name, lease=60)
+
+    def tearDown(self): 
+        self.folder.cleanup()
+
+    def test_add_is_idempotent(self): 
+        self.assertEqual(self.queue.add(TERMS, 2500, window=1000), 3)
+        self.assertEqual(self.queue.add(TERMS, 2500, window=1000), 0)
+        self.assertEqual(self.queue.counts()['pending'], 3)
+        job = self.queue.claim('a')
+        self.assertEqual((job.terms, job.ret_start, job.ret_max), 
+                         ([['author', 'shteyn']], 0, 1000))
+
+    def test_claimed_once(self): 
+        self.queue.add(TERMS, 2000, window=1000)
+        a, b = self.queue.claim('a'), self.queue.claim('b')
+        self.assertNotEqual(a.id, b.id)
+        self.assertIsNone(self.queue.claim('c'))
+        self.assertTrue(self.queue.complete(a, 'a'))
+        self.assertFalse(self.queue.complete(b, 'a'))
+        self.assertEqual(self.queue.counts()['running'], 1)
+
+    def test_expired_lease(self): 
+        self.queue.add(TERMS, 1000)
+        self.queue.lease = 0.05
+        job = self.queue.claim('a')
+        time.sleep(0.1)
+        again = self.queue.claim('b')
+        self.assertEqual(again.id, job.id)
+        self.assertEqual(again.attempts, 2)
+        self.assertFalse(self.queue.renew(job, 'a'))
+        with self.queue.saving(job, 'a', 0) as ok: 
+            self.assertFalse(ok)
+        with self.queue.saving(again, 'b', 0) as ok: 
+            self.assertTrue(ok)
+        with self.queue.saving(again, 'b', 0) as ok: 
+            self.assertFalse(ok)
+        self.assertEqual(self.queue.saved(again), {0})
+
+    def test_saving_rolls_back(self): 
+        self.queue.add(TERMS, 1000)
+        job = self.queue.claim('a')
+        with self.assertRaises(IOError): 
+            with self.queue.saving(job, 'a', 0) as ok: 
+                raise IOError('disk full')
+        self.assertEqual(self.queue.saved(job), set())
+
+    def test_fail(self): 
+        self.queue.max_attempts = 2
+        self.queue.add(TERMS, 1000)
+        for state in ('pending', 'failed'): 
+            job = self.queue.claim('a')
+            self.queue.fail(job, 'a', 'boom')
+            self.assertEqual(self.queue.counts()[state], 1)
+        self.assertEqual(self.queue.errors(), {job.id: 'boom'})
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual(self.queue.claim('a').attempts, 1)
+
+
+class WorkerTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(1800)
+        self.folder = tempfile.TemporaryDirectory()
+        self.queue = jobqueue.JobQueue(self.folder.name)
+        self.queue.add(TERMS, 1800, window=300)
+
+    def tearDown(self): 
+        self.folder.cleanup()
+
+    def _expected(self): 
+        return sorted(int(r.uid) for r in stream.iter_summaries(
+                self.corpus.efetch(self.corpus.uids())))
+
+    def _saved(self): 
+        return sorted(storage.known_pmids(self.folder.name).tolist())
+
+    def test_workers_share_rate_and_save_once(self): 
+        rate = 5
+        with EutilsSimulator(self.corpus) as stub: 
+            limiter.SharedTokenBucket(
+                    os.path.join(self.folder.name, 'limiter.sqlite'), 
+                    str(None), rate=rate)
+            counts = jobqueue.run_workers(
+                    self.queue, self.folder.name, n_workers=3, 
+                    base_urls=stub.base_urls)
+            times = sorted(t for t, path, params in stub.log)
+        self.assertEqual(counts['done'], 6)
+        self.assertEqual(self._saved(), self._expected())
+#        12 requests: an esearch and an efetch per job
+        self.assertEqual(len(times), 12)
+        for i in range(len(times) - rate): 
+            self.assertGreaterEqual(times[i + rate] - times[i], 0.95)
+        self.assertGreaterEqual(times[-1] - times[0], 
+                                (len(times) - 1)/rate - 0.05)
+
+    def test_worker_reuses_connections(self): 
+        with EutilsSimulator(self.corpus) as stub: 
+            worker = jobqueue.Worker(
+                    self.queue, self.folder.name, 
+                    limiter=limiter.TokenBucket(rate=1000), 
+                    base_urls=stub.base_urls)
+            self.assertEqual(worker.run(), 6)
+            n_requests = len(stub.log)
+        self.assertEqual(n_requests, 12)
+        self.assertEqual(stub.n_connections, 1)
+        self.assertEqual(self._saved(), self._expected())
+
+    def _overlapping(self, layout): 
+        # the synthetic corpus ignores search terms, so this search's 
+        # results are the first 1200 of the other one's; its job has three 
+        # efetch batches 
+        self.queue.add([[b'author', b'rothman']], 1200, window=1200)
+        opened = []
+        def open_writer(*args): 
+            opened.append(args)
+            return storage.open_writer(*args)
+        read = []
+        def known_pmids(*args): 
+            read.append(args)
+            return storage.known_pmids(*args)
+        with EutilsSimulator(self.corpus) as stub, \
+             mock.patch.object(jobqueue, 'open_writer', open_writer), \
+             mock.patch.object(jobqueue, 'known_pmids', known_pmids): 
+            worker = jobqueue.Worker(
+                    self.queue, self.folder.name, layout=layout, 
+                    limiter=limiter.TokenBucket(rate=1000), 
+                    base_urls=stub.base_urls)
+            self.assertEqual(worker.run(), 7)
+        self.assertEqual(self.queue.counts()['done'], 7)
+        # one writer per job, not per batch 
+        self.assertEqual(len(opened), 7)
+        # the save folder is read once, not for every batch 
+        self.assertEqual(len(read), 1)
+
+    def test_overlapping_searches_groups(self): 
+        self._overlapping('groups')
+        self.assertEqual(self._saved(), self._expected())
+
+    def test_overlapping_searches_columns(self): 
+        self._overlapping('columns')
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            pmids = sorted(reader.pmids.tolist())
+        self.assertEqual(pmids, self._expected())
+
+    def test_failed_job_is_retried(self): 
+        with EutilsSimulator(self.corpus, fail_on={2: 500}) as stub: 
+            worker = jobqueue.Worker(
+                    self.queue, self.folder.name, 
+                    limiter=limiter.TokenBucket(rate=1000), 
+                    retry=limiter.RetryPolicy(max_retries=0), 
+                    base_urls=stub.base_urls)
+            self.assertEqual(worker.run(), 6)
+        self.assertEqual(self.queue.counts()['done'], 6)
+        self.assertEqual(len(self.queue.errors()), 1)
+        self.assertEqual(self._saved(), self._expected())
+
+
+if __name__ == '__main__': 
+    unittest.main()
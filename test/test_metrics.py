@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import json
+import os
+
+from py3_modules.pubmed_scraping.pubmed_scraping import metrics, pipeline, \
+                                                         parallel, limiter, \
+                                                         synthetic, storage
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+class HistogramTest(unittest.TestCase): 
+    def test_quantiles(self): 
+        h = metrics.Histogram()
+        self.assertIsNone(h.quantile(0.5))
+        for v in range(1, 1001): 
+            h.add(v/1000.)
+        d = h.as_dict()
+        self.assertEqual(d['count'], 1000)
+        self.assertAlmostEqual(d['mean'], 0.5005)
+        self.assertEqual((d['min'], d['max']), (0.001, 1.))
+        # within one bucket, i.e. 19% 
+        self.assertAlmostEqual(d['p50'], 0.5, delta=0.1)
+        self.assertAlmostEqual(d['p90'], 0.9, delta=0.1)
+        self.assertLessEqual(d['p99'], 1.)
+    
+    def test_zero(self): 
+        h = metrics.Histogram()
+        h.add(0.)
+        h.add(0.)
+        h.add(2.)
+        self.assertEqual(h.quantile(0.5), 0.)
+        self.assertEqual(h.quantile(1.), 2.)
+
+
+class MetricsTest(unittest.TestCase): 
+    def test_counters_and_callbacks(self): 
+        seen = []
+        m = metrics.Metrics(callbacks=[lambda name, value: seen.append(name)])
+        m.incr('requests')
+        m.incr('request_bytes', 100)
+        m.incr('request_bytes', 50)
+        with m.timer('write_seconds'): 
+            pass
+        snapshot = m.snapshot()
+        self.assertEqual(snapshot['counters'], 
+                         {'requests': 1, 'request_bytes': 150})
+        self.assertEqual(snapshot['histograms']['write_seconds']['count'], 1)
+        self.assertEqual(seen, ['requests', 'request_bytes', 'request_bytes', 
+                                'write_seconds'])
+    
+    def test_run_lines(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            path = os.path.join(folder, 'metrics.jsonl')
+            m = metrics.Metrics(path)
+            with m.run(name='first'): 
+                m.incr('requests', 3)
+            try: 
+                with m.run(name='second'): 
+                    m.incr('requests')
+                    raise KeyError()
+            except KeyError: 
+                pass
+            with open(path) as f: 
+                lines = [json.loads(line) for line in f]
+        self.assertEqual([(l['name'], l['status'], l['counters']['requests']) 
+                          for l in lines], 
+                         [('first', 'ok', 3), ('second', 'error', 1)])
+
+
+class PipelineMetricsTest(unittest.TestCase): 
+    def _request(self, Pipeline, folder, **kwargs): 
+        with EutilsSimulator(synthetic.SyntheticCorpus(1500)) as stub: 
+            pipe = Pipeline([[b'author', b'shteyn']], 
+                            limiter=limiter.TokenBucket(rate=100), 
+                            metrics=metrics.Metrics(os.path.join(
+                                    folder, 'metrics.jsonl')), **kwargs)
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(1500, folder, layout='columns')
+        with open(os.path.join(folder, 'metrics.jsonl')) as f: 
+            line = json.loads(f.readline())
+        with storage.ColumnarReader(os.path.join(
+                folder, storage.COLUMNS_FILENAME)) as reader: 
+            n_stored = len(reader)
+        return line, n_stored
+    
+    def _check(self, line, n_stored, n_parsed): 
+        counters, histograms = line['counters'], line['histograms']
+        self.assertEqual(line['status'], 'ok')
+        self.assertEqual(line['n'], 1500)
+        self.assertEqual(counters['requests'], 4)
+        self.assertGreater(counters['request_bytes'], 0)
+        self.assertEqual(counters['articles'], n_stored)
+        self.assertEqual(counters['articles_written'], n_stored)
+        self.assertEqual(histograms['request_seconds']['count'], 4)
+        self.assertEqual(histograms['limiter_wait_seconds']['count'], 4)
+        self.assertEqual(histograms['parse_seconds']['count'], n_parsed)
+        self.assertEqual(histograms['parse_seconds_per_article']['count'], 3)
+        self.assertEqual(histograms['write_seconds']['count'], 3)
+    
+    def test_pipeline(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            line, n_stored = self._request(pipeline.Pipeline, folder)
+        self.assertEqual(line['pipeline'], 'Pipeline')
+        # the esearch response is parsed too 
+        self._check(line, n_stored, 4)
+    
+    def test_parallel_pipeline(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            line, n_stored = self._request(parallel.ParallelPipeline, folder, 
+                                           n_workers=1)
+        # the esearch is sent and parsed the same way as by Pipeline 
+        self._check(line, n_stored, 4)
+
+
+if __name__ == '__main__': 
+    unittest.main()
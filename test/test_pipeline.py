@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from unittest import mock
+import tempfile
+import datetime
+import email.utils
+import asyncio
+import time
+import os
+import requests
+import numpy as np
+import h5py
+
+from requests.exceptions import ConnectionError
+
+from py3_modules.pubmed_scraping.pubmed_scraping import pipeline, synthetic, \
+                                                         limiter, storage, \
+                                                         parallel, stream, \
+                                                         checkpoint
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+def h5_contents(path): 
+    contents = {}
+    def visit(name, obj): 
+        if isinstance(obj, h5py.Dataset): 
+            contents[name] = obj[()]
+    with h5py.File(path, 'r') as f: 
+        f.visititems(visit)
+    return contents
+
+
+class AsyncPipelineTest(unittest.TestCase): 
+    def setUp(self): 
+        self.terms = [[b'author', b'shteyn'], [b'mindate', b'2016']]
+        self.corpus = synthetic.SyntheticCorpus(600)
+
+    def _pipeline(self, Pipeline, stub, **kwargs): 
+        pipe = Pipeline(self.terms, **kwargs)
+        pipe.set_base_urls(stub.base_urls)
+        return pipe
+
+    def test_same_output_as_pipeline(self): 
+        with EutilsSimulator(self.corpus) as stub, \
+             tempfile.TemporaryDirectory() as sync_folder, \
+             tempfile.TemporaryDirectory() as async_folder:
+            self._pipeline(pipeline.Pipeline, stub).request(600, sync_folder)
+            fast = limiter.TokenBucket(rate=50)
+            self._pipeline(pipeline.AsyncPipeline, stub, limiter=fast)\
+                .request(600, async_folder)
+
+            expected = h5_contents(os.path.join(sync_folder, 'pubmed_summary.h5'))
+            result = h5_contents(os.path.join(async_folder, 'pubmed_summary.h5'))
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(sorted(expected.keys()), sorted(result.keys()))
+        for k, v in expected.items(): 
+            self.assertEqual(np.asarray(v).tolist(),
+                             np.asarray(result[k]).tolist())
+
+    def test_batches_in_flight(self): 
+        corpus = synthetic.SyntheticCorpus(2000)
+        with EutilsSimulator(corpus, latency=0.3) as stub: 
+            pipe = self._pipeline(pipeline.AsyncPipeline, stub, max_in_flight=3,
+                                  limiter=limiter.TokenBucket(rate=100))
+            pipe.request(2000)
+            n_requests = len(stub.log)
+            max_in_flight = stub.max_in_flight
+        # esearch plus 4 efetch batches, at most 3 of them at once
+        self.assertEqual(n_requests, 5)
+        self.assertEqual(max_in_flight, 3)
+
+    def test_rate_limit(self): 
+        with EutilsSimulator(synthetic.SyntheticCorpus(1500)) as stub: 
+            pipe = self._pipeline(pipeline.AsyncPipeline, stub, max_in_flight=4)
+            pipe.request(1500)
+            times = [t for t, path, params in stub.log]
+        # esearch plus 3 efetch requests at 3 requests per second
+        self.assertEqual(len(times), 4)
+        self.assertGreaterEqual(times[-1] - times[0], 3 / limiter.NCBI_RATE - 0.05)
+
+
+class ParallelPipelineTest(unittest.TestCase): 
+    def setUp(self): 
+        self.terms = [[b'author', b'shteyn']]
+        self.fast = limiter.TokenBucket(rate=100)
+
+    def _request(self, Pipeline, stub, folder, n, **kwargs): 
+        pipe = Pipeline(self.terms, limiter=self.fast, **kwargs)
+        pipe.set_base_urls(stub.base_urls)
+        pipe.request(n, folder)
+        return h5_contents(os.path.join(folder, storage.GROUPS_FILENAME))
+
+    def test_same_output_as_async_pipeline(self): 
+        with EutilsSimulator(synthetic.SyntheticCorpus(1200)) as stub, \
+             tempfile.TemporaryDirectory() as async_folder, \
+             tempfile.TemporaryDirectory() as parallel_folder: 
+            expected = self._request(pipeline.AsyncPipeline, stub, 
+                                     async_folder, 1200)
+            # queues of one batch each, so every stage waits on the next 
+            result = self._request(parallel.ParallelPipeline, stub, 
+                                   parallel_folder, 1200, n_workers=2, 
+                                   raw_depth=1, parsed_depth=1)
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(sorted(expected.keys()), sorted(result.keys()))
+        for k, v in expected.items(): 
+            self.assertEqual(np.asarray(v).tolist(),
+                             np.asarray(result[k]).tolist())
+
+    def test_writer_error_stops_fetcher(self): 
+        def fail(*args): 
+            raise ValueError('disk full')
+        with EutilsSimulator(synthetic.SyntheticCorpus(5000)) as stub, \
+             tempfile.TemporaryDirectory() as folder, \
+             mock.patch.object(parallel.ParallelPipeline, 'save_batch', fail): 
+            self.assertRaises(ValueError, self._request, 
+                              parallel.ParallelPipeline, stub, folder, 5000, 
+                              raw_depth=1, parsed_depth=1)
+            n_efetch = len([path for t, path, params in stub.log 
+                            if path.endswith('efetch.fcgi')])
+        # the harvest stops after the batches that were queued or being 
+        # handled, instead of all 10 
+        self.assertLessEqual(n_efetch, 6)
+
+
+class HistoryTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(1200)
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _request(self, Pipeline, subfolder, n, **kwargs): 
+        folder = os.path.join(self.folder.name, subfolder)
+        os.mkdir(folder)
+        with EutilsSimulator(self.corpus) as stub: 
+            pipe = Pipeline([[b'author', b'shteyn']], **kwargs)
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(n, folder, layout='columns', 
+                         use_history=subfolder != 'ids')
+            log = [(path, params) for t, path, params in stub.log]
+        with storage.ColumnarReader(os.path.join(
+                folder, storage.COLUMNS_FILENAME)) as reader: 
+            records = [reader.row(i) for i in range(len(reader))]
+        return log, records
+    
+    def test_history(self): 
+        fast = limiter.TokenBucket(rate=50)
+        _, expected = self._request(pipeline.AsyncPipeline, 'ids', 1200, 
+                                    limiter=fast)
+        for Pipeline, kwargs in ((pipeline.Pipeline, {}), 
+                                 (pipeline.AsyncPipeline, {'limiter': fast}), 
+                                 (parallel.ParallelPipeline, {'limiter': fast})): 
+            log, records = self._request(Pipeline, Pipeline.__name__, 5000, 
+                                         **kwargs)
+            self.assertEqual(records, expected)
+            (path, esearch), efetches = log[0], [p for _, p in log[1:]]
+            self.assertEqual(esearch['usehistory'], 'y')
+            self.assertEqual(esearch['retmax'], '0')
+            self.assertEqual([p['retstart'] for p in efetches], 
+                             ['0', '500', '1000'])
+            self.assertEqual([p['retmax'] for p in efetches], 
+                             ['500', '500', '200'])
+            for params in efetches: 
+                self.assertNotIn('id', params)
+                self.assertEqual(params['query_key'], '1')
+
+
+class ResumeTest(unittest.TestCase): 
+    def setUp(self): 
+        self.terms = [[b'author', b'shteyn']]
+        self.corpus = synthetic.SyntheticCorpus(1500)
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _request(self, Pipeline, stub, layout='columns', **kwargs): 
+        pipe = Pipeline(self.terms, **kwargs)
+        pipe.set_base_urls(stub.base_urls)
+        pipe.request(1500, self.folder.name, layout=layout)
+    
+    def _check(self, Pipeline, **kwargs): 
+        # esearch, then efetch batches at retstart 0, 500 and 1000; the 
+        # second efetch fails 
+        with EutilsSimulator(self.corpus, fail_on=[2]) as stub: 
+            self.assertRaises(ConnectionError, self._request, Pipeline, stub, 
+                              retry=limiter.RetryPolicy(max_retries=0), 
+                              **kwargs)
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(Pipeline, stub, **kwargs)
+            retstarts = [params['retstart'] for t, path, params in stub.log 
+                         if path.endswith('efetch.fcgi')]
+        self.assertEqual(retstarts, ['500', '1000'])
+        
+        # the run was completed, so the next one starts over, but doesn't 
+        # store anything twice 
+        self.assertFalse(os.path.exists(
+                os.path.join(self.folder.name, checkpoint.CHECKPOINT_FILENAME)))
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(Pipeline, stub, **kwargs)
+            self.assertEqual(len(stub.log), 4)
+        
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            pmids = list(reader.pmids)
+        self.assertEqual(len(pmids), len(set(pmids)))
+        self.assertEqual(pmids[-1], self.corpus.uids()[-1])
+    
+    def test_resume(self): 
+        self._check(pipeline.Pipeline)
+    
+    def test_resume_async(self): 
+        self._check(pipeline.AsyncPipeline, max_in_flight=1, 
+                    limiter=limiter.TokenBucket(rate=50))
+    
+    def test_resume_parallel(self): 
+        self._check(parallel.ParallelPipeline, n_workers=1, 
+                    limiter=limiter.TokenBucket(rate=50))
+    
+    def test_stopped_before_mark(self): 
+        # the first batch is written, but the run stops before its window 
+        # is marked in the checkpoint 
+        def stop(*args): 
+            raise RuntimeError('stopped')
+        with EutilsSimulator(self.corpus) as stub, \
+             mock.patch.object(pipeline.Checkpoint, 'mark', stop): 
+            self.assertRaises(RuntimeError, self._request, pipeline.Pipeline, 
+                              stub, layout='groups')
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(pipeline.Pipeline, stub, layout='groups')
+            retstarts = [params['retstart'] for t, path, params in stub.log 
+                         if path.endswith('efetch.fcgi')]
+        self.assertEqual(retstarts, ['0', '500', '1000'])
+        
+        path = os.path.join(self.folder.name, storage.GROUPS_FILENAME)
+        with h5py.File(path, 'r') as f: 
+            pmids = sorted(int(name) for name in f.keys())
+        expected = stream.iter_summaries(self.corpus.efetch(self.corpus.uids()))
+        self.assertEqual(pmids, sorted(int(r.uid) for r in expected))
+    
+    def test_start_over(self): 
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(pipeline.AsyncPipeline, stub, 
+                          limiter=limiter.TokenBucket(rate=50))
+        with EutilsSimulator(self.corpus) as stub: 
+            pipe = pipeline.AsyncPipeline(self.terms, 
+                                          limiter=limiter.TokenBucket(rate=50))
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(1500, self.folder.name, layout='columns', resume=False)
+            self.assertEqual(len(stub.log), 4)
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            self.assertEqual(len(reader.pmids), len(set(reader.pmids)))
+    
+    def test_new_results(self): 
+        # the same search, once NCBI has 700 more results for it 
+        with EutilsSimulator(synthetic.SyntheticCorpus(800)) as stub: 
+            self._request(pipeline.Pipeline, stub)
+        with EutilsSimulator(self.corpus) as stub: 
+            self._request(pipeline.Pipeline, stub)
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            pmids = reader.pmids.tolist()
+        expected = stream.iter_summaries(self.corpus.efetch(self.corpus.uids()))
+        self.assertEqual(sorted(pmids), sorted(int(r.uid) for r in expected))
+
+
+class IncrementalTest(unittest.TestCase): 
+    def setUp(self): 
+        self.terms = [[b'author', b'shteyn']]
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _request(self, Pipeline, corpus, layout, **kwargs): 
+        with EutilsSimulator(corpus) as stub: 
+            pipe = Pipeline(self.terms, **kwargs)
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(len(corpus), self.folder.name, layout=layout, 
+                         incremental=True)
+            return [params for t, path, params in stub.log 
+                    if path.endswith('efetch.fcgi')]
+    
+    def _check(self, Pipeline, layout, **kwargs): 
+        # the same articles, plus 700 published since; their references 
+        # carry PMIDs too, which mustn't be taken for the articles' own 
+        old = synthetic.SyntheticCorpus(800, references=3)
+        new = synthetic.SyntheticCorpus(1500, references=3)
+        self._request(Pipeline, old, layout, **kwargs)
+        efetches = self._request(Pipeline, new, layout, **kwargs)
+        requested = []
+        for params in efetches: 
+            start = int(params['retstart'])
+            requested.extend(params['id'].split(',')[
+                    start:start + int(params['retmax'])])
+        self.assertEqual(sorted(int(uid) for uid in requested), 
+                         new.uids(800))
+        # articles that were fetched but not stored aren't fetched again 
+        self.assertEqual(self._request(Pipeline, new, layout, **kwargs), [])
+        
+        stored = storage.known_pmids(self.folder.name)
+        self.assertEqual(len(stored), len(new))
+        if layout == 'groups': 
+            path = os.path.join(self.folder.name, storage.GROUPS_FILENAME)
+            with h5py.File(path, 'r') as f: 
+                pmids = [int(name) for name in f.keys()]
+        else: 
+            path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+            with storage.ColumnarReader(path) as reader: 
+                pmids = reader.pmids.tolist()
+        self.assertEqual(len(pmids), len(set(pmids)))
+        self.assertEqual(max(pmids), new.uids()[-1])
+    
+    def test_pipeline(self): 
+        self._check(pipeline.Pipeline, 'groups')
+    
+    def test_async_pipeline(self): 
+        self._check(pipeline.AsyncPipeline, 'columns', 
+                    limiter=limiter.TokenBucket(rate=50))
+    
+    def test_parallel_pipeline(self): 
+        self._check(parallel.ParallelPipeline, 'groups', n_workers=1, 
+                    limiter=limiter.TokenBucket(rate=50))
+    
+    def test_not_with_history(self): 
+        pipe = pipeline.Pipeline(self.terms)
+        self.assertRaises(ValueError, pipe.request, 10, self.folder.name, 
+                          use_history=True, incremental=True)
+
+
+class IterArticlesTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(1500)
+        self.expected = list(stream.iter_summaries(self.corpus.efetch(
+                self.corpus.uids(0, 1200))))
+    
+    def _pipeline(self, Pipeline, stub, **kwargs): 
+        pipe = Pipeline([[b'author', b'shteyn']], 
+                        limiter=limiter.TokenBucket(rate=100), **kwargs)
+        pipe.set_base_urls(stub.base_urls)
+        return pipe
+    
+    def _efetches(self, stub): 
+        return len([path for t, path, params in stub.log 
+                    if path.endswith('efetch.fcgi')])
+    
+    def test_iter_articles(self): 
+        for use_history in (False, True): 
+            with EutilsSimulator(self.corpus) as stub: 
+                pipe = self._pipeline(pipeline.Pipeline, stub)
+                articles = pipe.iter_articles(1200, use_history=use_history)
+                first = next(articles)
+                # nothing is requested ahead of the consumer 
+                self.assertEqual(self._efetches(stub), 1)
+                self.assertEqual([first] + list(articles), self.expected)
+                self.assertEqual(self._efetches(stub), 3)
+    
+    def test_iter_articles_async(self): 
+        async def consume(pipe, stub): 
+            records = []
+            async for record in pipe.iter_articles_async(1200): 
+                if not records: 
+                    in_flight = self._efetches(stub)
+                records.append(record)
+            return records, in_flight
+        
+        with EutilsSimulator(self.corpus) as stub: 
+            pipe = self._pipeline(pipeline.AsyncPipeline, stub, 
+                                  max_in_flight=2)
+            records, in_flight = asyncio.run(consume(pipe, stub))
+        self.assertEqual(records, self.expected)
+        self.assertLessEqual(in_flight, 2)
+    
+    def test_stop_early(self): 
+        async def first(pipe): 
+            articles = pipe.iter_articles_async(1500)
+            async for record in articles: 
+                await articles.aclose()
+                return record
+        
+        with EutilsSimulator(self.corpus, latency=0.05) as stub: 
+            pipe = self._pipeline(pipeline.AsyncPipeline, stub, 
+                                  max_in_flight=1)
+            self.assertEqual(asyncio.run(first(pipe)), self.expected[0])
+            self.assertEqual(self._efetches(stub), 1)
+
+
+class SessionTest(unittest.TestCase): 
+    def test_connections_reused(self): 
+        with EutilsSimulator(synthetic.SyntheticCorpus(1500)) as stub: 
+            pipe = pipeline.Pipeline([[b'author', b'shteyn']])
+            pipe.set_base_urls(stub.base_urls)
+            pipe.request(1500)
+            n_requests = len(stub.log)
+            n_connections = stub.n_connections
+        self.assertEqual(n_requests, 4)
+        self.assertEqual(n_connections, 1)
+
+
+class TokenBucketTest(unittest.TestCase): 
+    def test_rate_by_api_key(self): 
+        self.assertEqual(limiter.TokenBucket.for_api_key().rate,
+                         limiter.NCBI_RATE)
+        self.assertEqual(limiter.TokenBucket.for_api_key('key').rate,
+                         limiter.NCBI_RATE_API_KEY)
+
+    def test_spacing(self): 
+        bucket = limiter.TokenBucket(rate=20)
+        start = time.monotonic()
+        for _ in range(5): 
+            bucket.acquire()
+        # first token is free, the next four are 50 ms apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_throttled(self): 
+        bucket = limiter.TokenBucket(rate=10)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        # more 429s from requests that were already in flight 
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        # about a second's worth of requests regains rate/10 
+        for _ in range(5): 
+            bucket.succeeded()
+        self.assertAlmostEqual(bucket.rate, 6, delta=0.1)
+        for _ in range(50): 
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10)
+
+    def test_pause(self): 
+        bucket = limiter.TokenBucket(rate=100)
+        bucket.pause(0.3)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.29)
+
+    def test_shared_bucket(self): 
+        self.assertIs(limiter.shared_bucket('key'), limiter.shared_bucket('key'))
+        self.assertIsNot(limiter.shared_bucket(), limiter.shared_bucket('key'))
+
+
+class RetryTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(1500)
+        self.folder = tempfile.TemporaryDirectory()
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _request(self, stub, bucket=None, **kwargs): 
+        if bucket is None: 
+            bucket = limiter.TokenBucket(rate=100)
+        pipe = pipeline.Pipeline([[b'author', b'shteyn']], limiter=bucket, 
+                                 retry=limiter.RetryPolicy(backoff=0.01, 
+                                                           **kwargs))
+        pipe.set_base_urls(stub.base_urls)
+        pipe.request(1500, self.folder.name, layout='columns')
+    
+    def test_transient_errors(self): 
+        with EutilsSimulator(self.corpus, fail_on={0: 500, 2: 503, 3: 502}) as stub: 
+            self._request(stub)
+            self.assertEqual(len(stub.log), 7)
+        path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        with storage.ColumnarReader(path) as reader: 
+            self.assertEqual(reader.pmids[-1], self.corpus.uids()[-1])
+    
+    def test_retry_after(self): 
+        bucket = limiter.TokenBucket(rate=100)
+        with EutilsSimulator(self.corpus, fail_on={1: 429}, retry_after=1) as stub: 
+            self._request(stub, bucket)
+            times = [t for t, path, params in stub.log]
+        self.assertGreaterEqual(times[2] - times[1], 0.95)
+        self.assertLess(bucket.rate, 100)
+    
+    def test_client_error_not_retried(self): 
+        with EutilsSimulator(self.corpus, fail_on={1: 400}) as stub: 
+            self.assertRaises(ConnectionError, self._request, stub)
+            self.assertEqual(len(stub.log), 2)
+    
+    def test_gives_up(self): 
+        with EutilsSimulator(self.corpus, fail_on=[1, 2, 3]) as stub: 
+            self.assertRaises(ConnectionError, self._request, stub, 
+                              max_retries=2)
+            self.assertEqual(len(stub.log), 4)
+    
+    def test_parse_retry_after(self): 
+        response = requests.models.Response()
+        self.assertIsNone(limiter.RetryPolicy.retry_after(response))
+        response.headers['Retry-After'] = '120'
+        self.assertEqual(limiter.RetryPolicy.retry_after(response), 120)
+        date = datetime.datetime.now(datetime.timezone.utc) \
+               + datetime.timedelta(seconds=30)
+        response.headers['Retry-After'] = email.utils.format_datetime(date)
+        self.assertAlmostEqual(limiter.RetryPolicy.retry_after(response), 30, 
+                               delta=2)
+    
+    def test_delay(self): 
+        retry = limiter.RetryPolicy(backoff=1., max_backoff=5., seed=0)
+        delays = [retry.delay(attempt) for attempt in range(10) 
+                  for _ in range(20)]
+        self.assertTrue(all(0 <= d <= 5 for d in delays))
+        self.assertLess(max(delays[:20]), 1)
+        self.assertGreater(max(delays[-20:]), 1)
+
+
+if __name__ == '__main__': 
+    unittest.main()
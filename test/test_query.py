@@ -20,7 +20,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import unittest
-from requests import get
+from requests import get, Session
 
 from py3_modules.pubmed_scraping.pubmed_scraping import query
 
@@ -51,6 +51,44 @@ class KeyWordQueryTest(unittest.TestCase):
         self.assertIsInstance(url, str) 
         self.assertIs(method, get) 
 
+class SessionTest(unittest.TestCase): 
+    def setUp(self): 
+        self.session = query.make_session(pool_size=4)
+    
+    def test_session_functions(self): 
+        kw_query = query.KeyWordQuery(session=self.session)
+        self.assertIsInstance(self.session, Session)
+        self.assertEqual(kw_query.req_function, self.session.get)
+        uid_query = query.UIDQuery(session=self.session)
+        self.assertEqual(uid_query.req_function, self.session.post)
+        uid_query.ret_max = 100
+        self.assertEqual(uid_query.req_function, self.session.get)
+    
+    def test_pool_size(self): 
+        adapter = self.session.get_adapter('https://eutils.ncbi.nlm.nih.gov')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertIn('gzip', self.session.headers['Accept-Encoding'])
+
+class HistoryTest(unittest.TestCase): 
+    def test_kw_use_history(self): 
+        kw_query = query.KeyWordQuery()
+        self.assertFalse(kw_query.use_history)
+        kw_query.use_history = True
+        self.assertEqual(kw_query.fields['usehistory'], 'y')
+        kw_query.use_history = False
+        self.assertNotIn('usehistory', kw_query.fields)
+    
+    def test_uid_load_history(self): 
+        uid_query = query.UIDQuery()
+        uid_query.load_history('MCID_abc', 1)
+        self.assertTrue(uid_query.use_history)
+        self.assertFalse(query.UIDQuery().use_history)
+        fields = uid_query.request_fields()
+        self.assertEqual(fields['WebEnv'], 'MCID_abc')
+        self.assertEqual(fields['query_key'], '1')
+        self.assertNotIn('id', fields)
+        self.assertIs(uid_query.req_function, get)
+
 class UIDQueryTest(unittest.TestCase):
     def setUp(self):
         self.test_uid = [b'28852740',b'29350911']
@@ -58,7 +96,9 @@ class UIDQueryTest(unittest.TestCase):
         self.query.load(terms=self.test_uid)
 
     def test_kw_load(self): 
-        self.assertIsInstance(self.query.search_terms, list)
+        self.assertIsInstance(self.query.search_terms, query.UIDArray)
+        self.assertEqual(self.query.search_terms.tolist(), 
+                         [28852740, 29350911])
 
     def test_uid_terms(self): 
         saveable = self.query.search_terms.saveable_format
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from unittest import mock
+import tempfile
+import os
+import h5py
+
+from py3_modules.pubmed_scraping.pubmed_scraping import sharding, synthetic, \
+                                                         limiter, storage, \
+                                                         soups, pipeline
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+def summary_pmids(corpus, uids): 
+    raw = corpus.efetch(uids)
+    return sorted(int(r.uid) for r in soups.SummarySoup(
+            raw.decode('utf-8')).records())
+
+
+class MergeUIDsTest(unittest.TestCase): 
+    def test_split_uids(self): 
+        uid_lists = [[b'3', b'1'], [b'1', b'2'], [b'3'], [b'4']]
+        merged = sharding.merge_uids(uid_lists, n=3)
+        self.assertEqual([uids.tolist() for uids 
+                          in sharding.split_uids(uid_lists, merged)], 
+                         [[3, 1], [2], [], []])
+
+    def test_duplicates_keep_first_occurrence(self): 
+        merged = sharding.merge_uids([[b'3', b'1'], [b'1', b'2'], [b'3']])
+        self.assertEqual(merged.tolist(), [3, 1, 2])
+
+    def test_n(self): 
+        merged = sharding.merge_uids([[b'3', b'1'], [b'1', b'2']], n=2)
+        self.assertEqual(merged.tolist(), [3, 1])
+
+
+class ShardedPipelineTest(unittest.TestCase): 
+    def _pipeline(self, stub, terms, cap, **kwargs): 
+        pipe = sharding.ShardedPipeline(terms, cap=cap,
+                                        limiter=limiter.TokenBucket(rate=1000),
+                                        **kwargs)
+        pipe.set_base_urls(stub.base_urls)
+        return pipe
+
+    def test_harvests_more_than_cap(self): 
+        corpus = synthetic.SyntheticCorpus(3000)
+        with EutilsSimulator(corpus) as stub, \
+             tempfile.TemporaryDirectory() as folder: 
+            pipe = self._pipeline(stub, [[b'author', b'shteyn']], cap=400)
+            pipe.request(1e6, save_folder=folder, layout='columns')
+
+            retmax = [int(params['retmax']) for _, path, params in stub.log
+                      if path.endswith('esearch.fcgi')]
+            self.assertLessEqual(max(retmax), 400)
+            path = os.path.join(folder, storage.COLUMNS_FILENAME)
+            with storage.ColumnarReader(path) as reader: 
+                self.assertEqual(sorted(reader.pmids.tolist()),
+                                 summary_pmids(corpus, corpus.uids()))
+            with h5py.File(os.path.join(folder, 'uids.h5'), 'r') as f: 
+                self.assertEqual(len(f['uid']), 3000)
+
+    def test_incremental(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            for size in (800, 1500): 
+                with EutilsSimulator(synthetic.SyntheticCorpus(size)) as stub: 
+                    pipe = self._pipeline(stub, [[b'author', b'shteyn']], 
+                                          cap=400)
+                    pipe.request(1e6, save_folder=folder, incremental=True)
+                    requested = [uid for t, path, params in stub.log 
+                                 if path.endswith('efetch.fcgi') 
+                                 for uid in params['id'].split(',')]
+            self.assertEqual(len(requested), 700)
+            self.assertEqual(len(storage.known_pmids(folder)), 1500)
+
+    def test_resume(self): 
+        corpus = synthetic.SyntheticCorpus(3000)
+        mark = pipeline.Checkpoint.mark
+        def stop_after_first(checkpoint, *window): 
+            # the run stops after its second shard is saved, but before 
+            # it's marked 
+            if os.path.exists(checkpoint.path): 
+                raise RuntimeError('stopped')
+            mark(checkpoint, *window)
+        
+        requested = []
+        with tempfile.TemporaryDirectory() as folder: 
+            for patch in (True, False): 
+                with EutilsSimulator(corpus) as stub, \
+                     mock.patch.object(pipeline.Checkpoint, 'mark', 
+                                       stop_after_first if patch else mark): 
+                    pipe = self._pipeline(stub, [[b'author', b'shteyn']], 
+                                          cap=400, max_in_flight=1)
+                    try: 
+                        pipe.request(1e6, save_folder=folder, 
+                                     layout='columns')
+                    except RuntimeError: 
+                        self.assertTrue(patch)
+                    requested.append([uid for t, path, params in stub.log 
+                                      if path.endswith('efetch.fcgi') 
+                                      for uid in params['id'].split(',')])
+            path = os.path.join(folder, storage.COLUMNS_FILENAME)
+            with storage.ColumnarReader(path) as reader: 
+                pmids = reader.pmids.tolist()
+        first, second = requested
+        self.assertGreater(len(first), 0)
+        self.assertEqual(set(first) & set(second), set())
+        self.assertEqual(sorted(int(uid) for uid in first + second), 
+                         corpus.uids())
+        self.assertEqual(sorted(pmids), summary_pmids(corpus, corpus.uids()))
+
+    def test_start_over(self): 
+        corpus = synthetic.SyntheticCorpus(1500)
+        with tempfile.TemporaryDirectory() as folder: 
+            for resume in (True, False): 
+                with EutilsSimulator(corpus) as stub: 
+                    pipe = self._pipeline(stub, [[b'author', b'shteyn']], 
+                                          cap=400)
+                    pipe.request(1e6, save_folder=folder, resume=resume)
+                    efetches = [path for t, path, params in stub.log 
+                                if path.endswith('efetch.fcgi')]
+                self.assertGreater(len(efetches), 0)
+            with h5py.File(os.path.join(folder, storage.GROUPS_FILENAME), 
+                           'r') as f: 
+                pmids = sorted(int(name) for name in f.keys())
+        self.assertEqual(pmids, summary_pmids(corpus, corpus.uids()))
+
+    def test_shards_are_under_cap(self): 
+        corpus = synthetic.SyntheticCorpus(3000)
+        with EutilsSimulator(corpus) as stub: 
+            pipe = self._pipeline(stub, [[b'author', b'shteyn'],
+                                         [b'mindate', b'2000'],
+                                         [b'maxdate', b'2009']], cap=150)
+            shards = pipe.request_shards()
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(0 < s.count <= 150 for s in shards))
+        self.assertEqual(sum(s.count for s in shards), 1000)
+        for prev, shard in zip(shards, shards[1:]): 
+            self.assertLess(prev.maxdate, shard.mindate)
+
+    def test_single_day_over_cap_is_truncated(self): 
+        # articles 0, 420, 840, ... are all published on 1990/01/01
+        corpus = synthetic.SyntheticCorpus(3000)
+        with EutilsSimulator(corpus) as stub: 
+            pipe = self._pipeline(stub, [[b'author', b'shteyn'],
+                                         [b'mindate', b'1990/01/01'],
+                                         [b'maxdate', b'1990/01/01']], cap=5)
+            shards = pipe.request_shards()
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(shards[0].count, 8)
+
+
+if __name__ == '__main__': 
+    unittest.main()
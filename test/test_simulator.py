@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import os
+import requests
+
+from py3_modules.pubmed_scraping.pubmed_scraping import simulator, synthetic, \
+                                                         pipeline, limiter, \
+                                                         storage, soups
+
+TERMS = [[b'author', b'shteyn']]
+
+
+class EutilsSimulatorTest(unittest.TestCase): 
+    def setUp(self): 
+        self.corpus = synthetic.SyntheticCorpus(100)
+
+    def _get(self, sim, url, **params): 
+        return requests.get(url, params=params)
+
+    def test_rate_limit(self): 
+        with simulator.EutilsSimulator(self.corpus, rate_limit=2, 
+                                       api_key_rate_limit=3) as sim: 
+            statuses = [self._get(sim, sim.esearch_url).status_code 
+                        for _ in range(4)]
+            response = self._get(sim, sim.esearch_url)
+            keyed = [self._get(sim, sim.esearch_url, 
+                               api_key='key').status_code 
+                     for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 429, 429])
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(response.json()['error'], 'API rate limit exceeded')
+        self.assertEqual(keyed, [200, 200, 200, 429])
+        self.assertEqual(sim.statuses, {200: 5, 429: 4})
+
+    def test_ncbi_limits(self): 
+        sim = simulator.EutilsSimulator.ncbi(self.corpus)
+        self.assertEqual(sim.server.rate_limit, limiter.NCBI_RATE)
+        self.assertEqual(sim.server.api_key_rate_limit, 
+                         limiter.NCBI_RATE_API_KEY)
+        sim.server.server_close()
+
+    def test_error_rate(self): 
+        with simulator.EutilsSimulator(self.corpus, error_rate=0.5, 
+                                       error_statuses=(502, 429), 
+                                       seed=1) as sim: 
+            statuses = [self._get(sim, sim.esearch_url).status_code 
+                        for _ in range(40)]
+        self.assertEqual(set(statuses), {200, 429, 502})
+        self.assertEqual(len(sim.log), 40)
+#        the same seed fails the same requests
+        with simulator.EutilsSimulator(self.corpus, error_rate=0.5, 
+                                       error_statuses=(502, 429), 
+                                       seed=1) as sim: 
+            self.assertEqual([self._get(sim, sim.esearch_url).status_code 
+                              for _ in range(40)], statuses)
+
+    def test_databases(self): 
+        uids = ','.join(str(uid) for uid in self.corpus.uids(0, 5))
+        with simulator.EutilsSimulator(self.corpus) as sim: 
+            protein = self._get(sim, sim.efetch_url, db='protein', id=uids)
+            gene = self._get(sim, sim.efetch_url, db='gene', id=uids)
+            unknown = self._get(sim, sim.efetch_url, db='nuccore', id=uids)
+        self.assertEqual(len(list(soups.ProteinSoup(
+                protein.content).records())), 5)
+        self.assertEqual(len(list(soups.GeneSoup(gene.content).records())), 
+                         5)
+        self.assertEqual(unknown.status_code, 400)
+
+    def test_pipeline_recovers_from_rate_limit(self): 
+#        the client sends requests faster than the server accepts them
+        corpus = synthetic.SyntheticCorpus(2000)
+        with simulator.EutilsSimulator(corpus, rate_limit=3, 
+                                       latency=0.01) as sim, \
+             tempfile.TemporaryDirectory() as folder: 
+            pipe = pipeline.AsyncPipeline(
+                    TERMS, limiter=limiter.TokenBucket(rate=50), 
+                    retry=limiter.RetryPolicy(backoff=0.01, seed=0))
+            pipe.set_base_urls(sim.base_urls)
+            pipe.request(2000, save_folder=folder, layout='columns')
+            with storage.ColumnarReader(os.path.join(
+                    folder, storage.COLUMNS_FILENAME)) as reader: 
+                n_saved = len(reader.pmids)
+        self.assertGreater(sim.statuses.get(429, 0), 0)
+        self.assertEqual(n_saved, len(list(soups.FastSummarySoup(
+                corpus.efetch(corpus.uids())).records())))
+
+
+if __name__ == '__main__': 
+    unittest.main()
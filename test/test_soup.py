@@ -20,11 +20,240 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import unittest
+import tempfile
+import os
+import h5py
+from bs4 import Tag
 
-from py3_modules.pubmed_scraping.pubmed_scraping import soups
+from py3_modules.pubmed_scraping.pubmed_scraping import soups, synthetic
 
 
 #https://stackoverflow.com/questions/11399148/how-to-mock-an-http-request-in-a-unit-testing-scenario-in-python
 
 class SimpleUIDSoupTest(unittest.TestCase): 
-    pass 
\ No newline at end of file
+    pass
+
+
+def find_all_fields(soup): 
+    """
+    Fields of every article the way each generator property used to find 
+    them, with one find_all per field. 
+    """
+    for article in soup: 
+        fields = {} 
+        for attr, tag_name in soups.summary_kwargs.items(): 
+            if isinstance(tag_name, dict): 
+                tag_name = tag_name.copy()
+                parents = tag_name.pop('parent', ())
+                if isinstance(parents, str): 
+                    parents = (parents,)
+                elements = [element for element in article.find_all(**tag_name) 
+                            if [p.name for p in element.parents][:len(parents)] 
+                               == list(reversed(parents))]
+                try: 
+                    fields[attr] = ' '.join([element.string for element in 
+                                    elements]).encode('utf-8')
+                except (AttributeError, TypeError): 
+                    fields[attr] = b''
+            elif isinstance(article, Tag): 
+                name, keys = tag_name[:2]
+                fields[attr] = {key: [c.string.encode('utf-8') for contents in 
+                                      article(name) for c in contents(key)] 
+                                for key in keys} 
+        yield fields 
+
+class SummarySoupTest(unittest.TestCase): 
+    def setUp(self): 
+        corpus = synthetic.SyntheticCorpus(100, references=3)
+        self.soup = soups.SummarySoup(corpus.efetch(corpus.uids()).decode('utf-8'))
+    
+    def test_same_as_find_all(self): 
+        expected = list(find_all_fields(self.soup))
+        self.assertGreater(len(expected), 0)
+        for attr in self.soup._data_attrs: 
+            self.assertEqual([fields[attr] for fields in expected], 
+                             list(self.soup.__getattribute__(attr)))
+    
+    def test_records(self): 
+        records = list(self.soup.records())
+        self.assertEqual(records, 
+                         [soups.SummaryRecord(*info) for info in 
+                          zip(*[self.soup.__getattribute__(attr) for 
+                                attr in self.soup._data_attrs])])
+        self.assertIs(self.soup._extracted, self.soup._extracted)
+    
+    def test_ids_not_from_references(self): 
+        for record in self.soup.records(): 
+            self.assertTrue(record.uid.isdigit())
+            self.assertEqual(len(record.doi.split()), 1)
+            self.assertEqual(len(record.pmc.split()), 1)
+    
+    def test_save(self): 
+        records = list(self.soup.records())
+        with tempfile.TemporaryDirectory() as folder: 
+            self.soup.save(folder)
+            with h5py.File(os.path.join(folder, 'pubmed_summary.h5'), 'r') as f: 
+                self.assertEqual(len(f), len(records))
+                grp = f[records[0].uid.decode('utf-8')]
+                self.assertEqual(grp['title'][()], records[0].title)
+                self.assertEqual(list(grp['authors']['lastname'][()]), 
+                                 records[0].authors['lastname'])
+
+class UIDSoupTest(unittest.TestCase): 
+    def test_uid(self): 
+        corpus = synthetic.SyntheticCorpus(30)
+        soup = soups.UIDSoup(corpus.esearch(0, 20).decode('utf-8'))
+        uids = corpus.uids(0, 20)
+        self.assertIsInstance(soup.uid, soups.UIDArray)
+        self.assertEqual(soup.uid.tolist(), uids)
+        self.assertEqual(list(soup._uid), 
+                         [{'id': [str(uid).encode('utf-8') for uid in uids]}])
+
+
+# esearch response the way NCBI writes it when there are no results to list
+NCBI_COUNT_ONLY = b'''<?xml version="1.0" encoding="UTF-8" ?>
+<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">
+<eSearchResult><Count>2093</Count><RetMax>0</RetMax><RetStart>0</RetStart><QueryKey>1</QueryKey><WebEnv>MCID_5c3e5f6f</WebEnv><IdList/><TranslationSet/><TranslationStack>   <TermSet>    <Term>shteyn[Author]</Term>    <Field>Author</Field>    <Count>12</Count>    <Explode>N</Explode>   </TermSet>   <TermSet>    <Term>autophagy[All Fields]</Term>    <Field>All Fields</Field>    <Count>2081</Count>    <Explode>N</Explode>   </TermSet>   <OP>OR</OP>  </TranslationStack><QueryTranslation>shteyn[Author] OR autophagy[All Fields]</QueryTranslation></eSearchResult>
+'''
+
+class FastUIDSoupTest(unittest.TestCase): 
+    attrs = ('uid', 'count', 'ret_start', 'ret_max', 'web_env', 'query_key')
+    
+    def assertSameAsUIDSoup(self, raw): 
+        expected = soups.UIDSoup(raw.decode('utf-8'))
+        for result in (soups.FastUIDSoup(raw), 
+                       soups.FastUIDSoup(raw.decode('utf-8'))): 
+            for attr in self.attrs: 
+                self.assertEqual(getattr(result, attr), getattr(expected, attr), 
+                                 attr)
+    
+    def test_same_as_uid_soup(self): 
+        corpus = synthetic.SyntheticCorpus(1000)
+        self.assertSameAsUIDSoup(corpus.esearch(0, 1000))
+        self.assertSameAsUIDSoup(corpus.esearch(250, 500, web_env='NCBI_1', 
+                                                query_key=3))
+        self.assertSameAsUIDSoup(corpus.esearch(0, 0))
+        self.assertSameAsUIDSoup(NCBI_COUNT_ONLY)
+    
+    def test_uid_array(self): 
+        corpus = synthetic.SyntheticCorpus(30)
+        soup = soups.FastUIDSoup(corpus.esearch(0, 20))
+        self.assertIsInstance(soup.uid, soups.UIDArray)
+        self.assertEqual(soup.uid.tolist(), corpus.uids(0, 20))
+        self.assertEqual(soups.FastUIDSoup(NCBI_COUNT_ONLY).count, 2093)
+    
+    def test_save(self): 
+        corpus = synthetic.SyntheticCorpus(30)
+        self.assertSavedSameAsUIDSoup(corpus.esearch(0, 20))
+    
+    def test_save_unescapes_terms(self): 
+        corpus = synthetic.SyntheticCorpus(30)
+        raw = corpus.esearch(0, 20).replace(
+                b'synthetic[All Fields]', 
+                b'&quot;cell death&quot; &amp; autophagy&#39;s[All Fields]')
+        saved = self.assertSavedSameAsUIDSoup(raw)
+        self.assertIn('"cell death" & autophagy\'s[All Fields]', saved)
+    
+    def assertSavedSameAsUIDSoup(self, raw): 
+        saved = []
+        for soup in (soups.UIDSoup(raw.decode('utf-8')), soups.FastUIDSoup(raw)): 
+            with tempfile.TemporaryDirectory() as folder: 
+                soup.save(folder)
+                with h5py.File(os.path.join(folder, 'uids.h5'), 'r') as f: 
+                    saved.append((f['uid'][()].tolist(), 
+                                  list(f.attrs['search_terms'])))
+        self.assertEqual(saved[0], saved[1])
+        return saved[0][1]
+
+
+class FastSummarySoupTest(unittest.TestCase): 
+    def setUp(self): 
+        corpus = synthetic.SyntheticCorpus(100, references=3)
+        self.raw = corpus.efetch(corpus.uids())
+    
+    def test_same_as_summary_soup(self): 
+        expected = soups.SummarySoup(self.raw.decode('utf-8'))
+        for result in (soups.FastSummarySoup(self.raw), 
+                       soups.FastSummarySoup(self.raw.decode('utf-8'))): 
+            self.assertEqual(list(result.records()), list(expected.records()))
+            for attr in expected._data_attrs: 
+                self.assertEqual(list(getattr(result, attr)), 
+                                 list(getattr(expected, attr)), attr)
+        self.assertEqual(list(soups.FastSummarySoup(b'').records()), [])
+    
+    def test_compiled_once_per_class(self): 
+        self.assertIsInstance(soups.FastSummarySoup._extractor, 
+                              soups.XPathExtractor)
+        self.assertIsInstance(soups.SummarySoup._extractor, 
+                              soups.FieldExtractor)
+        self.assertIs(soups.FastSummarySoup(self.raw)._extractor, 
+                      soups.FastSummarySoup._extractor)
+    
+    def test_save(self): 
+        records = list(soups.FastSummarySoup(self.raw).records())
+        with tempfile.TemporaryDirectory() as folder: 
+            soups.FastSummarySoup(self.raw).save(folder)
+            with h5py.File(os.path.join(folder, 'pubmed_summary.h5'), 'r') as f: 
+                self.assertEqual(len(f), len(records))
+
+class XPathExtractorTest(unittest.TestCase): 
+    def test_spec(self): 
+        from lxml import etree
+        extractor = soups.XPathExtractor({
+                'title': 'Title', 
+                'quoted': {'name': 'Id', 'Type': "it's"}, 
+                'doi': {'Type': 'doi'}, 
+                'mixed': 'Mixed', 
+                'authors': ('Author', {'last': 'Last', 'first': 'First'})})
+        article = etree.fromstring(
+                b'<A><Title>one</Title><Id Type="it\'s">x</Id>'
+                b'<Id Type="doi">10.1/2</Id><Mixed>a<b/>c</Mixed>'
+                b'<Author><Last>Doe</Last><First>Jo</First></Author>'
+                b'<Author><Last>Roe</Last></Author><title>no</title></A>')
+        self.assertEqual(extractor.extract(article), 
+                         {'title': b'one', 'quoted': b'x', 'doi': b'10.1/2', 
+                          'mixed': b'', 
+                          'authors': {'last': [b'Doe', b'Roe'], 
+                                      'first': [b'Jo']}})
+
+class ProteinSoupTest(unittest.TestCase): 
+    def test_records(self): 
+        corpus = synthetic.SyntheticCorpus(20)
+        soup = soups.ProteinSoup(corpus.protein_efetch(corpus.uids()))
+        records = list(soup.records())
+        self.assertEqual(len(records), 20)
+        for uid, record in zip(corpus.uids(), records): 
+            self.assertIsInstance(record, soups.ProteinRecord)
+            self.assertTrue(record.uid.startswith(record.locus + b'.'))
+            self.assertEqual(int(record.length), len(record.sequence))
+            self.assertEqual(record.moltype, b'AA')
+            self.assertIn(record.organism, record.definition)
+            self.assertEqual(record.references['pubmed'], 
+                             [str(uid).encode('utf-8')])
+            self.assertEqual(record.seqids['seqid'][0], 
+                             b'ref|' + record.uid + b'|')
+            self.assertEqual(record.features['key'][0], b'Protein')
+            self.assertEqual(len(record.features['key']), 
+                             len(record.features['location']))
+        self.assertEqual(list(soup.uid), [r.uid for r in records])
+
+class GeneSoupTest(unittest.TestCase): 
+    def test_records(self): 
+        corpus = synthetic.SyntheticCorpus(20)
+        records = list(soups.GeneSoup(corpus.gene_efetch(
+                corpus.uids())).records())
+        self.assertEqual([int(r.uid) for r in records], corpus.uids())
+        for record in records: 
+            self.assertIsInstance(record, soups.GeneRecord)
+            self.assertTrue(record.symbol)
+            self.assertEqual(record.proteins['name'], 
+                             [record.description + b' protein'])
+            self.assertTrue(record.summary.endswith(b'.'))
+            self.assertRegex(record.location, rb'^\d+q\d+$')
+            for synonym in record.synonyms['synonym']: 
+                self.assertEqual(synonym[:3], record.symbol[:3])
+        self.assertTrue(any(r.synonyms['synonym'] for r in records))
+
+
+if __name__ == '__main__': 
+    unittest.main() 
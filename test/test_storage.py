@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import os
+import h5py
+
+from py3_modules.pubmed_scraping.pubmed_scraping import storage, stream, \
+                                                         soups, synthetic
+
+
+class ColumnarTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        corpus = synthetic.SyntheticCorpus(300)
+        self.batches = [list(stream.iter_summaries(corpus.efetch(
+                                corpus.uids(start, 100)))) 
+                        for start in (0, 100, 200)]
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def test_round_trip(self): 
+        for batch in self.batches: 
+            with storage.ColumnarWriter(self.path, chunk_size=64) as writer: 
+                writer.append(batch)
+        records = [r for batch in self.batches for r in batch]
+        with storage.ColumnarReader(self.path) as reader: 
+            self.assertEqual(len(reader), len(records))
+            self.assertEqual([reader.row(i) for i in range(len(reader))], 
+                             records)
+            for record in records[::7]: 
+                self.assertEqual(reader[int(record.uid)], record)
+            self.assertNotIn(1, reader)
+            self.assertRaises(KeyError, reader.__getitem__, 1)
+    
+    def test_summary_soup_save(self): 
+        corpus = synthetic.SyntheticCorpus(50)
+        soup = soups.SummarySoup(corpus.efetch(corpus.uids()).decode('utf-8'))
+        soup.save(self.folder.name, layout='columns')
+        soup.save(self.folder.name, layout='columns')
+        records = list(soup.records())
+        with storage.ColumnarReader(self.path) as reader: 
+            self.assertEqual(len(reader), 2*len(records))
+            self.assertEqual(reader.row(len(records)), records[0])
+        self.assertRaises(ValueError, soup.save, self.folder.name, 'rows')
+
+
+class GroupWriterTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, storage.GROUPS_FILENAME)
+        corpus = synthetic.SyntheticCorpus(40)
+        self.first = list(stream.iter_summaries(corpus.efetch(corpus.uids(0, 20))))
+        self.second = list(stream.iter_summaries(corpus.efetch(corpus.uids(20, 20))))
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def test_duplicate_batch_not_written(self): 
+        with storage.GroupWriter(self.path) as writer: 
+            writer.append(self.first)
+            # the last article is already stored, so none of them are 
+            self.assertRaises(ValueError, writer.append, 
+                              self.second + self.first[-1:])
+        self.assertEqual(len(storage.known_pmids(self.folder.name)), 
+                         len(self.first))
+    
+    def test_interrupted_write_cleaned_up(self): 
+        with storage.GroupWriter(self.path) as writer: 
+            writer.append(self.first)
+        with h5py.File(self.path, 'a') as f: 
+            f.create_group('_pending/{0}'.format(int(self.second[0].uid)))
+        with storage.GroupWriter(self.path) as writer: 
+            writer.append(self.second)
+        with h5py.File(self.path, 'r') as f: 
+            self.assertNotIn('_pending', f)
+            self.assertEqual(len(f), len(self.first) + len(self.second))
+    
+    def test_known_from_several_ids(self): 
+        # files written when a group's uid held its references' PMIDs too
+        with h5py.File(self.path, 'a') as f: 
+            for record in self.first: 
+                f.create_group('{0} 1 2'.format(int(record.uid)))
+        self.assertEqual(sorted(storage.known_pmids(self.folder.name)), 
+                         sorted(int(record.uid) for record in self.first))
+
+
+if __name__ == '__main__': 
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import os
+import numpy as np
+
+from py3_modules.pubmed_scraping.pubmed_scraping import store, storage, \
+                                                         stream, synthetic
+
+
+class BuildIndexTest(unittest.TestCase): 
+    def _lookup(self, keys, rows, pmid): 
+        bits = int(np.log2(len(keys)))
+        slot = store._slots([pmid], bits)[0]
+        while keys[slot] != 0: 
+            if keys[slot] == pmid: 
+                return rows[slot]
+            slot = (slot + 1) % len(keys)
+        return -1
+
+    def test_every_row_found(self): 
+        pmids = np.concatenate([np.arange(1, 5001), 
+                                np.random.RandomState(0).randint(1, 10**8, 5000)])
+        keys, rows = store.build_index(pmids)
+        self.assertGreaterEqual(len(keys), 2*len(pmids))
+        for i in range(0, len(pmids), 13): 
+            self.assertEqual(pmids[self._lookup(keys, rows, pmids[i])], pmids[i])
+
+    def test_duplicates_and_missing(self): 
+        keys, rows = store.build_index([7, 3, 7, 0])
+        self.assertEqual(self._lookup(keys, rows, 7), 0)
+        self.assertEqual(self._lookup(keys, rows, 3), 1)
+        self.assertEqual(self._lookup(keys, rows, 5), -1)
+        self.assertEqual(np.count_nonzero(keys), 3)
+
+
+class SummaryStoreTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, storage.COLUMNS_FILENAME)
+        self.corpus = synthetic.SyntheticCorpus(1200)
+        self._append(0, 1000)
+        with storage.ColumnarReader(self.path) as reader: 
+            self.records = [reader.row(i) for i in range(len(reader))]
+    
+    def tearDown(self): 
+        self.folder.cleanup()
+    
+    def _append(self, start, n): 
+        with storage.ColumnarWriter(self.path) as writer: 
+            for uid_start in range(start, start + n, 250): 
+                writer.append(stream.iter_summaries(self.corpus.efetch(
+                        self.corpus.uids(uid_start, 250))))
+    
+    def test_same_as_columnar_reader(self): 
+        with store.SummaryStore(self.folder.name) as summaries: 
+            self.assertEqual(len(summaries), len(self.records))
+            self.assertIsInstance(summaries.pmids, np.memmap)
+            self.assertEqual(list(summaries), self.records)
+            self.assertEqual(list(summaries.iter_rows(10, 20, chunk_size=3)), 
+                             self.records[10:20])
+            for record in self.records[::11]: 
+                self.assertEqual(summaries[int(record.uid)], record)
+            self.assertNotIn(1, summaries)
+            self.assertRaises(KeyError, summaries.__getitem__, 1)
+
+    def test_field_views(self): 
+        with store.SummaryStore(self.path) as summaries: 
+            titles = summaries.field('title', chunk_size=7)
+            self.assertEqual(list(titles), [r.title for r in self.records])
+            self.assertEqual(titles[-1], self.records[-1].title)
+            lastnames = summaries.field('authors', 'lastname')
+            self.assertEqual(lastnames[5:9], 
+                             [r.authors['lastname'] for r in self.records[5:9]])
+            self.assertEqual(lastnames[9:5], [])
+            self.assertRaises(KeyError, summaries.field, 'authors')
+
+    def test_index_persisted(self): 
+        store.SummaryStore(self.path).close()
+        # opening again doesn't need to build anything 
+        store.SummaryStore(self.path, build_index=False).close()
+        self._append(1000, 200)
+        self.assertRaises(IOError, store.SummaryStore, self.path, 
+                          build_index=False)
+        with store.SummaryStore(self.path) as summaries: 
+            last = summaries.row(len(summaries) - 1)
+            self.assertEqual(summaries.find(int(last.uid)), len(summaries) - 1)
+
+    def test_index_rebuilt_in_place(self): 
+        summaries = store.SummaryStore(self.path)
+        summaries.close()
+        size = os.path.getsize(self.path)
+        for _ in range(10): 
+            summaries._build_index()
+        self.assertEqual(os.path.getsize(self.path), size)
+        self._append(1000, 200)
+        with store.SummaryStore(self.path) as summaries: 
+            self.assertGreater(len(summaries), len(self.records))
+            self.assertEqual(len(summaries.pmids), len(summaries))
+            for i in range(0, len(summaries), 7): 
+                self.assertEqual(summaries.find(summaries.pmids[i]), i)
+
+    def test_convert_groups(self): 
+        with tempfile.TemporaryDirectory() as folder: 
+            with storage.GroupWriter(os.path.join(
+                    folder, storage.GROUPS_FILENAME)) as writer: 
+                writer.append(self.records[:300])
+            self.assertEqual(store.convert_groups(folder, chunk_size=100), 300)
+            with store.SummaryStore(folder) as summaries: 
+                self.assertEqual(list(summaries), self.records[:300])
+
+
+if __name__ == '__main__': 
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import io
+
+from py3_modules.pubmed_scraping.pubmed_scraping import stream, soups, \
+                                                         synthetic
+
+# structured abstract, inline markup in the title, no grants and no PMC ID
+ODD_ARTICLE = b'''<?xml version="1.0" ?>
+<PubmedArticleSet>
+<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM">
+<PMID Version="1">29350911</PMID><Article PubModel="Print">
+<Journal><JournalIssue><PubDate><Year>2018</Year><Month>Jan</Month></PubDate>
+</JournalIssue><ISOAbbreviation>Mol Cell</ISOAbbreviation></Journal>
+<ArticleTitle>Role of <i>ATG9</i> in autophagy.</ArticleTitle>
+<Abstract><AbstractText Label="BACKGROUND">First part.</AbstractText>
+<AbstractText Label="RESULTS">Second part.</AbstractText></Abstract>
+<AuthorList><Author><LastName>Shteyn</LastName><ForeName>Vladimir</ForeName>
+</Author></AuthorList></Article></MedlineCitation>
+<PubmedData><ArticleIdList><ArticleId IdType="pubmed">29350911</ArticleId>
+<ArticleId IdType="doi">10.1016/j.molcel.2018.01.001</ArticleId>
+</ArticleIdList></PubmedData></PubmedArticle>
+</PubmedArticleSet>
+'''
+
+
+def soup_records(raw): 
+    soup = soups.SummarySoup(raw.decode('utf-8'))
+    return [soups.SummaryRecord(*info) for info in
+            zip(*[soup.__getattribute__(attr) for attr in soup._data_attrs])]
+
+
+class IterSummariesTest(unittest.TestCase): 
+    def test_same_as_summary_soup(self): 
+        corpus = synthetic.SyntheticCorpus(200, references=3)
+        raw = corpus.efetch(corpus.uids())
+        expected = soup_records(raw)
+        result = list(stream.iter_summaries(raw))
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(expected, result)
+
+    def test_odd_article(self): 
+        expected = soup_records(ODD_ARTICLE)
+        result = list(stream.iter_summaries(ODD_ARTICLE))
+        self.assertEqual(expected, result)
+        record = result[0]
+        self.assertEqual(record.abstract, b'First part. Second part.')
+        self.assertEqual(record.title, b'')
+        self.assertEqual(record.pmc, b'')
+        self.assertEqual(record.grant, {'grantid': [], 'agency': []})
+
+    def test_file_like_source(self): 
+        corpus = synthetic.SyntheticCorpus(20)
+        raw = corpus.efetch(corpus.uids())
+        self.assertEqual(list(stream.iter_summaries(raw)),
+                         list(stream.iter_summaries(io.BytesIO(raw))))
+
+
+if __name__ == '__main__': 
+    unittest.main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+import tempfile
+import math
+import os
+from collections import Counter
+
+from py3_modules.pubmed_scraping.pubmed_scraping import text_index, storage, \
+                                                         stream, synthetic, \
+                                                         pipeline, limiter
+from py3_modules.pubmed_scraping.pubmed_scraping.simulator import \
+        EutilsSimulator
+
+
+def brute_force_bm25(records, text, k1=1.2, b=0.75): 
+    docs = [Counter(text_index.tokenize(r.title) 
+                    + text_index.tokenize(r.abstract)) for r in records]
+    lengths = [sum(d.values()) for d in docs]
+    avg = max(1., sum(lengths)/len(lengths))
+    scores = {}
+    for term in set(text_index.tokenize(text)): 
+        df = sum(1 for d in docs if term in d)
+        idf = math.log(1 + (len(docs) - df + 0.5)/(df + 0.5))
+        for r, d, length in zip(records, docs, lengths): 
+            if term in d: 
+                tf = d[term]
+                scores[int(r.uid)] = scores.get(int(r.uid), 0) + \
+                        idf*tf*(k1 + 1)/(tf + k1*(1 - b + b*length/avg))
+    return scores
+
+
+class TokenizeTest(unittest.TestCase): 
+    def test_words(self): 
+        self.assertEqual(text_index.tokenize(b'Golgi-apparatus, 2 Cells.'), 
+                         [b'golgi', b'apparatus', b'2', b'cells'])
+
+    def test_long_terms_are_cut(self): 
+        term, = text_index.tokenize('a'*100)
+        self.assertEqual(len(term), text_index.MAX_TERM_LENGTH)
+
+
+class TextIndexTest(unittest.TestCase): 
+    def setUp(self): 
+        self.folder = tempfile.TemporaryDirectory()
+        corpus = synthetic.SyntheticCorpus(600)
+        self.records = list(stream.iter_summaries(corpus.efetch(
+                corpus.uids())))
+        self.batches = [self.records[i:i + 50] 
+                        for i in range(0, len(self.records), 50)]
+        self.index = text_index.TextIndex(self.folder.name)
+        for batch in self.batches: 
+            self.index.add(batch)
+        self.words = text_index.tokenize(self.records[3].title)
+
+    def tearDown(self): 
+        self.index.close()
+        self.folder.cleanup()
+
+    def _check_search(self, index): 
+        for query in (b' '.join(self.words[:3]), self.words[-1], 
+                      self.records[10].abstract[:60]): 
+            expected = brute_force_bm25(self.records, query)
+            result = index.search(query, k=10)
+            best = sorted(expected.values(), reverse=True)[:10]
+            self.assertEqual(len(result), min(10, len(expected)))
+            for (pmid, score), expected_score in zip(result, best): 
+                self.assertAlmostEqual(score, expected[pmid])
+                self.assertAlmostEqual(score, expected_score)
+
+    def test_search(self): 
+        self._check_search(self.index)
+        self.assertEqual(self.index.search('notaword'), [])
+
+    def test_segments_are_merged(self): 
+        self.assertEqual(len(self.index), len(self.records))
+        self.assertLessEqual(len(self.index._segments), 
+                             math.log2(len(self.batches)) + 1)
+        self.index.merge()
+        self.assertEqual(len(self.index._segments), 1)
+        self._check_search(self.index)
+        self.assertEqual(len(os.listdir(self.index.path)), 2)
+
+    def test_match(self): 
+        a, b, c = self.words[:3]
+        def having(word): 
+            return set(int(r.uid) for r in self.records if word in 
+                       text_index.tokenize(r.title) 
+                       + text_index.tokenize(r.abstract))
+        everything = set(int(r.uid) for r in self.records)
+        queries = {
+            '{0} {1}'.format(a.decode(), b.decode()): having(a) & having(b), 
+            '{0} AND {1}'.format(a.decode(), b.decode()): having(a) & having(b),
+            '{0} OR {1}'.format(a.decode(), b.decode()): having(a) | having(b),
+            '{0} NOT {1}'.format(a.decode(), b.decode()): having(a) - having(b),
+            'NOT {0}'.format(a.decode()): everything - having(a), 
+            '({0} OR {1}) {2}'.format(a.decode(), b.decode(), c.decode()): 
+                (having(a) | having(b)) & having(c), 
+        }
+        for query, expected in queries.items(): 
+            result = self.index.match(query)
+            self.assertEqual(set(result.tolist()), expected, query)
+            self.assertEqual(result.tolist(), sorted(result.tolist()))
+        self.assertEqual(len(self.index.match('notaword')), 0)
+        for query in ('a OR', '(a b', 'a )'): 
+            with self.assertRaises(ValueError): 
+                self.index.match(query)
+
+    def test_reopen_and_duplicates(self): 
+        self.index.close()
+        self.index = text_index.TextIndex(self.folder.name)
+        self.assertEqual(self.index.pmids.tolist(), 
+                         [int(r.uid) for r in self.records])
+        self.assertEqual(self.index.add(self.batches[0]), 0)
+        self.assertEqual(self.index.add(self.batches[0] + self.batches[0]), 0)
+        self._check_search(self.index)
+
+    def test_no_text(self): 
+#        e.g. a title and an abstract with inline markup, read as b'' 
+        empty = self.records[0]._replace(uid=b'1', title=b'', abstract=b'')
+        with text_index.TextIndex(os.path.join(self.folder.name, 'empty')) \
+                as index: 
+            self.assertEqual(index.add([empty]), 1)
+            self.assertEqual(index.add(self.batches[0]), len(self.batches[0]))
+            self.assertEqual(len(index._segments), 1)
+            self.assertEqual(index.pmids.tolist()[0], 1)
+            self.assertIn(1, index.match('NOT notaword').tolist())
+            self.assertNotIn(1, [pmid for pmid, score 
+                                 in index.search(self.words[0])])
+
+    def test_interrupted_add(self): 
+#        a segment file that never made it into the manifest is ignored 
+        segment = os.path.join(self.index.path, self.index._new_name())
+        with open(segment, 'wb') as f: 
+            f.write(b'partial')
+        self.index.close()
+        self.index = text_index.TextIndex(self.folder.name)
+        self.assertEqual(len(self.index), len(self.records))
+        self._check_search(self.index)
+
+
+class PipelineIndexTest(unittest.TestCase): 
+    def test_index_updated_as_batches_are_saved(self): 
+        corpus = synthetic.SyntheticCorpus(450)
+        with EutilsSimulator(corpus) as stub, \
+             tempfile.TemporaryDirectory() as folder: 
+            with text_index.TextIndex(folder) as index: 
+                pipe = pipeline.AsyncPipeline(
+                        [[b'author', b'shteyn']], indexes=[index], 
+                        limiter=limiter.TokenBucket(rate=1000))
+                pipe.set_base_urls(stub.base_urls)
+                pipe.request(450, save_folder=folder, layout='columns')
+                self.assertEqual(sorted(index.pmids.tolist()), 
+                                 sorted(storage.known_pmids(folder).tolist()))
+                self.assertGreater(len(index._segments), 0)
+            self.assertIn('index_seconds', pipe.metrics.snapshot()['histograms'])
+
+
+if __name__ == '__main__': 
+    unittest.main()
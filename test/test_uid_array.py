@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import tempfile
+import os
+import numpy as np
+
+from py3_modules.pubmed_scraping.pubmed_scraping import uid_array, query
+
+UIDArray = uid_array.UIDArray
+
+
+class UIDArrayTest(unittest.TestCase): 
+    def test_sources(self): 
+        expected = [28852740, 29350911]
+        for uids in ([b'28852740', b'29350911'], ['28852740', '29350911'], 
+                     expected, np.array(expected), b'28852740,29350911', 
+                     '28852740\n29350911', iter([b'28852740', b'29350911'])): 
+            result = UIDArray(uids)
+            self.assertEqual(result.array.dtype, np.uint64)
+            self.assertEqual(result.tolist(), expected)
+
+    def test_invalid_dropped(self): 
+        uids = UIDArray([b'1 2', b'', b'abc', b'3', b'-4'])
+        self.assertEqual(uids.tolist(), [12, 3])
+
+    def test_unique_keeps_order(self): 
+        uids = UIDArray([5, 3, 5, 1, 3])
+        self.assertEqual(uids.unique().tolist(), [5, 3, 1])
+
+    def test_difference(self): 
+        uids = UIDArray([5, 3, 9, 1])
+        self.assertEqual(uids.difference([3, 4, 1]).tolist(), [5, 9])
+        self.assertEqual(uids.difference([]).tolist(), [5, 3, 9, 1])
+
+    def test_batches(self): 
+        uids = UIDArray(range(1, 1201))
+        batches = list(uids.batches(500))
+        self.assertEqual([len(b) for b in batches], [500, 500, 200])
+        self.assertEqual(batches[1][0], 501)
+        self.assertTrue(np.shares_memory(batches[1].array, uids.array))
+
+    def test_formats(self): 
+        uids = UIDArray([28852740, 29350911])
+        self.assertEqual(uids.to_bytes(), b'28852740,29350911')
+        self.assertEqual(uids.to_str(), '28852740,29350911')
+        self.assertEqual(UIDArray.concatenate([uids, [1]]).tolist(), 
+                         [28852740, 29350911, 1])
+        self.assertIn(29350911, uids)
+        self.assertEqual(uids, [28852740, 29350911])
+
+
+class UIDQuerySaveTest(unittest.TestCase): 
+    def test_round_trip(self): 
+        uid_query = query.UIDQuery()
+        uid_query.load(terms=[b'28852740', b'29350911'])
+        with tempfile.TemporaryDirectory() as folder: 
+            for extension in ('txt', 'pkl', 'h5'): 
+                path = os.path.join(folder, 'uids.' + extension)
+                uid_query.save(path)
+                loaded = query.UIDQuery()
+                loaded.load(path=path)
+                self.assertEqual(loaded.search_terms.tolist(), 
+                                 [28852740, 29350911])
+
+
+if __name__ == '__main__': 
+    unittest.main()